@@ -3,11 +3,13 @@
 
 from argparse import ArgumentParser
 from calendar import isleap
-from cftime import utime
-from dateutil import rrule
-from datetime import datetime
 import numpy as np
 from netCDF4 import Dataset as NC
+from os.path import dirname, join, realpath
+import sys
+
+sys.path.append(join(realpath(dirname(__file__)), "../../resources"))
+from timeline import time_bounds, time_values
 
 # set up the option parser
 parser = ArgumentParser()
@@ -27,23 +29,19 @@ elif len(args) == 1:
 else:
     print("wrong number arguments, 0 or 1 arguments accepted")
     parser.print_help()
-    import sys
-
     sys.exit(0)
 
 start_year = 1980
 end_year = 2021
 time_calendar = "standard"
 time_units = f"days since {start_year}-1-1"
-cdftime = utime(time_units, time_calendar)
-bnds_datelist = list(rrule.rrule(rrule.DAILY, dtstart=datetime(start_year, 1, 1), until=datetime(end_year, 1, 1)))
-
-# calculate the days since refdate, including refdate, with time being the
-bnds_interval_since_refdate = cdftime.date2num(bnds_datelist)
+bnds_interval_since_refdate = time_bounds(
+    f"{start_year}-1-1", f"{end_year}-1-1", periodicity="daily", ref_date=f"{start_year}-1-1", calendar=time_calendar
+)
 
 # mid-point value:
 # time[n] = (bnds[n] + bnds[n+1]) / 2
-time_interval_since_refdate = bnds_interval_since_refdate[0:-1] + np.diff(bnds_interval_since_refdate) / 2
+time_interval_since_refdate = time_values(bnds_interval_since_refdate, "mid")
 
 nt = len(time_interval_since_refdate)
 
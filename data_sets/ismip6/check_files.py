@@ -1,25 +1,31 @@
 #!/usr/bin/env python
 # Copyright (C) 2019 Andy Aschwanden
 
-import pandas as pd
-import os
+# Check the input files of an ensemble without writing scripts, e.g.
+#
+#   python check_files.py prognostic_core -e ../../uncertainty_qunatification/prognostic_core.csv in.nc
+#
+# Runs the generator of the experiment with --preflight only, see
+# resources/preflight.py.
 
-csv_files = [
-    "../../uncertainty_qunatification/prognostic_core.csv",
-    "../../uncertainty_qunatification/prognostic_open.csv",
-]
+import shutil
+import sys
+import tempfile
+from os.path import dirname, join, realpath
 
+sys.path.append(join(realpath(dirname(__file__)), "../../resources"))
+from experiments import generate, list_experiments
 
-df = pd.read_csv(csv_files[0])
-for column in df["CLIMATE"]:
-    print("{}: {},".format(column, os.path.isfile(column)))
-for column in df["FRF"]:
-    print("{}: {},".format(column, os.path.isfile(os.path.join("../front_retreat", column))))
+if len(sys.argv) < 2 or sys.argv[1] not in list_experiments():
+    print("usage: check_files.py EXPERIMENT [generator options]")
+    print("EXPERIMENT is one of {}".format(", ".join(list_experiments())))
+    sys.exit(1)
 
-df = pd.read_csv(csv_files[1])
-for column in df["CLIMATE"]:
-    print("{}: {},".format(column, os.path.isfile(column)))
-for column in df["RU"]:
-    print("{}: {},".format(column, os.path.isfile(column)))
-for column in df["THETA"]:
-    print("{}: {},".format(column, os.path.isfile(column)))
+o_dir = tempfile.mkdtemp()
+try:
+    generate(sys.argv[1], sys.argv[2:] + ["--preflight", "only", "--o_dir", o_dir])
+except ValueError as e:
+    print(e)
+    sys.exit(1)
+finally:
+    shutil.rmtree(o_dir)
@@ -5,10 +5,10 @@
 # Jakobshavn Fjord
 # for Fjord and Bay measurements
 
-from cftime import utime
-from dateutil import rrule
 from datetime import datetime
 from netCDF4 import Dataset as NC
+from os.path import dirname, join, realpath
+import sys
 import gpytorch
 import torch
 import numpy as np
@@ -21,6 +21,9 @@ from pytorch_lightning.callbacks.early_stopping import EarlyStopping
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from pytorch_lightning.loggers import TensorBoardLogger
 
+sys.path.append(join(realpath(dirname(__file__)), "../../resources"))
+from timeline import time_bounds, time_values
+
 torch.manual_seed(0)
 np.random.seed(0)
 
@@ -400,7 +403,6 @@ if __name__ == "__main__":
 
     calendar = "standard"
     units = "days since 1980-1-1"
-    cdftime_days = utime(units, calendar)
 
     # create list with dates from start_date until end_date with
     # periodicity prule for netCDF file
@@ -409,12 +411,10 @@ if __name__ == "__main__":
     sampling_interval = "daily"
     dates = pd.date_range(start=start_date, end=end_date, freq="1D")
 
-    rd = {"daily": rrule.DAILY, "weekly": rrule.WEEKLY, "monthly": rrule.MONTHLY, "yearly": rrule.YEARLY}
-
-    bnds_datelist = list(rrule.rrule(rd[sampling_interval], dtstart=start_date, until=end_date_yearly))
-    # calculate the days since refdate, including refdate, with time being the
-    bnds_interval_since_refdate = cdftime_days.date2num(bnds_datelist)
-    time_interval_since_refdate = bnds_interval_since_refdate[0:-1] + np.diff(bnds_interval_since_refdate) / 2
+    bnds_interval_since_refdate = time_bounds(
+        "1980-1-1", "2021-1-2", periodicity=sampling_interval, ref_date="1980-1-1", calendar=calendar
+    )
+    time_interval_since_refdate = time_values(bnds_interval_since_refdate, "mid")
 
     time_dict = {
         "calendar": calendar,
@@ -2,155 +2,49 @@
 # Copyright (C) 2019 Andy Aschwanden
 
 import os
-from os.path import abspath, basename, join
+from os.path import abspath, basename, dirname, join, realpath
+import sys
 import glob
-import numpy as np
-import re
-from dateutil import rrule
-from dateutil.parser import parse
 
 from argparse import ArgumentParser
 
 import multiprocessing
 
 # multiprocessing.set_start_method("forkserver", force=True)
-from multiprocessing import Pool
 from functools import partial
 
-from netCDF4 import Dataset as NC
-from cftime import utime, datetime
-from cdo import Cdo
-
-cdo = Cdo()
-
-
-def adjust_timeline(
-    filename,
-    start_date="2008-1-1",
-    interval=1,
-    interval_type="mid",
-    bounds=True,
-    periodicity="yearly".upper(),
-    ref_date="2008-1-1",
-    ref_unit="days",
-    calendar="standard",
-):
-    nc = NC(filename, "a")
-    nt = len(nc.variables["time"])
-
-    time_units = "%s since %s" % (ref_unit, ref_date)
-    time_calendar = calendar
-
-    cdftime = utime(time_units, time_calendar)
-
-    # create a dictionary so that we can supply the periodicity as a
-    # command-line argument.
-    pdict = {}
-    pdict["SECONDLY"] = rrule.SECONDLY
-    pdict["MINUTELY"] = rrule.MINUTELY
-    pdict["HOURLY"] = rrule.HOURLY
-    pdict["DAILY"] = rrule.DAILY
-    pdict["WEEKLY"] = rrule.WEEKLY
-    pdict["MONTHLY"] = rrule.MONTHLY
-    pdict["YEARLY"] = rrule.YEARLY
-    prule = pdict[periodicity]
-
-    # reference date from command-line argument
-    r = time_units.split(" ")[2].split("-")
-    refdate = datetime(int(r[0]), int(r[1]), int(r[2]))
-
-    # create list with dates from start_date for nt counts
-    # periodicity prule.
-    bnds_datelist = list(rrule.rrule(freq=prule, dtstart=parse(start_date), count=nt + 1, interval=interval))
-
-    # calculate the days since refdate, including refdate, with time being the
-    bnds_interval_since_refdate = cdftime.date2num(bnds_datelist)
-    if interval_type == "mid":
-        # mid-point value:
-        # time[n] = (bnds[n] + bnds[n+1]) / 2
-        time_interval_since_refdate = bnds_interval_since_refdate[0:-1] + np.diff(bnds_interval_since_refdate) / 2
-    elif interval_type == "start":
-        time_interval_since_refdate = bnds_interval_since_refdate[:-1]
-    else:
-        time_interval_since_refdate = bnds_interval_since_refdate[1:]
-
-    # create a new dimension for bounds only if it does not yet exist
-    time_dim = "time"
-    if time_dim not in list(nc.dimensions.keys()):
-        nc.createDimension(time_dim)
-
-    # variable names consistent with PISM
-    time_var_name = "time"
-    bnds_var_name = "time_bnds"
-
-    # create time variable
-    if time_var_name not in nc.variables:
-        time_var = nc.createVariable(time_var_name, "d", dimensions=(time_dim))
-    else:
-        time_var = nc.variables[time_var_name]
-    time_var[:] = time_interval_since_refdate
-    time_var.units = time_units
-    time_var.calendar = time_calendar
-    time_var.standard_name = time_var_name
-    time_var.axis = "T"
-
-    if bounds:
-        # create a new dimension for bounds only if it does not yet exist
-        bnds_dim = "nb2"
-        if bnds_dim not in list(nc.dimensions.keys()):
-            nc.createDimension(bnds_dim, 2)
-
-        # create time bounds variable
-        if bnds_var_name not in nc.variables:
-            time_bnds_var = nc.createVariable(bnds_var_name, "d", dimensions=(time_dim, bnds_dim))
-        else:
-            time_bnds_var = nc.variables[bnds_var_name]
-        time_bnds_var[:, 0] = bnds_interval_since_refdate[0:-1]
-        time_bnds_var[:, 1] = bnds_interval_since_refdate[1::]
-        time_var.bounds = bnds_var_name
-    else:
-        delattr(time_var, "bounds")
-
-    nc.close()
+sys.path.append(join(realpath(dirname(__file__)), "../resources"))
+from chunking import profiles
+from ismip6 import Catalog, Manifest, convert, convert_memory, read_variables
+from scheduler import available_memory, make_task, run_tasks
 
 
-def get_var(m_string):
+def output_file(entry, base_dir):
     """
-    Return the variable name
+    Return the ISMIP6 file of the catalog entry 'entry'
     """
-    m_var = None
-    for ismip6var in ISMIP6.keys():
-        if re.search(ismip6var, m_string) is not None:
-            m_var = ismip6var
 
-    return m_var
+    return join(base_dir, GROUP, entry["experiment"], entry["file"])
 
 
-def process_file(a_file, metadata):
+def process_file(entry, metadata):
 
-    m_file = basename(a_file)
-    m_var = get_var(m_file)
+    a_file = entry["path"]
+    m_file = entry["file"]
+    m_var = entry["variable"]
 
     base_dir = metadata["base_dir"]
 
     if m_var is not None:
 
         print("Processing {}".format(m_file))
-        if re.search("asmb", m_file) is not None:
-            EXP = "asmb"
-        if re.search("ctrl", m_file) is not None:
-            EXP = "ctrl"
-        project_dir = os.path.join(base_dir, GROUP, EXP)
-        o_file = join(project_dir, m_file)
+        o_file = output_file(entry, base_dir)
+        os.makedirs(dirname(o_file), exist_ok=True)
 
-        if ISMIP6[m_var]["type"] == "state":
+        if ISMIP6[m_var]["type"] in ("state", "flux"):
             print("  Saving {}".format(o_file))
-            cdo.seltimestep("1/1000", input=a_file, output=o_file, options="-f nc4 -z zip_3")
-            adjust_timeline(o_file, interval=5, interval_type="start", bounds=False)
-        elif ISMIP6[m_var]["type"] == "flux":
-            print("  Saving {}".format(o_file))
-            cdo.seltimestep("2/1000", input=a_file, output=o_file, options="-f nc4 -z zip_3")
-            adjust_timeline(o_file, interval=5, interval_type="mid", bounds=True)
+            convert(a_file, o_file, ISMIP6[m_var]["type"], interval=5, fill_value=None, profile=metadata["chunking"])
+            return o_file
         else:
             print("how did I get here")
 
@@ -169,9 +63,24 @@ parser.add_argument(
 parser.add_argument(
     "-n", "--n_procs", dest="n_procs", type=int, help="""number of cores/processors. default=4.""", default=4
 )
+parser.add_argument(
+    "--chunking",
+    dest="chunking",
+    choices=profiles,
+    help="""chunk shapes of the ISMIP6 files for reading maps, time series, or both. default=balanced""",
+    default="balanced",
+)
+parser.add_argument(
+    "--memory",
+    dest="memory",
+    type=float,
+    help="""memory for the workers in GB. default: most of the memory of the job or machine""",
+    default=None,
+)
 
 options = parser.parse_args()
 n_procs = options.n_procs
+memory = options.memory * 1024**3 if options.memory is not None else available_memory()
 in_dir = abspath(options.INDIR[0])
 base_dir = abspath(options.base_dir)
 
@@ -182,17 +91,8 @@ GROUP = "UAF"
 MODEL = "PISM"
 project = "{IS}_{GROUP}_{MODEL}".format(IS=IS, GROUP=GROUP, MODEL=MODEL)
 
-try:
-    ismip6resources = np.genfromtxt(
-        "../resources/ismip6vars.csv", dtype=None, encoding=None, delimiter=",", autostrip=True
-    )
-except:
-    ismip6resources = np.genfromtxt("../resources/ismip6vars.csv", dtype=None, delimiter=",", autostrip=True)
-
-ISMIP6 = {}
-keys = ismip6resources[0]
-for v in ismip6resources[1::]:
-    ISMIP6[v[0]] = dict(zip(keys[1::], v[1::]))
+ISMIP6 = read_variables()
+catalog = Catalog(ISMIP6, IS, GROUP, MODEL)
 
 
 if __name__ == "__main__":
@@ -211,10 +111,27 @@ if __name__ == "__main__":
     files.extend(glob.glob(join(scalar_dir, "*.nc")))
     files.extend(glob.glob(join(spatial_dir, "*.nc")))
 
-    metadata = {"base_dir": base_dir}
-    pool = Pool(n_procs)
-    pool.map(partial(process_file, metadata=metadata), files)
-    pool.terminate()
+    # reruns only process new or changed files
+    entries, problems = catalog.scan(files)
+    for a_file, problem in problems.items():
+        print("Skipping {}: {}".format(basename(a_file), problem))
+    manifest = Manifest(base_dir)
+    entries = [e for e in entries if not manifest.is_current(e["path"], output_file(e, base_dir))]
+    print("{} new or changed files\n".format(len(entries)))
+
+    # largest files first, as many at a time as fit into memory
+    metadata = {"base_dir": base_dir, "chunking": options.chunking}
+    tasks = [make_task(e["file"], e, os.path.getsize(e["path"]), convert_memory(e["path"])) for e in entries]
+    results = run_tasks(partial(process_file, metadata=metadata), tasks, n_procs, memory)
+    for entry, result in zip(entries, results):
+        if result["status"] == "done" and result["result"] is not None:
+            manifest.record(entry["path"], result["result"])
+    manifest.save()
+
+    failed = [r["name"] for r in results if r["status"] == "failed"]
+    if failed:
+        print("\n{} of {} files failed: {}".format(len(failed), len(results), ", ".join(failed)))
+        sys.exit(1)
 
     # for a_file in files:
     #     m_file = basename(a_file)
@@ -0,0 +1,137 @@
+"""
+allocation
+==========
+
+Provides:
+  - the domain decomposition PISM (via PETSc) uses for a given number
+    of MPI ranks
+  - a simple cost model for one time step of a decomposed grid
+  - core counts that fill whole nodes and keep subdomains balanced
+
+"""
+
+from collections import OrderedDict
+import math
+
+# Relative costs used by step_cost(). Only ratios matter. 'cell' is the
+# cost of updating one grid cell (all levels), 'halo' the cost of
+# exchanging one ghost cell (all levels) and 'latency' the cost of one
+# round of messages (global reductions in the Krylov solvers scale with
+# log2 of the number of ranks).
+default_cost_model = {"cell": 1.0, "halo": 8.0, "latency": 2.0e4}
+
+
+def decompose(n_ranks, Mx, My):
+    """
+    Return the number of ranks in x and y, following
+    IceGrid::compute_nprocs() in PISM.
+
+    Returns: tuple
+    """
+
+    Nx = int(0.5 + math.sqrt(float(Mx) * n_ranks / float(My)))
+    Nx = max(Nx, 1)
+    while Nx > 0:
+        Ny = n_ranks // Nx
+        if Nx * Ny == n_ranks:
+            break
+        Nx -= 1
+
+    if Mx > My and Nx < Ny:
+        Nx, Ny = Ny, Nx
+
+    return Nx, Ny
+
+
+def ownership_ranges(M, N):
+    """
+    Return the number of grid points owned by each of the N ranks
+    along an axis of M points (as in PETSc).
+
+    Returns: list
+    """
+
+    return [M // N + (1 if k < M % N else 0) for k in range(N)]
+
+
+def step_cost(n_ranks, Mx, My, Mz=1, Mbz=0, cost_model=None):
+    """
+    Estimate the cost of one time step on 'n_ranks' ranks: the slowest
+    rank's cell updates and halo exchange plus message latency.
+
+    Returns: OrderedDict
+    """
+
+    if cost_model is None:
+        cost_model = default_cost_model
+
+    Nx, Ny = decompose(n_ranks, Mx, My)
+    xm = max(ownership_ranges(Mx, Nx))
+    ym = max(ownership_ranges(My, Ny))
+    levels = Mz + Mbz
+
+    local_cells = xm * ym
+    mean_cells = float(Mx * My) / n_ranks
+    halo_cells = 2 * (xm + ym) + 4
+
+    result = OrderedDict()
+    result["cores"] = n_ranks
+    result["Nx"] = Nx
+    result["Ny"] = Ny
+    result["xm"] = xm
+    result["ym"] = ym
+    result["imbalance"] = local_cells / mean_cells
+    result["aspect_ratio"] = float(max(xm, ym)) / min(xm, ym) if min(xm, ym) > 0 else float("inf")
+    result["cost"] = (
+        cost_model["cell"] * local_cells * levels
+        + cost_model["halo"] * halo_cells * levels
+        + cost_model["latency"] * math.log2(max(n_ranks, 2))
+    )
+
+    return result
+
+
+def is_valid(decomposition, min_points=4):
+    """
+    A decomposition is valid if every rank owns at least 'min_points'
+    points in each direction.
+    """
+
+    return decomposition["xm"] >= min_points and decomposition["ym"] >= min_points
+
+
+def recommend_cores(grid_dict, ppn, n_cores, tolerance=0.1, max_aspect_ratio=4.0, cost_model=None):
+    """
+    Recommend a core count that fills whole 'ppn'-core nodes, using no
+    more nodes than 'n_cores' would occupy.
+
+    Among all node counts, find the fastest valid decomposition and pick
+    the smallest node count whose cost per step is within 'tolerance'
+    of it (fewer nodes for nearly the same wall time is cheaper).
+    Decompositions with subdomain aspect ratios above 'max_aspect_ratio'
+    are skipped unless nothing else is left.
+
+    Returns: OrderedDict (see step_cost()) with an additional "nodes" entry
+    """
+
+    Mx, My = grid_dict["Mx"], grid_dict["My"]
+    Mz, Mbz = grid_dict.get("Mz", 1), grid_dict.get("Mbz", 0)
+
+    max_nodes = max(int(math.ceil(float(n_cores) / ppn)), 1)
+
+    candidates = []
+    for nodes in range(1, max_nodes + 1):
+        d = step_cost(nodes * ppn, Mx, My, Mz, Mbz, cost_model=cost_model)
+        d["nodes"] = nodes
+        if is_valid(d):
+            candidates.append(d)
+
+    if not candidates:
+        raise ValueError("Grid {}x{} is too small for {} cores per node".format(Mx, My, ppn))
+
+    shaped = [d for d in candidates if d["aspect_ratio"] <= max_aspect_ratio]
+    if shaped:
+        candidates = shaped
+
+    best = min(d["cost"] for d in candidates)
+    return min([d for d in candidates if d["cost"] <= (1 + tolerance) * best], key=lambda d: d["nodes"])
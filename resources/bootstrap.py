@@ -0,0 +1,101 @@
+"""
+bootstrap
+=========
+
+Provides a shared initial state for the members of an ensemble that
+bootstrap from the same data set:
+
+  - members of historical.py and similar generators bootstrap from
+    greenland_dataname() and regrid the same variables from the same
+    regrid_file; PISM repeats this identically for every member
+  - with --shared_bootstrap, a bootstrap script runs PISM once per
+    distinct initial state for a zero-length run, writing the state into
+    state/bootstrap/ in the output directory; it is skipped if the
+    state is complete
+  - the bootstrap run has all parameters of its members but output,
+    reporting and run time, so the state has the fields of the model
+    components (hydrology, stress balance, calving, energy and age,
+    surface and ocean) the members restart with; members share a state
+    only if all these parameters are the same
+  - members start from the state with -i and without -bootstrap,
+    -regrid_file, -regrid_vars and the grid options; they stop if it
+    is not complete
+
+"""
+
+from collections import OrderedDict
+import re
+
+from chain import completion_test
+
+# parameters of the grid; PISM takes them from the input file unless it
+# bootstraps
+grid_parameters = ["Mx", "My", "Mz", "Mbz", "Lz", "Lbz", "z_spacing", "refinement_factor"]
+
+# parameters of a member that do not change its initial state (output,
+# reporting and run time); all others define it
+run_parameters = [
+    "o",
+    "o_format",
+    "o_size",
+    "profile",
+    "options_left",
+    "time_file",
+    "ys",
+    "ye",
+    "y",
+    "skip",
+    "skip_max",
+    "climate_forcing.buffer_size",
+]
+run_prefixes = ("output.", "ts_", "extra_", "save_")
+
+# parameters members no longer need when starting from a shared state
+member_only = ["bootstrap", "regrid_file", "regrid_vars"] + grid_parameters
+
+# -bootstrap in the PISM executable string of regional domains
+bootstrap_re = re.compile(r"\s-bootstrap(?=\s|$)")
+
+
+def initial_state_params(params_dict):
+    """
+    Return the parameters of 'params_dict' defining the initial state:
+    all but those in run_parameters and starting with run_prefixes.
+
+    Returns: OrderedDict
+    """
+
+    return OrderedDict(
+        (k, v) for k, v in params_dict.items() if k not in run_parameters and not k.startswith(run_prefixes)
+    )
+
+
+def start_from_state(params_dict, state):
+    """
+    Return 'params_dict' changed to start from 'state'.
+
+    Returns: OrderedDict
+    """
+
+    result = OrderedDict()
+    for k, v in params_dict.items():
+        if k in member_only:
+            continue
+        result[k] = state if k == "i" else v
+    return result
+
+
+def state_check(state, script):
+    """
+    Return shell commands that stop a member if the shared initial state
+    'state' is not complete.
+
+    Returns: string
+    """
+
+    return """# the shared initial state is written by {script}
+if ! ({test}); then
+  echo "{state} is not complete, run {script} first"
+  exit 1
+fi
+""".format(test=completion_test(state), state=state, script=script)
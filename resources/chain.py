@@ -0,0 +1,98 @@
+"""
+chain
+=====
+
+Provides:
+  - a shell test whether a PISM output file is complete
+  - guards that skip a restart segment whose output is complete
+  - chain scripts that submit restart segments with scheduler
+    dependencies (each segment starts after the previous one succeeded),
+    skipping segments that are already complete
+
+Re-running a chain script after a walltime kill or node failure
+resubmits only the segments that have not finished.
+
+"""
+
+import os
+
+
+def completion_test(ofile):
+    """
+    Return a shell condition that is true if 'ofile' is a complete PISM
+    output file. PISM writes run_stats after the run, so a file that
+    lacks it was not finished.
+
+    Returns: string
+    """
+
+    return "[ -s {ofile} ] && ncdump -h {ofile} 2> /dev/null | grep -q run_stats".format(ofile=ofile)
+
+
+def guard_command(cmd, ofile):
+    """
+    Wrap 'cmd' so it is skipped if 'ofile' is complete.
+
+    Returns: string
+    """
+
+    return """# skip this segment if its output is complete
+if {test}; then
+  echo "{ofile} is complete, skipping"
+else
+{cmd}
+fi
+""".format(test=completion_test(ofile), ofile=ofile, cmd=cmd)
+
+
+def write_chain_script(filename, segments, batch_system, output_dir):
+    """
+    Write a script that submits 'segments', a list of (script, output
+    file) tuples, one after the other with "afterok" dependencies.
+    Segments with complete output are not submitted. On systems without
+    a scheduler, the segments are run in order.
+
+    Returns: string
+    """
+
+    chain = batch_system.get("chain")
+
+    with open(filename, "w") as f:
+        f.write("#!/bin/bash\n")
+        f.write("set -e\n\n")
+        f.write('output_dir="{}"\n\n'.format(output_dir))
+        if chain is None:
+            f.write("""submit() {{
+  if {test}; then
+    echo "$2 is complete, skipping $1"
+  else
+    bash $1
+  fi
+}}
+
+""".format(test=completion_test("$2")))
+        else:
+            f.write(
+                """job_id=""
+submit() {{
+  if {test}; then
+    echo "$2 is complete, skipping $1"
+  elif [ -z "$job_id" ]; then
+    job_id=$({submit} $1)
+    echo "submitted $1 as $job_id"
+  else
+    job_id=$({submit} {depend} $1)
+    echo "submitted $1 as $job_id"
+  fi
+}}
+
+""".format(
+                    test=completion_test("$2"),
+                    submit=chain["submit"],
+                    depend=chain["depend"].format(job_id="$job_id"),
+                )
+            )
+        for script, ofile in segments:
+            f.write("submit {script} {ofile}\n".format(script=os.path.abspath(script), ofile=ofile))
+
+    return filename
@@ -0,0 +1,316 @@
+"""
+chunking
+========
+
+Provides chunk shapes of netCDF-4 files for the way they are read, and
+the rewriting of files with them:
+
+  - "map": one record per chunk, the x/y grid split into tiles of
+    about 'chunk_bytes'; reading a map touches as few chunks as possible
+  - "timeseries": as many records per chunk as fit into the memory of
+    the process writing the file, on small x/y tiles; reading all
+    records at a point or over a basin touches few chunks
+  - "balanced": records and tiles chosen so that reading a map and
+    reading the time series at a point touch about the same number of
+    chunks
+  - dimensions other than time, x and y (levels, bounds) are not split;
+    variables without x/y are chunked along time only
+
+PISM (and cdo) write one record of the whole grid per chunk, so reading
+the time series at a point decompresses every record of the file.
+Rewriting a file reads blocks of whole chunks of records, so each chunk
+is written once.
+
+Usage: python chunking.py [-p profile] [-L level] IN.nc OUT.nc rewrites
+a file; python chunking.py --benchmark DIR IN.nc measures the read
+latency of maps and point time series of IN.nc rewritten with each
+profile in DIR.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import json
+import math
+import os
+from os.path import basename, join
+import shutil
+import time
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+profiles = ("map", "timeseries", "balanced")
+
+# size of a chunk (uncompressed)
+chunk_bytes = 4 * 1024**2
+
+# memory for the records of one block when rewriting a file
+default_memory = 4 * 1024**3
+
+spatial_dimensions = ("x", "y")
+
+# values of the smallest x/y tile, so a map is not split into millions
+# of chunks
+min_tile = 16 * 16
+
+
+def chunk_shape(dimensions, shape, itemsize, profile, memory=default_memory):
+    """
+    Return the chunk shape of a variable with 'dimensions', 'shape' and
+    values of 'itemsize' bytes for 'profile'. A chunk has at most as
+    many records as fit into 'memory'.
+
+    Returns: tuple of ints
+    """
+
+    if profile not in profiles:
+        raise ValueError("profile must be one of {}, got {}".format(profiles, profile))
+
+    by_time = dimensions[:1] == ("time",)
+    spatial = [k for k, d in enumerate(dimensions) if d in spatial_dimensions]
+    fixed = [k for k in range(len(dimensions)) if k not in spatial and not (by_time and k == 0)]
+
+    fixed_values = int(np.prod([max(shape[k], 1) for k in fixed]))
+    values = max(chunk_bytes // (itemsize * fixed_values), 1)
+    n_spatial = int(np.prod([max(shape[k], 1) for k in spatial]))
+
+    t = 1
+    if by_time:
+        records = max(shape[0], 1)
+        max_records = max(memory // (itemsize * fixed_values * n_spatial), 1)
+        if not spatial:
+            t = min(records, values, max_records)
+        elif profile == "timeseries":
+            t = min(records, max(values // min_tile, 1), max_records)
+        elif profile == "balanced":
+            n = max(math.sqrt(records * n_spatial / float(values)), 1.0)
+            t = min(max(int(round(records / n)), 1), max_records)
+    tile = max(values // t, 1)
+
+    chunks = [max(shape[k], 1) for k in range(len(dimensions))]
+    if by_time:
+        chunks[0] = t
+    if spatial and n_spatial > tile:
+        r = (tile / float(n_spatial)) ** (1.0 / len(spatial))
+        for k in spatial:
+            chunks[k] = min(max(int(math.ceil(shape[k] * r)), 1), shape[k])
+    return tuple(chunks)
+
+
+def variable_chunks(var, profile, records=None, memory=default_memory):
+    """
+    Return the chunk shape of the netCDF variable 'var' for 'profile',
+    with 'records' records if given, or None if it is not chunked
+    (scalars and strings).
+
+    Returns: tuple or None
+    """
+
+    if var.ndim == 0 or not isinstance(var.datatype, np.dtype):
+        return None
+    shape = list(var.shape)
+    if records is not None and var.dimensions[:1] == ("time",):
+        shape[0] = records
+    return chunk_shape(var.dimensions, shape, var.dtype.itemsize, profile, memory)
+
+
+def block_records(chunks, record_bytes, memory=default_memory):
+    """
+    Return the number of records copied at once: a multiple of the
+    records per chunk 'chunks[0]' that fits into 'memory' (at least one
+    chunk).
+
+    Returns: int
+    """
+
+    t = chunks[0] if chunks else 1
+    return max(memory // max(record_bytes * t, 1), 1) * t
+
+
+def rechunk(source, target, profile, complevel=3, memory=default_memory):
+    """
+    Write the netCDF file 'source' to 'target' (which may be 'source')
+    with the chunk shapes of 'profile', compressed with 'complevel' (0:
+    not compressed).
+    """
+
+    tmp = "{}.tmp{}".format(target, os.getpid())
+    try:
+        with NC(source) as src, NC(tmp, "w", format="NETCDF4") as dst:
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            attrs = OrderedDict((a, src.getncattr(a)) for a in src.ncattrs())
+            history = "{}: rechunked for {} access".format(time.asctime(), profile)
+            attrs["history"] = "\n".join([history] + ([attrs["history"]] if "history" in attrs else []))
+            dst.setncatts(attrs)
+
+            for name, var in src.variables.items():
+                chunks = variable_chunks(var, profile, memory=memory)
+                out = dst.createVariable(
+                    name,
+                    var.datatype,
+                    var.dimensions,
+                    zlib=complevel > 0 and chunks is not None,
+                    complevel=max(complevel, 1),
+                    chunksizes=chunks,
+                    fill_value=getattr(var, "_FillValue", None),
+                )
+                out.setncatts(OrderedDict((a, var.getncattr(a)) for a in var.ncattrs() if a != "_FillValue"))
+                copy_blocks(var, out, chunks, memory)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+
+
+def copy_blocks(var, out, chunks, memory=default_memory):
+    """
+    Copy 'var' to 'out' in blocks of whole chunks of records.
+    """
+
+    var.set_auto_maskandscale(False)
+    out.set_auto_maskandscale(False)
+
+    if var.ndim == 0:
+        out.assignValue(var.getValue())
+        return
+    if chunks is None or var.dimensions[:1] != ("time",):
+        out[:] = var[:]
+        return
+
+    n = var.shape[0]
+    step = block_records(chunks, var.dtype.itemsize * int(np.prod(var.shape[1:])), memory)
+    for k in range(0, n, step):
+        out[k : min(k + step, n)] = var[k : min(k + step, n)]
+
+
+def drop_cache(filename):
+    """
+    Ask the kernel to drop the cached pages of 'filename', so reads go
+    to the file system.
+    """
+
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def read_latency(filename, variable, samples=20, seed=0):
+    """
+    Measure the mean time in seconds to read a map (one record) and the
+    time series at a point (all records) of 'variable' in 'filename',
+    at 'samples' random records and points, starting without cached
+    pages.
+
+    Returns: OrderedDict
+    """
+
+    rng = np.random.RandomState(seed)
+    result = OrderedDict()
+    with NC(filename) as nc:
+        var = nc.variables[variable]
+        var.set_auto_maskandscale(False)
+        n, shape = var.shape[0], var.shape[1:]
+        patterns = OrderedDict(
+            [
+                ("map", [(int(rng.randint(n)),) for _ in range(samples)]),
+                ("timeseries", [(slice(None),) + tuple(int(rng.randint(m)) for m in shape) for _ in range(samples)]),
+            ]
+        )
+        for pattern, indices in patterns.items():
+            drop_cache(filename)
+            start = time.time()
+            for index in indices:
+                var[index]
+            result[pattern] = (time.time() - start) / samples
+    return result
+
+
+def benchmark(source, directory, variable=None, samples=20, complevel=3, memory=default_memory):
+    """
+    Rewrite 'source' with each profile in 'directory' and measure the
+    read latency (see read_latency()) of 'variable' (default: the
+    largest variable with records on an x/y grid) in it and in 'source'.
+
+    Returns: OrderedDict
+    """
+
+    with NC(source) as nc:
+        if variable is None:
+            candidates = [
+                v
+                for v in nc.variables.values()
+                if v.dimensions[:1] == ("time",) and all(d in v.dimensions for d in spatial_dimensions)
+            ]
+            if not candidates:
+                raise ValueError("{} has no variable with records on an x/y grid".format(source))
+            variable = max(candidates, key=lambda v: int(np.prod(v.shape))).name
+        chunks = nc.variables[variable].chunking()
+
+    results = OrderedDict()
+    results["source"] = OrderedDict([("file", source), ("variable", variable), ("chunks", chunks)])
+    results["source"].update(read_latency(source, variable, samples))
+    for profile in profiles:
+        filename = join(directory, "{}_{}".format(profile, basename(source)))
+        start = time.time()
+        rechunk(source, filename, profile, complevel, memory)
+        elapsed = time.time() - start
+        with NC(filename) as nc:
+            chunks = nc.variables[variable].chunking()
+        results[profile] = OrderedDict(
+            [("chunks", chunks), ("bytes", os.path.getsize(filename)), ("write_time", elapsed)]
+        )
+        results[profile].update(read_latency(filename, variable, samples))
+        os.remove(filename)
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Rewrite a netCDF file with chunks for reading maps, time series, or both."
+    parser.add_argument("FILES", nargs="+")
+    parser.add_argument("-p", "--profile", dest="profile", choices=profiles, default="balanced")
+    parser.add_argument("-L", "--level", dest="level", type=int, help="compression level", default=3)
+    parser.add_argument("--memory", dest="memory", type=float, help="memory for a block of records in GB", default=None)
+    parser.add_argument(
+        "--benchmark", dest="benchmark", help="measure read latency, rewriting FILE in this directory", default=None
+    )
+    parser.add_argument("--variable", dest="variable", help="variable read by the benchmark", default=None)
+    parser.add_argument("--samples", dest="samples", type=int, help="reads per pattern", default=20)
+    parser.add_argument("-o", "--output", dest="output", help="benchmark result file", default=None)
+    options = parser.parse_args()
+
+    memory = int(options.memory * 1024**3) if options.memory is not None else default_memory
+    if options.benchmark is not None:
+        directory = join(os.path.abspath(options.benchmark), "chunking_benchmark_{}".format(os.getpid()))
+        os.makedirs(directory)
+        try:
+            result = benchmark(options.FILES[0], directory, options.variable, options.samples, options.level, memory)
+        finally:
+            shutil.rmtree(directory)
+        for name, r in result.items():
+            print(
+                "{:>10}: chunks {}, map {:.1f} ms, time series {:.1f} ms".format(
+                    name, r["chunks"], r["map"] * 1e3, r["timeseries"] * 1e3
+                )
+            )
+        if options.output is not None:
+            with open(options.output, "w") as f:
+                json.dump(result, f, indent=2)
+            print("Results written to {}".format(options.output))
+    else:
+        if len(options.FILES) != 2:
+            parser.error("give IN.nc OUT.nc")
+        rechunk(options.FILES[0], options.FILES[1], options.profile, options.level, memory)
@@ -0,0 +1,164 @@
+"""
+crop
+====
+
+Provides cropping of Greenland-wide forcing files to regional domains:
+
+  - the window of a file is the part of its x/y grid covering the x/y
+    extent of the domain plus a halo of grid cells of the file, so PISM
+    can still interpolate to the model grid at the domain edges
+  - cropped files keep all variables, attributes and the time axis;
+    variables on the x/y grid are copied in blocks of records, so daily
+    forcing is cropped in bounded memory
+  - files without an x/y grid, or whose grid the window covers
+    entirely, are not cropped
+
+Usage: python crop.py --x_range X_MIN X_MAX --y_range Y_MIN Y_MAX IN.nc OUT.nc
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import time
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+# grid cells of the forcing file kept around the domain
+default_halo = 2
+
+# bytes of a variable copied at once
+block_bytes = 256 * 1024**2
+
+
+def coordinate_window(c, c_range, halo=default_halo):
+    """
+    Return the index range (start, stop) of the values of the coordinate
+    'c' (ascending or descending) within 'c_range' plus 'halo' cells, or
+    None if no value is within 'c_range'.
+
+    Returns: tuple
+    """
+
+    inside = np.nonzero((c >= c_range[0]) & (c <= c_range[1]))[0]
+    if len(inside) == 0:
+        return None
+    return max(int(inside[0]) - halo, 0), min(int(inside[-1]) + 1 + halo, len(c))
+
+
+def read_window(filename, x_range, y_range, halo=default_halo):
+    """
+    Return the window of the netCDF file 'filename' covering 'x_range'
+    and 'y_range' plus 'halo' cells, or None if the file cannot be read,
+    has no x/y grid, does not overlap the ranges or would not get
+    smaller.
+
+    Returns: OrderedDict (dimension -> (start, stop))
+    """
+
+    if NC is None:
+        return None
+    try:
+        nc = NC(filename)
+    except Exception:
+        return None
+
+    try:
+        if "x" not in nc.dimensions or "y" not in nc.dimensions or "x" not in nc.variables or "y" not in nc.variables:
+            return None
+        window = OrderedDict()
+        for dim, c_range in (("x", x_range), ("y", y_range)):
+            w = coordinate_window(nc.variables[dim][:], c_range, halo)
+            if w is None:
+                return None
+            window[dim] = w
+        if all(stop - start == len(nc.dimensions[dim]) for dim, (start, stop) in window.items()):
+            return None
+        return window
+    finally:
+        nc.close()
+
+
+def crop_file(source, target, window):
+    """
+    Write the part of the netCDF file 'source' in 'window' (see
+    read_window()) to 'target'.
+    """
+
+    with NC(source) as src, NC(target, "w", format=src.data_model) as dst:
+        for name, dim in src.dimensions.items():
+            if name in window:
+                start, stop = window[name]
+                dst.createDimension(name, stop - start)
+            else:
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        attrs = OrderedDict((a, src.getncattr(a)) for a in src.ncattrs())
+        history = "{}: cropped to x[{}:{}], y[{}:{}]".format(
+            time.asctime(), window["x"][0], window["x"][1], window["y"][0], window["y"][1]
+        )
+        attrs["history"] = "\n".join([history] + ([attrs["history"]] if "history" in attrs else []))
+        dst.setncatts(attrs)
+
+        for name, var in src.variables.items():
+            filters = var.filters() or {}
+            fill_value = getattr(var, "_FillValue", None)
+            out = dst.createVariable(
+                name,
+                var.datatype,
+                var.dimensions,
+                zlib=bool(filters.get("zlib")),
+                complevel=filters.get("complevel", 4),
+                shuffle=bool(filters.get("shuffle")),
+                fill_value=fill_value,
+            )
+            out.setncatts(OrderedDict((a, var.getncattr(a)) for a in var.ncattrs() if a != "_FillValue"))
+            copy_variable(var, out, window)
+
+
+def copy_variable(var, out, window):
+    """
+    Copy the part of 'var' in 'window' to 'out', in blocks of records
+    along the first dimension.
+    """
+
+    var.set_auto_maskandscale(False)
+    out.set_auto_maskandscale(False)
+
+    if var.ndim == 0:
+        out.assignValue(var.getValue())
+        return
+
+    index = [slice(*window[d]) if d in window else slice(None) for d in var.dimensions]
+    n = var.shape[0]
+    if var.dimensions[0] in window or n == 0:
+        out[:] = var[tuple(index)]
+        return
+
+    record_bytes = var.dtype.itemsize * int(np.prod(out.shape[1:]))
+    step = max(block_bytes // max(record_bytes, 1), 1)
+    for k in range(0, n, step):
+        index[0] = slice(k, min(k + step, n))
+        out[index[0]] = var[tuple(index)]
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Crop a netCDF file to an x/y extent plus a halo."
+    parser.add_argument("FILES", nargs=2)
+    parser.add_argument("--x_range", dest="x_range", type=float, nargs=2, required=True)
+    parser.add_argument("--y_range", dest="y_range", type=float, nargs=2, required=True)
+    parser.add_argument("--halo", dest="halo", type=int, help="grid cells kept around the extent", default=default_halo)
+    options = parser.parse_args()
+
+    source, target = options.FILES
+    window = read_window(source, options.x_range, options.y_range, options.halo)
+    if window is None:
+        print("{} cannot be cropped to x {}, y {}".format(source, options.x_range, options.y_range))
+    else:
+        crop_file(source, target, window)
@@ -0,0 +1,155 @@
+"""
+domains
+=======
+
+Provides:
+  - a registry of modeling domains (Greenland and sub-regions thereof)
+    and their grids, loaded from domains.json
+  - registration of additional (regional) domains from data files
+    listed in $CRIOS2PISM_DOMAINS or at run time
+
+Each domain has a PISM executable string, optionally an x/y extent
+(regional domains), and, if PISM grids can be generated for it, the
+number of grid points at the finest resolution, the accepted
+resolutions and a vertical grid. Grids are precomputed for all
+accepted resolutions, so lookups are O(1).
+
+"""
+
+from collections import OrderedDict
+import json
+import os
+
+domains_file = os.path.join(os.path.realpath(os.path.dirname(__file__)), "domains.json")
+
+# os.pathsep-separated list of additional domain files
+domains_env = "CRIOS2PISM_DOMAINS"
+
+vertical_grids = {}
+
+# name or alias -> domain
+_domains = {}
+# (name or alias, resolution) -> grid description
+_grids = {}
+
+
+def compute_grid(domain, grid_resolution):
+    """
+    Compute the grid description of 'domain' at 'grid_resolution'.
+
+    Returns: OrderedDict
+    """
+
+    tiers = [t for t in vertical_grids[domain["vertical_grid"]] if grid_resolution >= t["resolution_min"]]
+    tier = max(tiers, key=lambda t: t["resolution_min"])
+
+    grid_div = grid_resolution / domain["resolution_max"]
+
+    grid = OrderedDict()
+    grid["Mx"] = int(domain["mx_max"] / grid_div)
+    grid["My"] = int(domain["my_max"] / grid_div)
+    grid["Lz"] = 4000
+    grid["Lbz"] = 2000
+    grid["z_spacing"] = "equal"
+    grid["Mz"] = tier["Mz"]
+    grid["Mbz"] = tier["Mbz"]
+    grid["skip"] = ""
+    grid["skip_max"] = tier["skip_max"]
+
+    return grid
+
+
+def register_domain(name, pism_exec, aliases=(), x_range=None, y_range=None, **kwargs):
+    """
+    Register a domain. To allow grid generation, pass 'mx_max', 'my_max',
+    'resolution_max', 'resolutions' and 'vertical_grid' (a key of
+    'vertical_grids'). An existing domain with the same name is replaced.
+
+    Returns: dict
+    """
+
+    domain = dict(kwargs)
+    domain["name"] = name.lower()
+    domain["aliases"] = [a.lower() for a in aliases]
+    domain["x_range"] = x_range
+    domain["y_range"] = y_range
+
+    if x_range is not None and y_range is not None:
+        domain["pism_exec"] = pism_exec.format(x_min=x_range[0], x_max=x_range[1], y_min=y_range[0], y_max=y_range[1])
+    else:
+        domain["pism_exec"] = pism_exec
+
+    domain["resolutions"] = tuple(domain.get("resolutions", ()))
+    if domain["resolutions"] and domain.get("vertical_grid") not in vertical_grids:
+        raise ValueError(
+            "Domain {}: vertical grid {} is not one of {}".format(
+                name, domain.get("vertical_grid"), sorted(vertical_grids.keys())
+            )
+        )
+
+    for key in [domain["name"]] + domain["aliases"]:
+        _domains[key] = domain
+        for grid_resolution in domain["resolutions"]:
+            _grids[(key, grid_resolution)] = compute_grid(domain, grid_resolution)
+
+    return domain
+
+
+def load_domains(filename):
+    """
+    Load vertical grids and domains from a JSON file, see domains.json.
+    """
+
+    with open(filename) as f:
+        registry = json.load(f)
+
+    vertical_grids.update(registry.get("vertical_grids", {}))
+    for name, domain in registry.get("domains", {}).items():
+        register_domain(name, **domain)
+
+
+def get_domain(name):
+    """
+    Return the domain called 'name' (or an alias thereof).
+
+    Returns: dict
+    """
+
+    try:
+        return _domains[name.lower()]
+    except KeyError:
+        raise ValueError("Domain {} not recognized. Pick one of {}.".format(name, list_domains()))
+
+
+def get_grid(name, grid_resolution):
+    """
+    Return the grid description of domain 'name' at 'grid_resolution'.
+    Raises ValueError if the domain does not exist or does not accept
+    this resolution.
+
+    Returns: OrderedDict
+    """
+
+    try:
+        return _grids[(name.lower(), grid_resolution)].copy()
+    except KeyError:
+        domain = get_domain(name)
+        raise ValueError(
+            "grid resolution {}m not recognized for domain {}. Pick one of {}.".format(
+                grid_resolution, name, domain["resolutions"]
+            )
+        )
+
+
+def list_domains():
+    """
+    Return a list of registered domain names and aliases.
+    """
+
+    return sorted(_domains.keys())
+
+
+load_domains(domains_file)
+for filename in os.environ.get(domains_env, "").split(os.pathsep):
+    if filename:
+        load_domains(filename)
@@ -0,0 +1,167 @@
+"""
+emission
+========
+
+Provides:
+  - job array scripts: one scheduler job array per ensemble, each array
+    index looks up its member in a table
+  - task-farm scripts: many small members run concurrently in one
+    allocation using sub-allocations of the MPI launcher, or a slice of
+    the node file of the job per worker
+
+In both modes the per-member scripts contain only the commands of the
+member; the batch header, the run header (variables, mkdir loop) and the
+footer are written once.
+
+"""
+
+import math
+import os
+
+
+def add_directive(header, directive):
+    """
+    Insert a scheduler directive after the last directive (#SBATCH or
+    #PBS line) of a batch header.
+
+    Returns: string
+    """
+
+    lines = header.split("\n")
+    last = -1
+    for k, line in enumerate(lines):
+        if line.startswith("#SBATCH") or line.startswith("#PBS"):
+            last = k
+    lines.insert(last + 1, directive)
+    return "\n".join(lines)
+
+
+def write_member_table(filename, member_scripts):
+    """
+    Write the list of member scripts, one per line; line k + 1 belongs to
+    array index k.
+
+    Returns: string
+    """
+
+    with open(filename, "w") as f:
+        for script in member_scripts:
+            f.write(os.path.abspath(script) + "\n")
+    return filename
+
+
+def farm_member_system(batch_system, member_cores):
+    """
+    Return the system dict to format member commands with in a task
+    farm: the MPI launcher starts 'member_cores' ranks in a
+    sub-allocation and job IDs are unique per member. A ValueError is
+    raised if the system has no launcher for task farms.
+
+    Returns: dict
+    """
+
+    if "farm_mpido" not in batch_system:
+        raise ValueError(
+            "This system has no MPI launcher that keeps task-farm members on separate cores; use --emission array"
+        )
+    system = batch_system.copy()
+    system["mpido"] = batch_system["farm_mpido"].format(cores=member_cores)
+    system["job_id"] = "farm_job_id"
+    return system
+
+
+def write_array_script(filename, member_scripts, batch_header, run_header, batch_system):
+    """
+    Write a job array script that runs member k at array index k. On
+    systems without job arrays, and for a single member, members are run
+    one after the other in one job.
+
+    Returns: string
+    """
+
+    table = write_member_table(os.path.splitext(filename)[0] + ".txt", member_scripts)
+    array = batch_system.get("array")
+
+    with open(filename, "w") as f:
+        if array is None or len(member_scripts) == 1:
+            f.write(batch_header)
+            f.write(run_header)
+            f.write("for member in $(cat {table}); do\n".format(table=table))
+            f.write("  . $member\n")
+            f.write("done\n")
+        else:
+            f.write(add_directive(batch_header, array["directive"].format(last=len(member_scripts) - 1)))
+            f.write(run_header)
+            f.write("# look up the member script of this array index\n")
+            f.write(
+                'member=$(sed -n "$((${index} + 1))p" {table})\n'.format(index="{" + array["index"] + "}", table=table)
+            )
+            f.write(". $member\n")
+        f.write("\n")
+        f.write(batch_system.get("footer", ""))
+
+    return filename
+
+
+def write_farm_script(filename, member_scripts, batch_header, run_header, batch_system, n_cores, member_cores):
+    """
+    Write a task-farm script that runs the members concurrently in one
+    allocation of 'n_cores' cores, 'member_cores' cores each. Members are
+    dealt round-robin to n_cores / member_cores workers. On systems with
+    a node file (farm_nodefile), worker k gets lines k * member_cores + 1
+    to (k + 1) * member_cores of it as its host file.
+
+    Returns: string
+    """
+
+    table = write_member_table(os.path.splitext(filename)[0] + ".txt", member_scripts)
+    slots = max(int(math.floor(float(n_cores) / member_cores)), 1)
+    job_id = "{" + batch_system["job_id"] + "}"
+
+    nodefile = batch_system.get("farm_nodefile")
+    hosts, cleanup = "", ""
+    if nodefile is not None:
+        hosts = """  # the hosts of this worker
+  farm_hostfile=./farm_hosts_${job_id}_$1
+  sed -n "$(($1 * {member_cores} + 1)),$((($1 + 1) * {member_cores}))p" ${nodefile} > $farm_hostfile
+""".format(job_id=job_id, member_cores=member_cores, nodefile=nodefile)
+        cleanup = "rm -f ./farm_hosts_${job_id}_*\n".format(job_id=job_id)
+
+    with open(filename, "w") as f:
+        f.write(batch_header)
+        f.write(run_header)
+        f.write(
+            """# run {n} members on {slots} workers with {member_cores} cores each
+slots={slots}
+
+run_worker() {{
+{hosts}  member_index=0
+  for member in $(cat {table}); do
+    if [ $((member_index % slots)) -eq $1 ]; then
+      farm_job_id=${job_id}_${{member_index}}
+      . $member || echo "$member failed"
+    fi
+    member_index=$((member_index + 1))
+  done
+}}
+
+worker=0
+while [ $worker -lt $slots ]; do
+  run_worker $worker &
+  worker=$((worker + 1))
+done
+wait
+{cleanup}""".format(
+                n=len(member_scripts),
+                slots=slots,
+                member_cores=member_cores,
+                table=table,
+                job_id=job_id,
+                hosts=hosts,
+                cleanup=cleanup,
+            )
+        )
+        f.write("\n")
+        f.write(batch_system.get("footer", ""))
+
+    return filename
@@ -0,0 +1,1299 @@
+"""
+engine
+======
+
+Provides:
+  - the command line options the run script generators share
+  - Run: the setup of one generator run (directories, config file, time
+    file, run header, cores, walltime and output plan, batch headers,
+    provenance) and the composition of PISM commands
+  - the two kinds of experiments: an ensemble with one script per member
+    (EnsembleExperiment) and an ensemble of runs split into restart
+    segments (RestartExperiment)
+  - a registry of experiment plugins, and generate(), which runs a
+    plugin in-process with a list of command line arguments
+
+A plugin (see experiments.py) is a subclass of EnsembleExperiment or
+RestartExperiment registered with @register. It sets 'name',
+'description', 'config', its own 'arguments' and 'overrides' of the
+shared ones, and returns the PISM parameters of a member or segment.
+
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import OrderedDict
+import math
+import os
+from os.path import abspath, basename, dirname, join, realpath, splitext
+import shlex
+import subprocess as sub
+
+from bootstrap import bootstrap_re, initial_state_params, start_from_state, state_check
+from crop import crop_file, read_window
+from ensemble import EnsembleReader
+from filecache import cache_key, default_directory
+from preflight import (
+    HeaderIndex,
+    check_inputs,
+    index_name,
+    input_dir_re,
+    input_files,
+    input_variables,
+    time_dependent,
+)
+from resources import *
+from staging import enqueue_command, step_command, write_worker_script
+from timeline import create_timeline, date_value
+
+# repository root, the default input directory
+root_directory = abspath(join(realpath(dirname(__file__)), ".."))
+
+# names of climate_forcing.buffer_size in the parameters of members
+buffer_parameters = ("climate_forcing.buffer_size", "climate_forcing_buffer_size")
+
+# reference date of the time files
+timeline_reference_date = "2008-01-01"
+
+grid_choices = [18000, 9000, 6000, 4500, 3600, 3000, 2400, 1800, 1500, 1200, 1000, 900, 600, 450, 300, 150]
+
+# Command line options of all generators as (flags, keyword arguments).
+# Experiments change defaults and choices with their 'overrides'.
+common_arguments = [
+    (("-n", "--n_procs"), dict(dest="n", type=int, help="""number of cores/processors. default=140.""", default=140)),
+    (
+        ("--output_budget",),
+        dict(dest="output_budget", help="Maximum size of the spatial time series of one run, e.g. 500G", default=None),
+    ),
+    (
+        ("--ensemble_output_budget",),
+        dict(
+            dest="ensemble_output_budget",
+            help="Maximum size of the spatial time series of all runs, e.g. 20T",
+            default=None,
+        ),
+    ),
+    (
+        ("--coarsen_exstep",),
+        dict(
+            dest="coarsen_exstep",
+            action="store_true",
+            help="Coarsen exstep until the output fits the budget instead of stopping",
+            default=False,
+        ),
+    ),
+    (
+        ("--io_benchmark",),
+        dict(
+            dest="io_benchmark",
+            help="Write throughput measured with resources/io_benchmark.py, used to choose output format and striping",
+            default=None,
+        ),
+    ),
+    (
+        ("--incremental",),
+        dict(
+            dest="incremental",
+            action="store_true",
+            help="Only rewrite scripts whose content changed and keep an existing config and time file",
+            default=False,
+        ),
+    ),
+    (
+        ("--cache_dir",),
+        dict(
+            dest="cache_dir",
+            help="Cache of config and time files (see resources/filecache.py). default: $CRIOS2PISM_CACHE or ~/.cache/crios2pism",
+            default=None,
+        ),
+    ),
+    (
+        ("--no_cache",),
+        dict(
+            dest="no_cache",
+            action="store_true",
+            help="Build the config and time files in the output directory instead of linking cached ones",
+            default=False,
+        ),
+    ),
+    (
+        ("--preflight",),
+        dict(
+            dest="preflight",
+            choices=["warn", "strict", "only", "off"],
+            help="Check the input files of all members before writing scripts (see resources/preflight.py): warn, stop on problems (strict), only check, or skip",
+            default="warn",
+        ),
+    ),
+    (
+        ("--forcing_buffer",),
+        dict(
+            dest="forcing_buffer",
+            help="climate_forcing.buffer_size: auto (from the records of the forcing files and the memory per rank) or a number of records",
+            default="auto",
+        ),
+    ),
+    (
+        ("--crop_forcing",),
+        dict(
+            dest="crop_forcing",
+            choices=["on", "off"],
+            help="Crop the forcing files of regional domains to the domain plus --crop_halo grid cells (see resources/crop.py)",
+            default="on",
+        ),
+    ),
+    (
+        ("--crop_halo",),
+        dict(dest="crop_halo", type=int, help="Grid cells of a forcing file kept around a regional domain", default=2),
+    ),
+    (
+        ("--save_times",),
+        dict(
+            dest="save_times",
+            help="Write snapshots of the model state at these times (PISM -save_times, e.g. monthly) to resume runs from (see resources/resume.py)",
+            default=None,
+        ),
+    ),
+    (
+        ("--staging",),
+        dict(
+            dest="staging",
+            choices=["inline", "queue"],
+            help="Compress and move output files in the run scripts (inline) or hand them to a staging worker (queue, see resources/staging.py)",
+            default="inline",
+        ),
+    ),
+    (
+        ("--staging_queue",),
+        dict(
+            dest="staging_queue",
+            help="Queue of the staging worker. default: the system's staging queue, or the queue of the runs",
+            default=None,
+        ),
+    ),
+    (
+        ("--staging_jobs",),
+        dict(
+            dest="staging_jobs",
+            type=int,
+            help="Tasks the staging worker runs at a time. default: the processors per node of its queue",
+            default=None,
+        ),
+    ),
+    (
+        ("--spatial_chunking",),
+        dict(
+            dest="spatial_chunking",
+            choices=["map", "timeseries", "balanced"],
+            help="Rechunk spatial time series after the run for reading maps, time series at points, or both (see resources/chunking.py). default: as PISM writes them",
+            default=None,
+        ),
+    ),
+    (
+        ("--auto_cores",),
+        dict(
+            dest="auto_cores",
+            action="store_true",
+            help="Use the core count that fills whole nodes and balances the domain decomposition",
+            default=False,
+        ),
+    ),
+    (
+        ("--performance_db",),
+        dict(
+            dest="performance_db",
+            help="Performance database of past runs (see resources/performance.py) to size cores and walltime from",
+            default=None,
+        ),
+    ),
+    (("-w", "--wall_time"), dict(dest="walltime", help="""walltime. default: 100:00:00.""", default="100:00:00")),
+    (("-q", "--queue"), dict(dest="queue", choices=list_queues(), help="""queue. default=long.""", default="long")),
+    (
+        ("-d", "--domain"),
+        dict(dest="domain", choices=list_domains(), help="sets the modeling domain", default="ismip6"),
+    ),
+    (("--exstep",), dict(dest="exstep", help="Writing interval for spatial time series", default="yearly")),
+    (
+        ("-f", "--o_format"),
+        dict(
+            dest="oformat",
+            choices=["auto", "netcdf3", "netcdf4_parallel", "netcdf4_serial", "pnetcdf"],
+            help="output format. default: the format of the experiment, or chosen by the output planner from --io_benchmark",
+            default="auto",
+        ),
+    ),
+    (
+        ("-L", "--comp_level"),
+        dict(
+            dest="compression_level",
+            type=int,
+            help="Compression level for output file. Only works with netcdf4_serial. default: 2, or chosen by the output planner from --io_benchmark",
+            default=None,
+        ),
+    ),
+    (
+        ("-g", "--grid"),
+        dict(dest="grid", type=int, choices=grid_choices, help="horizontal grid resolution", default=9000),
+    ),
+    (("--i_dir",), dict(dest="input_dir", help="input directory", default=root_directory)),
+    (("--o_dir",), dict(dest="output_dir", help="output directory", default="test_dir")),
+    (
+        ("--o_size",),
+        dict(
+            dest="osize",
+            choices=["small", "medium", "big", "big_2d", "custom"],
+            help="output size type",
+            default="custom",
+        ),
+    ),
+    (
+        ("-s", "--system"),
+        dict(dest="system", choices=list_systems(), help="computer system to use.", default="pleiades_broadwell"),
+    ),
+    (
+        ("--spatial_ts",),
+        dict(
+            dest="spatial_ts",
+            choices=["basic", "standard", "none", "ismip6"],
+            help="output size type",
+            default="standard",
+        ),
+    ),
+    (
+        ("--stable_gl",),
+        dict(
+            dest="float_kill_calve_near_grounding_line",
+            action="store_false",
+            help="Stable grounding line",
+            default=True,
+        ),
+    ),
+    (
+        ("--stress_balance",),
+        dict(dest="stress_balance", choices=["sia", "ssa+sia", "ssa"], help="stress balance solver", default="ssa+sia"),
+    ),
+    (
+        ("--vertical_velocity_approximation",),
+        dict(
+            dest="vertical_velocity_approximation",
+            choices=["centered", "upstream"],
+            help="How to approximate vertical velocities",
+            default="upstream",
+        ),
+    ),
+]
+
+# Options of generators writing one script per ensemble member.
+ensemble_arguments = [
+    (("FILE",), dict(nargs=1, help="Input file to restart from", default=None)),
+    (
+        ("--emission",),
+        dict(
+            dest="emission",
+            choices=["scripts", "array", "farm"],
+            help="Write one batch script per member, one job array, or one task farm running members concurrently",
+            default="scripts",
+        ),
+    ),
+    (
+        ("--member_cores",),
+        dict(
+            dest="member_cores",
+            type=int,
+            help="Cores per member in a task farm; -n is the size of the whole allocation",
+            default=None,
+        ),
+    ),
+    (
+        ("--extract_interface",),
+        dict(
+            dest="extract_interface",
+            action="store_true",
+            help="Extract the ice-ocean interface of the output into io/ (extract_interface.py -t ice_ocean)",
+            default=False,
+        ),
+    ),
+    (
+        ("--shared_bootstrap",),
+        dict(
+            dest="shared_bootstrap",
+            action="store_true",
+            help="Bootstrap once per initial state and start all members from it (see resources/bootstrap.py)",
+            default=False,
+        ),
+    ),
+    (("--start",), dict(help="Simulation start year", default="2008-1-1")),
+    (("--end",), dict(help="Simulation end year", default="2015-1-1")),
+    (
+        ("-e", "--ensemble_file"),
+        dict(dest="ensemble_file", help="File that has all combinations for ensemble study", default=None),
+    ),
+]
+
+# Options of generators splitting runs into restart segments.
+restart_arguments = [
+    (
+        ("--chain",),
+        dict(
+            dest="chain",
+            action="store_true",
+            help="Write scripts that submit restart segments with afterok dependencies and skip segments that are complete",
+            default=False,
+        ),
+    ),
+    (("--start_year",), dict(dest="start_year", type=int, help="Simulation start year", default=0)),
+    (("--duration",), dict(dest="duration", type=int, help="Years to simulate", default=1000)),
+    (("--step",), dict(dest="step", type=int, help="Step in years for restarting", default=1000)),
+    (
+        ("-e", "--ensemble_file"),
+        dict(dest="ensemble_file", help="File that has all combinations for ensemble study", default=None),
+    ),
+]
+
+# these Bash commands are added to the beginning of the run scrips
+run_header_template = """# stop if a variable is not defined
+set -u
+# stop on errors
+set -e
+
+# path to the config file
+config="{config}"
+# path to the input directory (input data sets are contained in this directory)
+input_dir="{input_dir}"
+# output directory
+output_dir="{output_dir}"
+# temporary directory for spatial files
+spatial_tmp_dir="{spatial_tmp_dir}"
+
+# create required output directories
+for each in {dirs};
+do
+  mkdir -p $each
+done
+
+"""
+
+
+def add_arguments(parser, arguments, overrides=None):
+    """
+    Add 'arguments', a list of (flags, keyword arguments), to 'parser'.
+    'overrides' maps an option's dest to keyword arguments replacing
+    the defaults, e.g. {"grid": {"choices": [1000], "default": 1000}}.
+    Options whose override is None are left out.
+    """
+
+    overrides = overrides or {}
+    for flags, kwargs in arguments:
+        dest = kwargs.get("dest", flags[0].lstrip("-"))
+        if dest in overrides and overrides[dest] is None:
+            continue
+        kwargs = dict(kwargs, **overrides.get(dest, {}))
+        parser.add_argument(*flags, **kwargs)
+
+
+def period_records(header, start_date=None, end_date=None):
+    """
+    Return the number of records of a forcing file (described by its
+    preflight 'header') PISM reads for a run from 'start_date' to
+    'end_date': the records in that period, assuming evenly spaced
+    records, plus one on either side for interpolation. Without dates,
+    all records.
+
+    Returns: int
+    """
+
+    records = header["records"]
+    time = header.get("time")
+    if start_date is None or end_date is None or time is None or time["max"] <= time["min"]:
+        return records
+    try:
+        start = date_value(start_date, time["units"], time["calendar"])
+        end = date_value(end_date, time["units"], time["calendar"])
+    except ValueError:
+        return records
+    overlap = max(min(end, time["max"]) - max(start, time["min"]), 0.0)
+    return min(int(math.ceil(records * overlap / (time["max"] - time["min"]))) + 2, records)
+
+
+class Run(object):
+    """
+    One generator run: the parsed 'options' and everything derived from
+    them that all scripts of the run share.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.input_dir = abspath(options.input_dir)
+        self.output_dir = abspath(options.output_dir)
+        self.spatial_tmp_dir = abspath(options.output_dir + "_tmp")
+
+        self.system = options.system
+        self.queue = options.queue
+        self.walltime = options.walltime
+        self.nn = options.n
+        self.domain = options.domain
+        self.grid = options.grid
+        self.grid_dict = generate_grid_description(self.grid, self.domain)
+        self.osize = options.osize
+        self.spatial_ts = options.spatial_ts
+        self.exstep = options.exstep
+        self.oformat = options.oformat
+        self.compression_level = options.compression_level
+
+        self.pism_exec = generate_domain(self.domain)
+        self.pism = generate_prefix_str(self.pism_exec)
+
+        self.dirs = {"output": "$output_dir", "spatial_tmp": "$spatial_tmp_dir"}
+        for d in ["performance", "state", "scalar", "spatial", "jobs", "basins"]:
+            self.dirs[d] = "$output_dir/{dir}".format(dir=d)
+        if self.spatial_ts == "none":
+            del self.dirs["spatial"]
+        if getattr(options, "extract_interface", False):
+            self.dirs["io"] = "$output_dir/io"
+
+        # use the actual path of the run scripts directory (we need it now and
+        # not during the simulation)
+        self.scripts_dir = join(self.output_dir, "run_scripts")
+        if not os.path.isdir(self.scripts_dir):
+            os.makedirs(self.scripts_dir)
+        self.manifest = ScriptManifest(join(self.scripts_dir, "manifest.json"), incremental=options.incremental)
+
+        if options.no_cache:
+            self.cache = None
+            self.crop_cache = None
+        else:
+            self.cache = FileCache(options.cache_dir)
+            # cropped forcing files are large: cache them on the file
+            # system of the output, where they are linked to
+            self.crop_cache = FileCache(join(self.output_dir, "regional_forcing", ".cache"))
+
+        self.header_index = HeaderIndex(join(options.cache_dir or default_directory(), index_name))
+        self.forcing_headers = {}
+        self.buffer_sizes = []
+        self.cropped = OrderedDict()
+        self.staged = set()
+        self.initial_states = OrderedDict()
+
+        self.config_nc = None
+        self.timefile = None
+
+    def make_config(self, pism_config):
+        """
+        Generate the config file 'pism_config'.nc in the output
+        directory from config/'pism_config'.cdl, or link it from the
+        cache.
+
+        Returns: string
+        """
+
+        self.config_nc = join(self.output_dir, pism_config + ".nc")
+        pism_config_cdl = join(self.input_dir, "config", pism_config + ".cdl")
+        if self.cache is not None:
+            self.cache.config(pism_config_cdl, self.config_nc)
+        elif not self.options.incremental or needs_update(self.config_nc, pism_config_cdl):
+            cmd = "ncgen -o {output} {input}".format(output=self.config_nc, input=pism_config_cdl)
+            sub.call(shlex.split(cmd))
+        return self.config_nc
+
+    def make_timefile(self, start_date, end_date, periodicity=None):
+        """
+        Generate the time file of a run from 'start_date' to 'end_date',
+        or link it from the cache.
+
+        Returns: string
+        """
+
+        time_dir = join(self.output_dir, "time_forcing")
+        if not os.path.isdir(time_dir):
+            os.makedirs(time_dir)
+
+        self.timefile = join(time_dir, "timefile_{start}_{end}.nc".format(start=start_date, end=end_date))
+        if self.cache is not None:
+            self.cache.timeline(start_date, end_date, periodicity, timeline_reference_date, self.timefile)
+        elif not self.options.incremental or not os.path.exists(self.timefile):
+            create_timeline(
+                self.timefile,
+                start_date,
+                end_date,
+                periodicity=periodicity or "yearly",
+                ref_date=timeline_reference_date,
+            )
+        return self.timefile
+
+    def prepare(self, years, n_members=1, step=None, ensemble_file=None, **physics):
+        """
+        Size the runs of 'years' model years (cores, walltime and, if
+        'step' is not None, the restart step), plan the output, check the
+        output budget with the planned format, and make the run and batch
+        headers. 'physics'
+        are passed to size_from_performance_db().
+
+        Returns: int or None (the restart step)
+        """
+
+        options = self.options
+
+        if options.performance_db is not None:
+            self.nn, self.walltime, step = size_from_performance_db(
+                options.performance_db,
+                self.system,
+                self.queue,
+                self.domain,
+                self.grid_dict,
+                self.nn,
+                years,
+                self.walltime,
+                step=step,
+                **physics,
+            )
+
+        if step is not None and step > years:
+            raise ValueError(
+                "restart_step > (simulation_end_year - simulation_start_year): {} > {}".format(step, years)
+            )
+
+        self.nn = allocate_cores(self.system, self.queue, self.nn, self.grid_dict, auto=options.auto_cores)
+        io_plan = plan_output_io(
+            self.system,
+            self.nn,
+            self.grid_dict,
+            self.spatial_ts,
+            self.exstep,
+            years,
+            oformat=self.oformat,
+            compression_level=self.compression_level,
+            benchmark=options.io_benchmark,
+            default_format=options.output_format,
+        )
+        self.oformat = io_plan["o_format"]
+        self.compression_level = io_plan["compression_level"]
+
+        # the budget is checked with the planned format and compression
+        exstep = check_output_budget(
+            self.spatial_ts,
+            self.grid_dict,
+            self.exstep,
+            years,
+            n_members=n_members,
+            budget=options.output_budget,
+            ensemble_budget=options.ensemble_output_budget,
+            coarsen=options.coarsen_exstep,
+            oformat=self.oformat,
+            compression_level=self.compression_level,
+        )
+        if exstep != self.exstep:
+            # stripe counts for the smaller spatial time series
+            self.exstep = exstep
+            io_plan = plan_output_io(
+                self.system,
+                self.nn,
+                self.grid_dict,
+                self.spatial_ts,
+                self.exstep,
+                years,
+                oformat=self.oformat,
+                compression_level=self.compression_level,
+                benchmark=options.io_benchmark,
+                default_format=options.output_format,
+            )
+
+        self.run_header = run_header_template.format(
+            input_dir=self.input_dir,
+            output_dir=self.output_dir,
+            spatial_tmp_dir=self.spatial_tmp_dir,
+            config=self.config_nc,
+            dirs=" ".join(list(self.dirs.values())),
+        )
+        self.run_header += stripe_commands(io_plan, self.dirs)
+
+        self.batch_header, self.batch_system = make_batch_header(self.system, self.nn, self.walltime, self.queue)
+        if getattr(options, "emission", "scripts") == "farm":
+            self.member_system = farm_member_system(self.batch_system, options.member_cores or self.nn)
+        else:
+            self.member_system = self.batch_system
+        self.post_header = make_batch_post_header(self.system)
+        if ensemble_file is None:
+            self.provenance_file = write_provenance_record(self.output_dir)
+        else:
+            self.provenance_file = write_provenance_record(self.output_dir, ensemble_file=ensemble_file)
+
+        return step
+
+    def compression_params(self):
+        """
+        Return the compression level parameter, if a level was chosen.
+
+        Returns: dict
+        """
+
+        if self.compression_level is None:
+            return {}
+        return {"output.compression_level": self.compression_level}
+
+    def profile(self):
+        """
+        Return the name of the PISM profiling output of a job.
+        """
+
+        return join(self.dirs["performance"], "profile_${job_id}.py".format(**self.member_system))
+
+    def spatial_ts_params(self, outfile):
+        """
+        Return the parameters of the spatial time series of 'outfile', or
+        an empty dict if no spatial time series are written.
+
+        Returns: dict
+        """
+
+        if self.spatial_ts == "none":
+            return {}
+        exvars = spatial_ts_vars[self.spatial_ts]
+        return generate_spatial_ts(outfile, exvars, self.exstep, odir=self.dirs["spatial_tmp"], split=False)
+
+    def command(self, script, params_dict, job_no=None, guard=None):
+        """
+        Return the command running PISM with 'params_dict' and record the
+        parameters in the manifest under 'script'. 'job_no' numbers the
+        job output of restart segments; if 'guard' (an output file) is
+        given, the command is skipped when that file is complete.
+
+        Returns: string
+        """
+
+        all_params = " \\\n  ".join(["-{} {}".format(k, v) for k, v in list(params_dict.items())])
+        self.manifest.record_params(script, params_dict)
+        commandline_options = getattr(self.options, "commandline_options", None)
+        if commandline_options is not None:
+            all_params = f"{all_params} \\\n  {commandline_options[1:-1]}"
+
+        if job_no is None:
+            job = "{jobs}/job.${job_id}"
+        else:
+            job = "{jobs}/job_{job_no}.${job_id}"
+        if self.system == "debug":
+            redirect = " 2>&1 | tee " + job
+        else:
+            redirect = " > " + job + " 2>&1"
+
+        template = "{mpido} {pism} {params}" + redirect
+
+        # members starting from a shared initial state do not bootstrap
+        initial_state = self.initial_states.get(params_dict.get("i"))
+        pism = self.pism if initial_state is None else bootstrap_re.sub("", self.pism)
+
+        context = merge_dicts(self.member_system, self.dirs, {"job_no": job_no, "pism": pism, "params": all_params})
+        cmd = template.format(**context)
+        if guard is not None:
+            cmd = guard_command(cmd, guard)
+        if initial_state is not None:
+            cmd = state_check(initial_state["state"], initial_state["script"]) + cmd
+        return cmd
+
+    def preflight(self, params_dicts, start_date=None, end_date=None):
+        """
+        Check the input files named in 'params_dicts' (one per member)
+        according to --preflight, for the period from 'start_date' to
+        'end_date' (None to skip the time check). Raises ValueError on
+        problems with --preflight strict or only.
+
+        Returns: bool (False if scripts should not be written)
+        """
+
+        mode = self.options.preflight
+        if mode == "off":
+            return True
+
+        m_domain = get_domain(self.domain)
+        index = self.header_index
+        n_files, problems = check_inputs(
+            params_dicts,
+            self.input_dir,
+            start_date,
+            end_date,
+            x_range=m_domain.get("x_range"),
+            y_range=m_domain.get("y_range"),
+            index=index,
+        )
+
+        print(
+            "Preflight: {} input files ({} indexed, {} read, {} missing), {} with problems".format(
+                n_files, index.stats["indexed"], index.stats["read"], index.stats["missing"], len(problems)
+            )
+        )
+        for k, (path, (p, uses)) in enumerate(problems.items()):
+            if k == 20:
+                print("  ... and {} more".format(len(problems) - k))
+                break
+            print("  {}: {} ({})".format(path, "; ".join(p), ", ".join("{} x{}".format(u, n) for u, n in uses.items())))
+
+        if problems and mode in ("strict", "only"):
+            raise ValueError("Preflight found problems with {} of {} input files".format(len(problems), n_files))
+        return mode != "only"
+
+    def member_params(self, params_dict, start_date=None, end_date=None):
+        """
+        Complete the parameters 'params_dict' of a member running from
+        'start_date' to 'end_date': size the forcing buffer, crop the
+        forcing of regional domains and add snapshots.
+
+        Returns: dict
+        """
+
+        params_dict = self.snapshots(self.crop_forcing(self.forcing_buffer(params_dict, start_date, end_date)))
+        return self.shared_bootstrap(params_dict, start_date)
+
+    def shared_bootstrap(self, params_dict, start_date):
+        """
+        With --shared_bootstrap, change 'params_dict' of a member that
+        bootstraps to start from the initial state shared by all members
+        with the same initial state parameters (see bootstrap.py), written
+        by a bootstrap script into state/bootstrap/ in the output
+        directory.
+
+        Returns: dict
+        """
+
+        if not getattr(self.options, "shared_bootstrap", False) or start_date is None or "bootstrap" not in params_dict:
+            return params_dict
+
+        params = initial_state_params(params_dict)
+        key = cache_key("bootstrap", self.pism, start_date, params)
+        name = "{}_g{}m_{}".format(self.domain.lower(), self.grid, key[:12])
+        directory = join(self.dirs["state"], "bootstrap")
+        state = join(directory, "initial_{}.nc".format(name))
+        if state not in self.initial_states:
+            self.initial_states[state] = OrderedDict(
+                [
+                    ("state", state),
+                    ("script", join(self.scripts_dir, "bootstrap_{}.sh".format(name))),
+                    ("params", params),
+                    ("start", start_date),
+                    ("members", 0),
+                ]
+            )
+        self.initial_states[state]["members"] += 1
+        return start_from_state(params_dict, state)
+
+    def bootstrap_scripts(self):
+        """
+        Write the scripts computing the shared initial states: a
+        zero-length run from the start date, skipped if the state is
+        complete.
+
+        Returns: list of strings
+        """
+
+        scripts = []
+        for state, initial_state in self.initial_states.items():
+            params = merge_dicts(
+                initial_state["params"], {"ys": initial_state["start"], "ye": initial_state["start"], "o": state}
+            )
+            script = initial_state["script"]
+            with self.manifest.open(script) as f:
+                f.write(self.batch_header)
+                f.write(self.run_header)
+                f.write("mkdir -p {}\n\n".format(dirname(state)))
+                f.write(self.command(script, params, guard=state))
+                f.write(self.batch_system.get("footer", ""))
+            scripts.append(script)
+        return scripts
+
+    def snapshots(self, params_dict):
+        """
+        Add snapshots at --save_times, next to the output file, to
+        'params_dict'.
+
+        Returns: dict
+        """
+
+        if self.options.save_times is None or "o" not in params_dict:
+            return params_dict
+        ofile = params_dict["o"]
+        return merge_dicts(params_dict, generate_snap_shots(basename(ofile), [self.options.save_times], dirname(ofile)))
+
+    def forcing_buffer(self, params_dict, start_date=None, end_date=None):
+        """
+        Set climate_forcing.buffer_size in 'params_dict' according to
+        --forcing_buffer. "auto" sizes it from the records of the
+        member's time-dependent forcing files (those from 'start_date'
+        to 'end_date' if given) and the memory per rank (see
+        forcing_buffer.py); if a file cannot be read the experiment's
+        value is kept.
+
+        Returns: dict
+        """
+
+        keys = [k for k in buffer_parameters if k in params_dict]
+        if not keys:
+            return params_dict
+
+        if self.options.forcing_buffer != "auto":
+            params_dict[keys[0]] = int(self.options.forcing_buffer)
+            return params_dict
+
+        files = input_files([params_dict], self.input_dir)
+        new = [path for path in files if path not in self.forcing_headers]
+        if new:
+            self.forcing_headers.update(self.header_index.headers(new))
+
+        forcing = []
+        for path, uses in files.items():
+            parameters = [p for p in uses if p in time_dependent]
+            if not parameters:
+                continue
+            header = self.forcing_headers[path]
+            if header is None or header["error"] is not None:
+                return params_dict
+            fields = set(v for p in parameters for v in input_variables[p] if v in header["time_variables"])
+            forcing.append((period_records(header, start_date, end_date), max(len(fields), 1)))
+
+        sizing = size_forcing_buffer(self.system, self.queue, self.nn, self.grid_dict, forcing)
+        if sizing is not None:
+            params_dict[keys[0]] = sizing["buffer_size"]
+            self.buffer_sizes.append(sizing)
+        return params_dict
+
+    def crop_forcing(self, params_dict):
+        """
+        Point the forcing files in 'params_dict' at copies cropped to the
+        x/y extent of a regional domain plus --crop_halo grid cells,
+        made once per file (linked from regional_forcing/.cache in the
+        output directory, see crop.py). Files
+        that cannot be cropped, and the bootstrapping file, are used as
+        they are.
+
+        Returns: dict
+        """
+
+        m_domain = get_domain(self.domain)
+        if self.options.crop_forcing == "off" or m_domain.get("x_range") is None:
+            return params_dict
+
+        for parameter, value in params_dict.items():
+            if parameter == "i" or parameter not in input_variables:
+                continue
+            m = input_dir_re.match(str(value))
+            if m is None:
+                continue
+            name = m.group(1)
+            if name not in self.cropped:
+                self.cropped[name] = self.crop(name, m_domain["x_range"], m_domain["y_range"])
+            if self.cropped[name] is not None:
+                params_dict[parameter] = self.cropped[name]
+        return params_dict
+
+    def crop(self, name, x_range, y_range):
+        """
+        Crop the input file 'name' (relative to the input directory) to
+        'x_range' and 'y_range' into regional_forcing/ in the output
+        directory.
+
+        Returns: string (the cropped file) or None if 'name' is not
+        cropped
+        """
+
+        source = join(self.input_dir, name)
+        window = read_window(source, x_range, y_range, self.options.crop_halo)
+        if window is None:
+            return None
+
+        target = join(self.output_dir, "regional_forcing", name)
+        os.makedirs(dirname(target), exist_ok=True)
+        if self.crop_cache is not None:
+            self.crop_cache.crop(source, window, target)
+        elif not self.options.incremental or needs_update(target, source):
+            crop_file(source, target, window)
+        return target
+
+    def spatial_ts_steps(self, filename, compress=False):
+        """
+        Return the steps (see staging.step_command()) done on the spatial
+        time series 'filename' after PISM exits: rechunking it for
+        --spatial_chunking, or compressing it if 'compress' is True.
+
+        Returns: list
+        """
+
+        if self.options.spatial_chunking is not None:
+            return [("rechunk", filename, filename, self.options.spatial_chunking)]
+        if compress:
+            return [("compress", filename, filename)]
+        return []
+
+    def stage(self, name, steps):
+        """
+        Return the commands of 'steps' (see staging.step_command()) done
+        on the output files of the run 'name' after PISM exits: the
+        commands themselves, or with --staging queue, a hand-off of the
+        steps to the staging worker.
+
+        Returns: string
+        """
+
+        steps = list(steps)
+        if not steps:
+            return ""
+        if self.options.staging == "queue":
+            self.staged.add(name)
+            return enqueue_command(join(self.dirs["output"], "staging"), name, steps)
+        return "\n\n".join(step_command(step) for step in steps) + "\n"
+
+    def staging_worker(self):
+        """
+        Write the batch script of the worker serving the staging tasks
+        of the run scripts.
+
+        Returns: string
+        """
+
+        queue = self.options.staging_queue or systems[self.system].get("staging_queue", self.queue)
+        jobs = self.options.staging_jobs or systems[self.system]["queue"].get(queue, 1)
+        batch_header, _ = make_batch_header(self.system, jobs, self.walltime, queue)
+        script = join(self.scripts_dir, "staging_{}_g{}m.sh".format(self.domain.lower(), self.grid))
+        write_worker_script(script, batch_header, join(self.output_dir, "staging"), jobs, len(self.staged))
+        return script
+
+    def finish(self, *script_lists):
+        """
+        Save the manifest, report changes and list the scripts written.
+        """
+
+        if self.buffer_sizes:
+            sizes = [b["buffer_size"] for b in self.buffer_sizes]
+            print(
+                "Forcing buffer: {} to {} records, at most {} per rank, {} of {} members read their forcing once".format(
+                    min(sizes),
+                    max(sizes),
+                    format_size(max(b["bytes"] for b in self.buffer_sizes)),
+                    sum(1 for b in self.buffer_sizes if b["complete"]),
+                    len(sizes),
+                )
+            )
+        cropped = [(join(self.input_dir, name), target) for name, target in self.cropped.items() if target is not None]
+        if cropped:
+            print(
+                "Regional forcing: {} of {} files cropped to the domain, {} -> {}".format(
+                    len(cropped),
+                    len(self.cropped),
+                    format_size(sum(os.path.getsize(source) for source, _ in cropped)),
+                    format_size(sum(os.path.getsize(target) for _, target in cropped)),
+                )
+            )
+        if self.initial_states:
+            script_lists += (self.bootstrap_scripts(),)
+            print(
+                "Shared bootstrap: {} initial states for {} members; run the bootstrap scripts first".format(
+                    len(self.initial_states), sum(s["members"] for s in self.initial_states.values())
+                )
+            )
+        if self.staged:
+            script_lists += ([self.staging_worker()],)
+            print("Staging: {} tasks handed to the staging worker (submit it with the runs)".format(len(self.staged)))
+        self.header_index.save()
+        self.manifest.save()
+        self.manifest.report()
+        for scripts in script_lists:
+            print("\n".join([script for script in scripts]))
+            print("\nwritten\n")
+
+
+class Experiment(object):
+    """
+    Base class of experiment plugins.
+    """
+
+    name = None
+    description = "Generating scripts for warming experiments."
+    # config/<config>.cdl is the PISM config of the experiment
+    config = "pism"
+    # options of the experiment in addition to the shared ones
+    arguments = []
+    # dest -> keyword arguments changing a shared option (None removes it)
+    overrides = {}
+    # options shared by experiments of one kind, and their overrides
+    kind_arguments = []
+    kind_overrides = {}
+    # columns of the ensemble file (an ensemble.EnsembleSchema)
+    ensemble_schema = None
+    # output format unless the planner chooses one from --io_benchmark
+    output_format = "netcdf4_parallel"
+
+    def parser(self):
+        """
+        Return the command line parser of the experiment.
+
+        Returns: ArgumentParser
+        """
+
+        parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+        parser.description = self.description
+        overrides = dict(self.kind_overrides, **self.overrides)
+        add_arguments(parser, self.kind_arguments[:1], overrides)
+        add_arguments(parser, common_arguments, overrides)
+        add_arguments(parser, self.kind_arguments[1:], overrides)
+        add_arguments(parser, self.arguments, overrides)
+        parser.set_defaults(output_format=self.output_format)
+        return parser
+
+    def load_ensemble(self, run):
+        """
+        Return the ensemble members: dicts with the columns of
+        ensemble_schema, read from the ensemble file in batches.
+        """
+
+        return EnsembleReader(run.options.ensemble_file, self.ensemble_schema)
+
+    def physics(self, options):
+        """
+        Return the physics choices used to look up past runs in the
+        performance database.
+
+        Returns: dict
+        """
+
+        return {
+            "stress_balance": options.stress_balance,
+            "hydrology": getattr(options, "hydrology", None),
+            "calving": getattr(options, "calving", None),
+        }
+
+    def generate(self, run):
+        raise NotImplementedError
+
+
+class EnsembleExperiment(Experiment):
+    """
+    An ensemble with one script per member, written as batch scripts, one
+    job array or one task farm (--emission). Subclasses implement
+    member(), returning the script name, the PISM parameters and the
+    commands to run after PISM.
+    """
+
+    kind_arguments = ensemble_arguments
+    # periodicity of the time file (None: yearly)
+    periodicity = None
+
+    def member(self, run, combination):
+        raise NotImplementedError
+
+    def generate(self, run):
+        options = run.options
+        emission = getattr(options, "emission", "scripts")
+
+        run.make_config(self.config)
+        run.make_timefile(options.start, options.end, self.periodicity)
+
+        combinations = self.load_ensemble(run)
+        ensemble_file = getattr(options, "ensemble_file", None)
+        run.prepare(
+            model_years(options.start, options.end),
+            n_members=len(combinations),
+            ensemble_file=ensemble_file,
+            **self.physics(options),
+        )
+
+        members = (self.member(run, combination)[1] for combination in combinations)
+        if not run.preflight(members, options.start, options.end):
+            return []
+
+        scripts = []
+        for combination in combinations:
+            script_name, params_dict, post = self.member(run, combination)
+            params_dict = run.member_params(params_dict, options.start, options.end)
+            script = join(run.scripts_dir, script_name)
+
+            with run.manifest.open(script) as f:
+                if emission == "scripts":
+                    f.write(run.batch_header)
+                    f.write(run.run_header)
+                f.write(run.command(script, params_dict))
+                f.write("\n")
+                f.write(post)
+                if emission == "scripts":
+                    f.write(run.batch_system.get("footer", ""))
+
+            scripts.append(script)
+
+        scripts = uniquify_list(scripts)
+
+        if emission != "scripts":
+            ensemble_script = join(
+                run.scripts_dir,
+                "{}_g{}m_{}_{}.sh".format(run.domain, run.grid, splitext(basename(ensemble_file))[0], emission),
+            )
+            if emission == "array":
+                scripts = [
+                    write_array_script(ensemble_script, scripts, run.batch_header, run.run_header, run.batch_system)
+                ]
+            elif emission == "farm":
+                scripts = [
+                    write_farm_script(
+                        ensemble_script,
+                        scripts,
+                        run.batch_header,
+                        run.run_header,
+                        run.batch_system,
+                        run.nn,
+                        options.member_cores or run.nn,
+                    )
+                ]
+
+        run.finish(scripts)
+        return scripts
+
+
+class RestartExperiment(Experiment):
+    """
+    An ensemble of runs split into restart segments of --step years. Each
+    member gets one script per segment, a script running all segments
+    (_j.sh) and, with --chain, a script submitting the segments with
+    dependencies. Subclasses implement member_name() and segment().
+    """
+
+    kind_arguments = [(("FILE",), dict(nargs=1, help="Input file to restart from", default=None))] + restart_arguments
+    kind_overrides = {
+        "performance_db": {
+            "help": "Performance database of past runs (see resources/performance.py) to size cores, walltime and restart steps from"
+        }
+    }
+    # prefix of the script names
+    prefix = "run"
+
+    def member_name(self, run, combination):
+        raise NotImplementedError
+
+    def segment(self, run, combination, outfile, start, end, regridfile):
+        """
+        Return the PISM parameters of the segment from 'start' to 'end'
+        writing 'outfile'. 'regridfile' is the output of the previous
+        segment, None for the first one.
+        """
+
+        raise NotImplementedError
+
+    def generate(self, run):
+        options = run.options
+
+        run.make_config(self.config)
+
+        combinations = self.load_ensemble(run)
+
+        simulation_start_year = options.start_year
+        simulation_end_year = options.start_year + options.duration
+        run.simulation_start_year = simulation_start_year
+        run.simulation_end_year = simulation_end_year
+
+        restart_step = run.prepare(
+            simulation_end_year - simulation_start_year,
+            n_members=len(combinations),
+            step=options.step,
+            ensemble_file=options.ensemble_file,
+            **self.physics(options),
+        )
+
+        # the first segment reads all inputs; restart runs count model
+        # years, so forcing time axes are not checked
+        first_end = simulation_start_year + restart_step
+        members = (
+            self.segment(run, combination, "preflight.nc", simulation_start_year, first_end, None)
+            for combination in combinations
+        )
+        if not run.preflight(members):
+            return []
+
+        scripts = []
+        scripts_combined = []
+        scripts_chain = []
+        footer = run.batch_system.get("footer", "")
+        for combination in combinations:
+            full_exp_name = self.member_name(run, combination)
+
+            # All runs in one script file for coarse grids that fit into max walltime
+            script_combined = join(run.scripts_dir, "{}_g{}m_{}_j.sh".format(self.prefix, run.grid, full_exp_name))
+            with run.manifest.open(script_combined) as f_combined:
+                f_combined.write(run.batch_header)
+                f_combined.write(run.run_header)
+
+                segments = []
+                regridfile = None
+                starts = range(simulation_start_year, simulation_end_year, restart_step)
+                for job_no, start in enumerate(starts, start=1):
+                    end = start + restart_step
+
+                    experiment = "_".join([full_exp_name, "{}".format(start), "{}".format(end)])
+                    script = join(run.scripts_dir, "{}_g{}m_{}.sh".format(self.prefix, run.grid, experiment))
+                    scripts.append(script)
+
+                    outfile = "{domain}_g{grid}m_{experiment}.nc".format(
+                        domain=run.domain.lower(), grid=run.grid, experiment=experiment
+                    )
+                    state_file = join(run.dirs["state"], outfile)
+
+                    params_dict = run.member_params(self.segment(run, combination, outfile, start, end, regridfile))
+                    cmd = run.command(script, params_dict, job_no=job_no, guard=state_file if options.chain else None)
+                    run.manifest.record_params(script_combined, params_dict, segment=job_no)
+
+                    with run.manifest.open(script) as f:
+                        f.write(run.batch_header)
+                        f.write(run.run_header)
+                        f.write(cmd)
+                        f.write("\n")
+                        f.write(footer)
+
+                    f_combined.write(cmd)
+                    f_combined.write("\n\n")
+
+                    regridfile = state_file
+                    segments.append((script, state_file))
+
+                f_combined.write(footer)
+
+            scripts_combined.append(script_combined)
+
+            if options.chain:
+                script_chain = join(run.scripts_dir, "{}_g{}m_{}_chain.sh".format(self.prefix, run.grid, full_exp_name))
+                scripts_chain.append(write_chain_script(script_chain, segments, run.batch_system, run.output_dir))
+
+        scripts = uniquify_list(scripts)
+        scripts_combined = uniquify_list(scripts_combined)
+        if options.chain:
+            run.finish(scripts, scripts_combined, scripts_chain)
+        else:
+            run.finish(scripts, scripts_combined)
+        return scripts + scripts_combined + scripts_chain
+
+
+experiments = OrderedDict()
+
+
+def register(cls):
+    """
+    Class decorator registering an experiment plugin under its name.
+    """
+
+    experiments[cls.name] = cls
+    return cls
+
+
+def list_experiments():
+    return list(experiments.keys())
+
+
+def generate(name, argv=None):
+    """
+    Generate the scripts of experiment 'name' with the command line
+    arguments 'argv' (a list; sys.argv[1:] if None).
+
+    Returns: list of scripts written
+    """
+
+    try:
+        experiment = experiments[name]()
+    except KeyError:
+        raise ValueError("Unknown experiment {}. Pick one of {}".format(name, list_experiments()))
+
+    options = experiment.parser().parse_args(argv)
+    return experiment.generate(Run(options))
+
+
+def main(name):
+    generate(name)
@@ -0,0 +1,217 @@
+"""
+ensemble
+========
+
+Provides the loader of ensemble files (uncertainty_qunatification/*.csv):
+
+  - a schema per experiment type: the columns, the header names they
+    may appear under, their type and, for optional columns, a default
+  - validation of the header (missing and unexpected columns) before
+    any script is written, and of every value with its line number
+  - members as dicts keyed by column name, so the column order of a
+    file does not matter
+  - reading in batches of rows, so ensembles of 10^5 members are
+    streamed in constant memory
+
+"""
+
+from collections import OrderedDict
+import csv
+from itertools import islice
+
+# marks a column without a default: it must be in the header and have
+# a value in every row
+required = object()
+
+
+class EnsembleError(ValueError):
+    """
+    Raised when an ensemble file does not match its schema.
+    """
+
+    pass
+
+
+def to_number(value):
+    """
+    Convert 'value' to an int if it is written as one and to a float
+    otherwise.
+    """
+
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+converters = {"str": str, "int": int, "float": float, "number": to_number}
+
+
+class Column(object):
+    """
+    A column of an ensemble file.
+
+    'name' is the key of the column in a member, 'headers' the names it
+    may have in the file header (matched ignoring case; defaults to
+    'name'), 'kind' one of str, int, float and number (an int if
+    written as one, a float otherwise). A column with a 'default' may be
+    missing from the file and may have empty values.
+    """
+
+    def __init__(self, name, kind="str", headers=None, default=required):
+        if kind not in converters:
+            raise ValueError("Column {}: kind must be one of {}, got {}".format(name, sorted(converters), kind))
+        self.name = name
+        self.kind = kind
+        self.headers = [h.strip().lower() for h in (headers or [name])]
+        self.default = default
+
+    @property
+    def required(self):
+        return self.default is required
+
+    def convert(self, value):
+        value = value.strip()
+        if value == "":
+            if self.required:
+                raise ValueError("no value")
+            return self.default
+        return converters[self.kind](value)
+
+
+class EnsembleSchema(object):
+    """
+    The columns of the ensemble files of an experiment type. Columns
+    not in the schema are an error unless 'allow_extra' is True.
+    """
+
+    def __init__(self, columns, allow_extra=False):
+        self.columns = list(columns)
+        self.allow_extra = allow_extra
+
+    def names(self):
+        return [c.name for c in self.columns]
+
+    def bind(self, header, filename="ensemble file"):
+        """
+        Match 'header' against the schema.
+
+        Returns: list of (column, index) pairs; index is None for
+        optional columns missing from the header
+        """
+
+        positions = OrderedDict()
+        for k, h in enumerate(header):
+            h = h.strip().lower()
+            if h in positions:
+                raise EnsembleError("{}: column '{}' appears more than once".format(filename, h))
+            positions[h] = k
+
+        binding = []
+        missing = []
+        used = set()
+        for column in self.columns:
+            index = None
+            for h in column.headers:
+                if h in positions:
+                    index = positions[h]
+                    used.add(h)
+                    break
+            if index is None and column.required:
+                missing.append("/".join(column.headers))
+            binding.append((column, index))
+
+        extra = [h for h in positions if h not in used]
+        errors = []
+        if missing:
+            errors.append("missing columns {}".format(", ".join(missing)))
+        if extra and not self.allow_extra:
+            errors.append("unexpected columns {}".format(", ".join(extra)))
+        if errors:
+            raise EnsembleError(
+                "{}: {} (expected {})".format(
+                    filename, "; ".join(errors), ", ".join("/".join(c.headers) for c in self.columns)
+                )
+            )
+        return binding
+
+    def member(self, binding, fields, filename="ensemble file", line=None):
+        """
+        Convert the 'fields' of a row to a member.
+
+        Returns: OrderedDict
+        """
+
+        member = OrderedDict()
+        for column, index in binding:
+            if index is None:
+                member[column.name] = column.default
+                continue
+            try:
+                member[column.name] = column.convert(fields[index])
+            except ValueError as e:
+                raise EnsembleError(
+                    "{}, line {}: column {}: {} is not a valid {} ({})".format(
+                        filename, line, column.name, repr(fields[index]), column.kind, e
+                    )
+                )
+        return member
+
+
+class EnsembleReader(object):
+    """
+    Members of the ensemble file 'filename' with columns 'schema'. The
+    header is checked when the reader is created; rows are read in
+    batches of 'batch_size' each time the reader is iterated over.
+    Blank lines and lines starting with # are skipped.
+    """
+
+    def __init__(self, filename, schema, batch_size=1024):
+        self.filename = filename
+        self.schema = schema
+        self.batch_size = batch_size
+        self._length = None
+        with open(filename, newline="") as f:
+            header = next(self._rows(f), (None, None))[1]
+        if header is None:
+            raise EnsembleError("{}: empty ensemble file".format(filename))
+        self.width = len(header)
+        self.binding = schema.bind(header, filename)
+
+    def _rows(self, f):
+        for line, fields in enumerate(csv.reader(f), start=1):
+            if not fields or not any(s.strip() for s in fields) or fields[0].lstrip().startswith("#"):
+                continue
+            yield line, fields
+
+    def member(self, fields, line):
+        if len(fields) != self.width:
+            raise EnsembleError(
+                "{}, line {}: expected {} values, got {}".format(self.filename, line, self.width, len(fields))
+            )
+        return self.schema.member(self.binding, fields, self.filename, line)
+
+    def batches(self):
+        """
+        Yield lists of at most 'batch_size' members.
+        """
+
+        with open(self.filename, newline="") as f:
+            rows = self._rows(f)
+            next(rows, None)
+            while True:
+                batch = [self.member(fields, line) for line, fields in islice(rows, self.batch_size)]
+                if not batch:
+                    break
+                yield batch
+
+    def __iter__(self):
+        for batch in self.batches():
+            for member in batch:
+                yield member
+
+    def __len__(self):
+        if self._length is None:
+            with open(self.filename, newline="") as f:
+                self._length = max(sum(1 for _ in self._rows(f)) - 1, 0)
+        return self._length
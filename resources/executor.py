@@ -0,0 +1,263 @@
+"""
+executor
+========
+
+Provides:
+  - a local backend for scripts generated with "-s debug": runs the
+    scripts of a run_scripts directory concurrently so that the total
+    number of MPI ranks never exceeds the cores of the machine
+  - a summary of wall time and exit status per script
+
+Usage: python executor.py [-n cores] [--pattern "*.sh"] RUN_SCRIPTS_DIR
+
+Shared bootstrap scripts (bootstrap_*.sh) always run first; the other
+scripts start once all of them succeeded. The staging worker
+(staging_*.sh) is not run unless --pattern selects it.
+
+Restart segments of one member depend on each other. For generators
+that split runs into --step segments, the combined scripts (_j.sh) run
+the segments of a member in order; by default the segment scripts they
+run and the chain scripts (_chain.sh) are left out.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import csv
+from fnmatch import fnmatch
+import glob
+import os
+from os.path import abspath, basename, join
+import re
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.realpath(os.path.dirname(__file__)))
+from resources import systems
+
+mpi_re = re.compile(r"(?:mpiexec|mpirun|srun)\s.*?(?:-n|-np|--ntasks)[\s=](\d+)")
+# job array and task farm scripts (see emission.py)
+table_re = re.compile(r"\$\(cat (\S+\.txt)\)")
+slots_re = re.compile(r"^slots=(\d+)")
+# output file of a PISM command
+output_re = re.compile(r"\s-o\s+(\S+)")
+
+bootstrap_pattern = "bootstrap_*.sh"
+combined_pattern = "*_j.sh"
+excluded_patterns = ["staging_*.sh", "*_chain.sh"]
+
+summary_fields = ["script", "cores", "status", "wall_time", "log"]
+
+
+def script_cores(script):
+    """
+    Return the largest number of MPI ranks started by 'script' (1 if it
+    does not use MPI). Job array and task farm scripts run the members
+    in their table on 'slots' workers (1 for job arrays) at a time.
+    """
+
+    cores, slots, members = 1, 1, 1
+    with open(script) as f:
+        for line in f:
+            if line.lstrip().startswith("#"):
+                continue
+            m = mpi_re.search(line)
+            if m:
+                cores = max(cores, int(m.group(1)))
+            m = slots_re.match(line)
+            if m:
+                slots = int(m.group(1))
+            m = table_re.search(line)
+            if m and os.path.exists(m.group(1)):
+                with open(m.group(1)) as table:
+                    members = max([members] + [script_cores(member.strip()) for member in table if member.strip()])
+    return max(cores, slots * members)
+
+
+def member_scripts(scripts_dir):
+    """
+    Return member scripts listed in job array and task farm tables; they
+    cannot be run on their own.
+
+    Returns: set
+    """
+
+    members = set()
+    for table in glob.glob(join(scripts_dir, "*.txt")):
+        with open(table) as f:
+            members.update(abspath(line.strip()) for line in f if line.strip())
+    return members
+
+
+def script_outputs(script):
+    """
+    Return the output files (-o) of the PISM commands in 'script'.
+
+    Returns: set
+    """
+
+    outputs = set()
+    with open(script) as f:
+        for line in f:
+            if not line.lstrip().startswith("#"):
+                outputs.update(output_re.findall(line))
+    return outputs
+
+
+def combined_segments(scripts):
+    """
+    Return the restart segment scripts among 'scripts' whose outputs are
+    all written by a combined script (_j.sh) among 'scripts'.
+
+    Returns: set
+    """
+
+    combined = set()
+    for script in scripts:
+        if fnmatch(basename(script), combined_pattern):
+            combined.update(script_outputs(script))
+
+    segments = set()
+    for script in scripts:
+        outputs = script_outputs(script)
+        if not fnmatch(basename(script), combined_pattern) and outputs and outputs <= combined:
+            segments.add(script)
+    return segments
+
+
+def select_scripts(scripts_dir, pattern=None):
+    """
+    Return the bootstrap scripts and the other scripts in 'scripts_dir'
+    matching 'pattern' (default: all scripts but the staging worker, the
+    chain scripts and the segments run by combined scripts), without the
+    members of job arrays and task farms. Bootstrap scripts are returned
+    whatever 'pattern' is, as the others depend on them.
+
+    Returns: tuple of lists
+    """
+
+    members = member_scripts(scripts_dir)
+
+    def scripts(pattern):
+        return [s for s in sorted(glob.glob(join(scripts_dir, pattern))) if abspath(s) not in members]
+
+    bootstrap = scripts(bootstrap_pattern)
+    others = [s for s in scripts(pattern or "*.sh") if s not in bootstrap]
+    if pattern is None:
+        others = [s for s in others if not any(fnmatch(basename(s), p) for p in excluded_patterns)]
+        segments = combined_segments(others)
+        others = [s for s in others if s not in segments]
+    return bootstrap, others
+
+
+def run_scripts(scripts, n_cores, log_dir, poll_interval=1.0):
+    """
+    Run 'scripts' with bash, starting a script whenever enough of the
+    'n_cores' cores are free (scripts that do not fit are started in
+    order as soon as possible, smaller ones may go first). Output of
+    each script is written to 'log_dir'.
+
+    Returns: list of OrderedDict (see summary_fields)
+    """
+
+    job_id = systems["debug"]["job_id"]
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    pending = [(script, script_cores(script)) for script in scripts]
+    running = {}
+    results = OrderedDict()
+
+    for script, cores in pending:
+        result = OrderedDict([("script", script), ("cores", cores), ("status", ""), ("wall_time", ""), ("log", "")])
+        if cores > n_cores:
+            print("Skipping {}: needs {} cores, {} available".format(basename(script), cores, n_cores))
+            result["status"] = "skipped"
+        results[script] = result
+    pending = [(s, c) for s, c in pending if c <= n_cores]
+
+    free = n_cores
+    k = 0
+    while pending or running:
+        for script, cores in list(pending):
+            if cores <= free:
+                pending.remove((script, cores))
+                k += 1
+                env = dict(os.environ)
+                env[job_id] = "local_{}".format(k)
+                log = join(log_dir, basename(script) + ".log")
+                log_file = open(log, "w")
+                process = subprocess.Popen(["bash", script], stdout=log_file, stderr=subprocess.STDOUT, env=env)
+                running[script] = (process, cores, time.time(), log_file)
+                results[script]["log"] = log
+                free -= cores
+                print("Started {} on {} cores ({} free)".format(basename(script), cores, free))
+
+        for script, (process, cores, start, log_file) in list(running.items()):
+            status = process.poll()
+            if status is not None:
+                log_file.close()
+                del running[script]
+                free += cores
+                results[script]["status"] = status
+                results[script]["wall_time"] = "{:.1f}".format(time.time() - start)
+                print(
+                    "Finished {} with status {} after {} s".format(
+                        basename(script), status, results[script]["wall_time"]
+                    )
+                )
+
+        if running:
+            time.sleep(poll_interval)
+
+    return list(results.values())
+
+
+def write_summary(filename, results):
+    """
+    Write the per-script summary as CSV.
+    """
+
+    with open(filename, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=summary_fields)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Run scripts generated for the debug system concurrently on this machine."
+    parser.add_argument("SCRIPTS_DIR", nargs=1, help="run_scripts directory")
+    parser.add_argument(
+        "-n", "--n_procs", dest="n", type=int, help="number of cores to use", default=os.cpu_count() or 1
+    )
+    parser.add_argument("--pattern", dest="pattern", help="scripts to run. default: all but staging_*.sh", default=None)
+    parser.add_argument(
+        "-o", "--summary", dest="summary", help="summary file. default: SCRIPTS_DIR/local_summary.csv", default=None
+    )
+    options = parser.parse_args()
+
+    scripts_dir = abspath(options.SCRIPTS_DIR[0])
+    log_dir = join(scripts_dir, "local_logs")
+    bootstrap, scripts = select_scripts(scripts_dir, options.pattern)
+
+    # the other scripts start from the shared bootstrap states
+    results = run_scripts(bootstrap, options.n, log_dir)
+    if any(r["status"] != 0 for r in results):
+        print("Bootstrap failed, skipping {} scripts".format(len(scripts)))
+        for script in scripts:
+            results.append(
+                OrderedDict([("script", script), ("cores", ""), ("status", "skipped"), ("wall_time", ""), ("log", "")])
+            )
+    else:
+        results += run_scripts(scripts, options.n, log_dir)
+
+    summary = options.summary or join(scripts_dir, "local_summary.csv")
+    write_summary(summary, results)
+
+    failed = [r for r in results if r["status"] != 0]
+    print("\n{} scripts, {} failed or skipped, summary written to {}".format(len(results), len(failed), summary))
+    sys.exit(1 if failed else 0)
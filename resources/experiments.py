@@ -0,0 +1,869 @@
+"""
+experiments
+===========
+
+Provides the experiment plugins of the run script generators:
+
+  - historical: historical simulations for ISMIP6
+  - prognostic_core, prognostic_open: prognostic simulations for ISMIP6
+  - initialization: ISMIP6 initialization (ctrl and asmb runs)
+  - variability: climate variability experiments in restart segments
+  - synthetic: synthetic outlet glacier experiments in restart segments
+
+Use generate(name, argv) to generate the scripts of an experiment
+in-process, e.g. generate("historical", ["-e", "historical_jib.csv", "in.nc"]).
+
+"""
+
+from os.path import join, splitext
+
+from ensemble import Column, EnsembleSchema
+from engine import EnsembleExperiment, RestartExperiment, generate, grid_choices, list_experiments, main, register
+from resources import *
+
+regridvars = "litho_temp,enthalpy,age,tillwat,bmelt,ice_area_specific_volume,thk"
+
+# sliding parameters of the Greenland experiments
+ssa_n = 3.25
+ssa_e = 1.0
+tefo = 0.020
+phi_min = 5.0
+phi_max = 40.0
+topg_min = -700
+topg_max = 700
+
+bed_type_argument = (
+    ("-b", "--bed_type"),
+    dict(dest="bed_type", choices=list_bed_types(), help="output size type", default="wc"),
+)
+version_argument = (
+    ("--dataset_version",),
+    dict(dest="version", choices=["2", "3", "3a", "4"], help="input data set version", default="3a"),
+)
+hydrology_argument = (
+    ("--hydrology",),
+    dict(
+        dest="hydrology",
+        choices=["routing", "routing_steady", "diffuse"],
+        help="Basal hydrology model.",
+        default="diffuse",
+    ),
+)
+calving_argument = (
+    ("--calving",),
+    dict(
+        dest="calving",
+        choices=["vonmises_calving", "hayhurst_calving"],
+        help="Choose calving law",
+        default="vonmises_calving",
+    ),
+)
+
+
+def greenland_dataname(domain, grid, version, bed_type):
+    """
+    Return the bootstrapping data set of a Greenland domain.
+
+    Returns: string
+    """
+
+    if domain.lower() in ("greenland_ext", "gris_ext"):
+        return "$input_dir/data_sets/bed_dem/pism_Greenland_ext_{}m_mcb_jpl_v{}_{}.nc".format(grid, version, bed_type)
+    elif domain.lower() == "ismip6":
+        return "$input_dir/data_sets/bed_dem/pism_Greenland_ismip6_{}m_mcb_jpl_v{}_{}.nc".format(
+            grid, version, bed_type
+        )
+    else:
+        return "$input_dir/data_sets/bed_dem/pism_Greenland_{}m_mcb_jpl_v{}_{}.nc".format(grid, version, bed_type)
+
+
+def member_id(run_id, fmt="{:03d}"):
+    """
+    Format a run id, zero padded if it is a number.
+    """
+
+    try:
+        return fmt.format(int(run_id))
+    except:
+        return "{}".format(run_id)
+
+
+def experiment_name(name_options, *parts):
+    """
+    Join the 'name_options' (key, value pairs) and 'parts' to an
+    experiment name.
+    """
+
+    return "_".join(
+        [p for p in parts[:1]]
+        + ["_".join(["_".join([k, str(v)]) for k, v in list(name_options.items())])]
+        + ["{}".format(p) for p in parts[1:]]
+    )
+
+
+@register
+class Historical(EnsembleExperiment):
+    """
+    Historical simulations for ISMIP6.
+    """
+
+    name = "historical"
+    periodicity = "daily"
+    output_format = "netcdf4_serial"
+    overrides = {
+        "exstep": {"default": "monthly"},
+        "spatial_ts": {"choices": ["basic", "standard", "none", "ismip6", "strain"]},
+        "stress_balance": {"choices": ["sia", "ssa+sia", "ssa", "blatter"]},
+        "version": {"choices": ["2", "3", "3a", "4", "1980", "1980a", "1980v3", "1_RAGIS"], "default": "1_RAGIS"},
+    }
+    arguments = [
+        (("--options",), dict(dest="commandline_options", help="""Here you can add command-line options""")),
+        (("--tsstep",), dict(dest="tsstep", help="Writing interval for scalar time series", default="daily")),
+        (
+            ("-r", "--refinement_factor"),
+            dict(
+                dest="refinement_factor",
+                type=int,
+                help="Horizontal grid refinement factor. For regional models only",
+                default=None,
+            ),
+        ),
+        bed_type_argument,
+        hydrology_argument,
+        calving_argument,
+        version_argument,
+    ]
+    ensemble_schema = EnsembleSchema(
+        [
+            Column("run_id", headers=["", "id"]),
+            Column("climate", headers=["ctype"]),
+            Column("hydrology", headers=["htype"]),
+            Column("frontal_melt", headers=["ftype"]),
+            Column("climate_file", headers=["climate"]),
+            Column("runoff_file", headers=["ru"]),
+            Column("frontal_melt_file", headers=["theta"]),
+            Column("calving_rate_scaling_file", headers=["scav"], default=None),
+            Column("fm_a", "number", headers=["a"], default=None),
+            Column("fm_b", "number", headers=["b"], default=None),
+            Column("fm_alpha", "number", headers=["alpha"], default=None),
+            Column("fm_beta", "number", headers=["beta"], default=None),
+            Column("vcm", headers=["vcm"]),
+            Column("calving_threshold", "number", headers=["tct"]),
+            Column("gamma_T", "number", headers=["gamma_t"]),
+            Column("salinity", "number", headers=["s"], default=None),
+            Column("ppq", "number", headers=["ppq"]),
+            Column("sia_e", "number", headers=["siae"]),
+        ]
+    )
+
+    def member(self, run, combination):
+        options = run.options
+        run_id = combination["run_id"]
+        climate = combination["climate"]
+        hydrology = combination["hydrology"]
+        frontal_melt = combination["frontal_melt"]
+        climate_file = combination["climate_file"]
+        runoff_file = combination["runoff_file"]
+        frontal_melt_file = combination["frontal_melt_file"]
+        calving_rate_scaling_file = combination["calving_rate_scaling_file"]
+        vcm = combination["vcm"]
+        calving_threshold = combination["calving_threshold"]
+        gamma_T = combination["gamma_T"]
+        salinity = combination["salinity"]
+        ppq = combination["ppq"]
+        sia_e = combination["sia_e"]
+
+        refinement_factor = options.refinement_factor
+        if refinement_factor is not None:
+            grid_resolution = int(run.grid / refinement_factor)
+        else:
+            grid_resolution = run.grid
+
+        vversion = "v" + str(options.version)
+        experiment = experiment_name({"id": member_id(run_id)}, vversion, options.start, options.end)
+        outfile = f"{run.domain}_g{grid_resolution}m_{experiment}.nc"
+
+        general_params_dict = {
+            "profile": run.profile(),
+            "time_file": run.timefile,
+            "o_format": run.oformat,
+            "config_override": "$config",
+        }
+        general_params_dict.update(run.compression_params())
+
+        if "-regional" in run.pism and refinement_factor is not None:
+            general_params_dict["refinement_factor"] = refinement_factor
+
+        general_params_dict["o"] = join(run.dirs["state"], outfile)
+        general_params_dict["bootstrap"] = ""
+        general_params_dict["i"] = greenland_dataname(run.domain, run.grid, options.version, options.bed_type)
+        general_params_dict["regrid_file"] = options.FILE[0]
+        general_params_dict["regrid_vars"] = regridvars
+
+        if run.osize != "custom":
+            general_params_dict["o_size"] = run.osize
+        else:
+            general_params_dict["output.sizes.medium"] = "sftgif,velsurf_mag,mask,usurf,bmelt"
+
+        sb_params_dict = {
+            "sia_e": sia_e,
+            "ssa_e": ssa_e,
+            "ssa_n": ssa_n,
+            "pseudo_plastic_q": ppq,
+            "till_effective_fraction_overburden": tefo,
+            "vertical_velocity_approximation": options.vertical_velocity_approximation,
+            "stress_balance.blatter.enhancement_factor": sia_e,
+        }
+        sb_params_dict["topg_to_phi"] = "{},{},{},{}".format(phi_min, phi_max, topg_min, topg_max)
+
+        climate_parameters = {
+            "climate_forcing.buffer_size": 367,
+            "surface_given_file": "$input_dir/data_sets/ismip6/{}".format(climate_file),
+        }
+
+        hydrology_parameters = {
+            "hydrology.routing.include_floating_ice": True,
+            "hydrology.surface_input_file": "$input_dir/data_sets/ismip6/{}".format(runoff_file),
+            "hydrology.routing.add_water_input_to_till_storage": False,
+            "hydrology.add_water_input_to_till_storage": False,
+        }
+        hydro_params_dict = generate_hydrology(hydrology, **hydrology_parameters)
+
+        if frontal_melt == "discharge_routing":
+            frontalmelt_params_dict = {
+                "frontal_melt": "routing",
+                "frontal_melt.routing.file": f"$input_dir/data_sets/ocean/{frontal_melt_file}",
+            }
+        else:
+            frontalmelt_params_dict = {
+                "frontal_melt": "discharge_given",
+                "frontal_melt.discharge_given.file": f"$input_dir/data_sets/ocean/{frontal_melt_file}",
+            }
+
+        ocean_parameters = {
+            "ocean.th.file": f"$input_dir/data_sets/ocean/{frontal_melt_file}",
+            "ocean.th.clip_salinity": False,
+            "ocean.th.gamma_T": gamma_T,
+        }
+        if salinity:
+            ocean_parameters["constants.sea_water.salinity"] = salinity
+
+        try:
+            vcm = float(vcm)
+            calving_parameters = {
+                "float_kill_calve_near_grounding_line": options.float_kill_calve_near_grounding_line,
+                "calving.vonmises_calving.sigma_max": vcm * 1e6,
+                "calving.vonmises_calving.use_custom_flow_law": True,
+                "calving.vonmises_calving.Glen_exponent": 3.0,
+                "calving.thickness_calving.threshold": calving_threshold,
+            }
+        except:
+            calving_parameters = {
+                "float_kill_calve_near_grounding_line": options.float_kill_calve_near_grounding_line,
+                "calving.vonmises_calving.threshold_file": f"$input_dir/data_sets/calving/{vcm}",
+                "calving.vonmises_calving.use_custom_flow_law": True,
+                "calving.vonmises_calving.Glen_exponent": 3.0,
+            }
+        if calving_rate_scaling_file:
+            calving_parameters["calving.rate_scaling.file"] = (
+                f"$input_dir/data_sets/calving/{calving_rate_scaling_file}"
+            )
+            calving_parameters["calving.rate_scaling.period"] = 0
+
+        spatial_ts_dict = run.spatial_ts_params(outfile)
+        all_params_dict = merge_dicts(
+            general_params_dict,
+            generate_grid_description(run.grid, run.domain),
+            generate_stress_balance(options.stress_balance, sb_params_dict),
+            generate_climate(climate, **climate_parameters),
+            generate_ocean("th", **ocean_parameters),
+            hydro_params_dict,
+            frontalmelt_params_dict,
+            generate_calving(options.calving, **calving_parameters),
+            generate_scalar_ts(outfile, options.tsstep, odir=run.dirs["scalar"]),
+            spatial_ts_dict,
+        )
+
+        steps = []
+        if options.extract_interface:
+            steps.append(("extract_interface", general_params_dict["o"], join(run.dirs["io"], "io_" + outfile)))
+        if spatial_ts_dict:
+            steps.extend(run.spatial_ts_steps(spatial_ts_dict["extra_file"]))
+            steps.append(("move", spatial_ts_dict["extra_file"], join(run.dirs["spatial"], "ex_" + outfile)))
+        post = "\n" + run.stage(splitext(outfile)[0], steps) + "\n"
+
+        return f"{run.domain}_g{grid_resolution}m_{experiment}.sh", all_params_dict, post
+
+
+class PrognosticExperiment(EnsembleExperiment):
+    """
+    Prognostic simulations for ISMIP6, restarting from FILE. Subclasses
+    add columns to the ensemble file and forcing parameters.
+    """
+
+    description = "Generating scripts for warming experiments."
+    config = "ismip6"
+    overrides = {
+        "exstep": {"default": "yearly"},
+        "grid": {"default": 1000},
+        "osize": {"choices": ["small", "medium", "big", "big_2d", "custom", "none"], "default": "none"},
+        "spatial_ts": {"default": "ismip6"},
+        "start": {"default": "2015-1-1"},
+        "end": {"default": "2101-1-1"},
+    }
+    arguments = [bed_type_argument, hydrology_argument, calving_argument, version_argument]
+    # columns of the ensemble files of all prognostic experiments
+    columns = [
+        Column("run_id", headers=["exp", "", "id"]),
+        Column("climate_file", headers=["climate"]),
+    ]
+
+    def forcing_params(self, run, member):
+        """
+        Return the parameter dicts added after the climate parameters.
+        """
+
+        raise NotImplementedError
+
+    def member(self, run, member):
+        options = run.options
+
+        experiment = experiment_name(
+            {"id": member_id(member["run_id"])}, "v" + str(options.version), options.start, options.end
+        )
+        outfile = "{domain}_g{grid}m_{experiment}.nc".format(
+            domain=run.domain.lower(), grid=run.grid, experiment=experiment
+        )
+        state_file = join(run.dirs["state"], outfile)
+
+        general_params_dict = {
+            "time_file": run.timefile,
+            "o": state_file,
+            "o_format": run.oformat,
+            "config_override": "$config",
+        }
+        general_params_dict.update(run.compression_params())
+
+        general_params_dict["bootstrap"] = ""
+        general_params_dict["i"] = greenland_dataname(run.domain, run.grid, options.version, options.bed_type)
+        general_params_dict["regrid_file"] = options.FILE[0]
+        general_params_dict["regrid_vars"] = regridvars
+
+        if run.osize != "custom":
+            general_params_dict["o_size"] = run.osize
+        else:
+            general_params_dict["output.sizes.medium"] = "sftgif,velsurf_mag"
+
+        sb_params_dict = {
+            "sia_e": member["sia_e"],
+            "ssa_e": ssa_e,
+            "ssa_n": ssa_n,
+            "pseudo_plastic_q": member["ppq"],
+            "till_effective_fraction_overburden": tefo,
+            "vertical_velocity_approximation": options.vertical_velocity_approximation,
+        }
+        sb_params_dict["topg_to_phi"] = "{},{},{},{}".format(phi_min, phi_max, topg_min, topg_max)
+
+        climate_params_dict = {
+            "climate_forcing.buffer_size": 367,
+            "surface": "ismip6",
+            "surface_ismip6_file": "$input_dir/data_sets/ismip6/{}".format(member["climate_file"]),
+            "surface_ismip6_reference_file": options.FILE[0],
+        }
+
+        spatial_ts_dict = run.spatial_ts_params(outfile)
+        all_params_dict = merge_dicts(
+            general_params_dict,
+            generate_grid_description(run.grid, run.domain),
+            generate_stress_balance(options.stress_balance, sb_params_dict),
+            climate_params_dict,
+            *self.forcing_params(run, member),
+            generate_scalar_ts(outfile, "yearly", odir=run.dirs["scalar"], **{"ts_vars": "ismip6"}),
+            spatial_ts_dict,
+        )
+
+        state_steps = []
+        if not run.osize == "none":
+            state_steps.append(("compress", state_file, state_file))
+        spatial_steps = []
+        if spatial_ts_dict:
+            spatial_steps.extend(run.spatial_ts_steps(spatial_ts_dict["extra_file"], compress=True))
+            if options.extract_interface:
+                spatial_steps.append(
+                    ("extract_interface", spatial_ts_dict["extra_file"], join(run.dirs["io"], "io_" + outfile))
+                )
+        post = "\n"
+        post += run.stage(splitext(outfile)[0], state_steps)
+        post += "\n"
+        post += run.stage("ex_" + splitext(outfile)[0], spatial_steps)
+        post += "\n"
+
+        return "{}_g{}m_{}.sh".format(run.domain, run.grid, experiment), all_params_dict, post
+
+
+@register
+class PrognosticCore(PrognosticExperiment):
+    """
+    Prognostic simulations for ISMIP6 with prescribed front retreat.
+    """
+
+    name = "prognostic_core"
+
+    ensemble_schema = EnsembleSchema(
+        PrognosticExperiment.columns
+        + [
+            Column("ppq", "number", headers=["ppq"]),
+            Column("sia_e", "number", headers=["siae"]),
+            Column("front_retreat_file", headers=["frf"]),
+        ]
+    )
+
+    def physics(self, options):
+        return {"stress_balance": options.stress_balance, "hydrology": options.hydrology, "calving": None}
+
+    def forcing_params(self, run, member):
+        front_retreat_params_dict = {
+            "front_retreat_file": "$input_dir/data_sets/front_retreat/{}".format(member["front_retreat_file"])
+        }
+        return [generate_hydrology(run.options.hydrology), front_retreat_params_dict]
+
+
+@register
+class PrognosticOpen(PrognosticExperiment):
+    """
+    Prognostic simulations for ISMIP6 with frontal melt and calving.
+    """
+
+    name = "prognostic_open"
+    overrides = dict(
+        PrognosticExperiment.overrides,
+        osize={"default": "custom"},
+        stress_balance={"choices": ["sia", "ssa+sia", "ssa", "blatter"]},
+    )
+
+    ensemble_schema = EnsembleSchema(
+        PrognosticExperiment.columns
+        + [
+            Column("runoff_file", headers=["ru"]),
+            Column("frontal_melt_file", headers=["theta"]),
+            Column("fm_a", "number", headers=["a"], default=None),
+            Column("fm_b", "number", headers=["b"], default=None),
+            Column("fm_alpha", "number", headers=["alpha"], default=None),
+            Column("fm_beta", "number", headers=["beta"], default=None),
+            Column("vcm", headers=["vcm"]),
+            Column("ppq", "number", headers=["ppq"]),
+            Column("sia_e", "number", headers=["siae"]),
+        ]
+    )
+
+    def forcing_params(self, run, member):
+        options = run.options
+
+        frontalmelt_params_dict = {
+            "frontal_melt": "discharge_given",
+            "frontal_melt.discharge_given.file": "$input_dir/data_sets/ismip6/{}".format(member["frontal_melt_file"]),
+        }
+
+        vcm = member["vcm"]
+        try:
+            vcm = float(vcm)
+            calving_parameters = {
+                "float_kill_calve_near_grounding_line": options.float_kill_calve_near_grounding_line,
+                "calving.vonmises_calving.sigma_max": vcm * 1e6,
+                "calving.vonmises_calving.use_custom_flow_law": True,
+                "calving.vonmises_calving.Glen_exponent": 3.0,
+            }
+        except:
+            calving_parameters = {
+                "float_kill_calve_near_grounding_line": options.float_kill_calve_near_grounding_line,
+                "calving.vonmises_calving.threshold_file": "$input_dir/data_sets/calving/{}".format(vcm),
+                "calving.vonmises_calving.use_custom_flow_law": True,
+                "calving.vonmises_calving.Glen_exponent": 3.0,
+            }
+
+        return [
+            {},
+            generate_hydrology(options.hydrology),
+            frontalmelt_params_dict,
+            generate_calving(options.calving, **calving_parameters),
+        ]
+
+
+@register
+class Initialization(EnsembleExperiment):
+    """
+    Initialization for ISMIP6: the ctrl run and the asmb run.
+    """
+
+    name = "initialization"
+    config = "ismip6"
+    overrides = {
+        "domain": {"choices": ["ismip6"]},
+        "exstep": {"default": 5},
+        "grid": {"choices": [1000], "default": 1000},
+        "osize": {"choices": ["small", "medium", "big", "big_2d", "custom", "none"], "default": "none"},
+        "spatial_ts": {"choices": ["ismip6", "none"], "default": "ismip6"},
+        "emission": None,
+        "member_cores": None,
+        "ensemble_file": None,
+        "end": {"default": "2108-1-1"},
+    }
+    arguments = [
+        bed_type_argument,
+        version_argument,
+        (("-e", "--experiment"), dict(dest="exp", choices=["ctrl", "asmb"], help="output size type", default="ctrl")),
+    ]
+
+    anomaly_file = "$input_dir/data_sets/ismip6/initMIP_climate_forcing_anomalies_2008_2108.nc"
+    sia_e = 1.25
+    ppq = 0.6
+
+    def load_ensemble(self, run):
+        return [run.options.exp]
+
+    def physics(self, options):
+        return {"stress_balance": options.stress_balance, "hydrology": "diffuse", "calving": None}
+
+    def member(self, run, exp):
+        options = run.options
+        pism_dataname = greenland_dataname(run.domain, run.grid, options.version, options.bed_type)
+
+        experiment = experiment_name({"exp": exp}, "v" + str(options.version), options.start, options.end)
+        outfile = "{domain}_g{grid}m_{experiment}.nc".format(
+            domain=run.domain.lower(), grid=run.grid, experiment=experiment
+        )
+
+        general_params_dict = {
+            "profile": run.profile(),
+            "time_file": run.timefile,
+            "o": join(run.dirs["state"], outfile),
+            "o_format": run.oformat,
+            "config_override": "$config",
+        }
+        general_params_dict.update(run.compression_params())
+
+        general_params_dict["bootstrap"] = ""
+        general_params_dict["i"] = pism_dataname
+        general_params_dict["regrid_file"] = options.FILE[0]
+        general_params_dict["regrid_vars"] = regridvars
+
+        if run.osize != "custom":
+            general_params_dict["o_size"] = run.osize
+        else:
+            general_params_dict["output.sizes.medium"] = "sftgif,velsurf_mag"
+
+        sb_params_dict = {
+            "sia_e": self.sia_e,
+            "ssa_e": ssa_e,
+            "ssa_n": ssa_n,
+            "pseudo_plastic_q": self.ppq,
+            "till_effective_fraction_overburden": tefo,
+            "vertical_velocity_approximation": options.vertical_velocity_approximation,
+        }
+        sb_params_dict["topg_to_phi"] = "{},{},{},{}".format(phi_min, phi_max, topg_min, topg_max)
+
+        if exp == "ctrl":
+            climate = "given"
+            climate_parameters = {"climate_forcing.buffer_size": 367, "surface_given_file": pism_dataname}
+        else:
+            climate = "anomaly"
+            climate_parameters = {
+                "climate_forcing.buffer_size": 367,
+                "surface_given_file": pism_dataname,
+                "surface_anomaly_file": self.anomaly_file,
+            }
+
+        all_params_dict = merge_dicts(
+            general_params_dict,
+            generate_grid_description(run.grid, run.domain),
+            generate_stress_balance(options.stress_balance, sb_params_dict),
+            generate_climate(climate, **climate_parameters),
+            {},
+            generate_hydrology("diffuse"),
+            {"front_retreat_file": pism_dataname},
+            generate_scalar_ts(outfile, "yearly", odir=run.dirs["scalar"], ts_vars="ismip6"),
+            run.spatial_ts_params(outfile),
+        )
+
+        return "{}_g{}m_{}.sh".format(run.domain, run.grid, experiment), all_params_dict, ""
+
+
+@register
+class Variability(RestartExperiment):
+    """
+    Climate variability experiments, restarting from FILE.
+    """
+
+    name = "variability"
+    prefix = "lhs"
+    overrides = {
+        "domain": {"choices": ["gris", "gris_ext"], "default": "gris"},
+        "exstep": {"default": 1},
+        "grid": {"choices": [g for g in grid_choices if g != 1000]},
+        "spatial_ts": {"choices": ["basic", "standard", "none", "svs", "divq", "variability"], "default": "basic"},
+        "hydrology": {"choices": ["null", "diffuse", "routing"]},
+        "calving": {"choices": ["float_kill", "vonmises_calving"], "help": "calving"},
+        "version": {"choices": ["2", "3", "3a"]},
+    }
+    arguments = [
+        calving_argument,
+        bed_type_argument,
+        (
+            ("--forcing_type",),
+            dict(dest="forcing_type", choices=["ctrl", "e_age"], help="output size type", default="ctrl"),
+        ),
+        hydrology_argument,
+        (
+            ("-p", "--params"),
+            dict(dest="params_list", help="Comma-separated list with params for sensitivity", default=None),
+        ),
+        version_argument,
+    ]
+
+    ensemble_schema = EnsembleSchema(
+        [
+            Column("run_id", headers=["", "id"]),
+            Column("climate_file", headers=["climate"]),
+            Column("ppq", "number", headers=["ppq"]),
+            Column("sia_e", "number", headers=["siae"]),
+        ]
+    )
+
+    def physics(self, options):
+        return {"stress_balance": options.stress_balance, "hydrology": options.hydrology, "calving": None}
+
+    def member_name(self, run, combination):
+        return experiment_name({"id": "{}".format(combination["run_id"])}, "v" + str(run.options.version))
+
+    def segment(self, run, combination, outfile, start, end, regridfile):
+        options = run.options
+        climate_file = combination["climate_file"]
+        ppq = combination["ppq"]
+        sia_e = combination["sia_e"]
+        pism_dataname = greenland_dataname(run.domain, run.grid, options.version, options.bed_type)
+
+        general_params_dict = {
+            "ys": start,
+            "ye": end,
+            "calendar": "365_day",
+            "climate_forcing_buffer_size": 365,
+            "o": join(run.dirs["state"], outfile),
+            "o_format": run.oformat,
+            "config_override": "$config",
+        }
+        general_params_dict.update(run.compression_params())
+
+        if regridfile is None:
+            general_params_dict["bootstrap"] = ""
+            general_params_dict["i"] = pism_dataname
+            general_params_dict["regrid_file"] = options.FILE[0]
+            general_params_dict["regrid_vars"] = regridvars
+        else:
+            general_params_dict["i"] = regridfile
+
+        if run.osize != "custom":
+            general_params_dict["o_size"] = run.osize
+        else:
+            general_params_dict["output.sizes.medium"] = "sftgif,velsurf_mag"
+
+        sb_params_dict = {
+            "sia_e": sia_e,
+            "ssa_e": ssa_e,
+            "ssa_n": ssa_n,
+            "pseudo_plastic_q": ppq,
+            "till_effective_fraction_overburden": tefo,
+            "vertical_velocity_approximation": options.vertical_velocity_approximation,
+        }
+        if regridfile is None:
+            sb_params_dict["topg_to_phi"] = "{},{},{},{}".format(phi_min, phi_max, topg_min, topg_max)
+
+        climate_params_dict = {
+            "climate_forcing.buffer_size": 367,
+            "surface": "given",
+            "surface_given_file": "$input_dir/data_sets/ismip6/{}".format(climate_file),
+            "surface_given_period": 30,
+        }
+
+        return merge_dicts(
+            general_params_dict,
+            generate_grid_description(run.grid, run.domain, restart=regridfile is not None),
+            generate_stress_balance(options.stress_balance, sb_params_dict),
+            climate_params_dict,
+            {"front_retreat_file": pism_dataname},
+            {},
+            generate_hydrology(options.hydrology),
+            {},
+            generate_scalar_ts(
+                outfile, "yearly", start=run.simulation_start_year, end=run.simulation_end_year, odir=run.dirs["scalar"]
+            ),
+            run.spatial_ts_params(outfile),
+        )
+
+
+@register
+class Synthetic(RestartExperiment):
+    """
+    Synthetic outlet glacier experiments with an elevation-dependent
+    climate, bootstrapped from the synthetic geometry.
+    """
+
+    name = "synthetic"
+    description = "Generating scripts for model initialization."
+    overrides = {
+        "FILE": None,
+        "domain": {"choices": ["synth_jib", "synth_ellps"], "default": "synth_jib"},
+        "exstep": {"default": 1},
+        "grid": {"choices": (250, 500, 1000, 2000, 5000, 10000, 20000, 40000), "default": 1000},
+        "spatial_ts": {"choices": ["basic", "pdd", "outlet"], "default": "outlet"},
+        "ensemble_file": {"default": "outletglacier.csv"},
+    }
+    arguments = [
+        (
+            ("-i", "--initial_state_file"),
+            dict(dest="initialstatefile", help="Input file to restart from", default=None),
+        ),
+        (
+            ("--calving",),
+            dict(
+                dest="calving",
+                choices=[
+                    "float_kill",
+                    "vonmises_calving",
+                    "eigen_calving",
+                    "vonmises_nofloat_calving",
+                    "hayhurst_calving",
+                    "hayhurst_nofloat_calving",
+                ],
+                help="calving",
+                default="float_kill",
+            ),
+        ),
+        (
+            ("--test_climate_models",),
+            dict(
+                dest="test_climate_models",
+                action="store_true",
+                help="Turn off ice dynamics and mass transport to test climate models",
+                default=False,
+            ),
+        ),
+    ]
+
+    sia_e = 1.5
+    ssa_e = 3.0
+    ppq = 0.6
+    ttphi = "{},{},{},{}".format(15.0, 45.0, -900, 500)
+
+    ensemble_schema = EnsembleSchema(
+        [
+            Column("run_id", headers=["id"]),
+            Column("m_min", "number"),
+            Column("m_max", "number"),
+            Column("h_min", "number"),
+            Column("h_ela", "number"),
+            Column("h_max", "number"),
+            Column("vct", "float"),
+            Column("hydrology", headers=["hydro"]),
+            Column("frontal_melt_file"),
+        ]
+    )
+
+    def physics(self, options):
+        return {"stress_balance": options.stress_balance, "hydrology": None, "calving": options.calving}
+
+    def member_name(self, run, combination):
+        return experiment_name({"id": member_id(combination["run_id"], fmt="{:d}")})
+
+    def segment(self, run, combination, outfile, start, end, regridfile):
+        options = run.options
+        m_min, m_max, h_min, h_ela, h_max = [combination[k] for k in ("m_min", "m_max", "h_min", "h_ela", "h_max")]
+        vct = combination["vct"]
+        hydrology = combination["hydrology"]
+        frontal_melt_file = combination["frontal_melt_file"]
+        pism_dataname = "pism_{}_g{}m.nc".format(run.domain.lower(), run.grid)
+
+        general_params_dict = {
+            "ys": start,
+            "ye": end,
+            "calendar": "365_day",
+            "climate_forcing_buffer_size": 365,
+            "o": join(run.dirs["state"], outfile),
+            "o_format": run.oformat,
+            "config_override": "$config",
+            "profile": run.profile(),
+        }
+        general_params_dict.update(run.compression_params())
+
+        if regridfile is None:
+            general_params_dict["bootstrap"] = ""
+            general_params_dict["i"] = pism_dataname
+            if options.initialstatefile is not None:
+                general_params_dict["regrid_file"] = options.initialstatefile
+                general_params_dict["regrid_vars"] = regridvars
+        else:
+            general_params_dict["i"] = regridfile
+
+        if run.osize != "custom":
+            general_params_dict["o_size"] = run.osize
+        else:
+            general_params_dict["output.sizes.medium"] = "sftgif,velsurf_mag,usurf,mask,uvelsurf,vvelsurf"
+
+        sb_params_dict = {
+            "sia_e": self.sia_e,
+            "ssa_e": self.ssa_e,
+            "ssa_n": ssa_n,
+            "pseudo_plastic_q": self.ppq,
+            "till_effective_fraction_overburden": tefo,
+            "vertical_velocity_approximation": options.vertical_velocity_approximation,
+            "stress_balance.sia.bed_smoother.range": 0.0,
+        }
+        if regridfile is None and options.initialstatefile is None:
+            sb_params_dict["topg_to_phi"] = self.ttphi
+
+        climate_parameters = {
+            "force_to_thickness_file": pism_dataname,
+            "climatic_mass_balance": "{},{},{},{},{}".format(m_min, m_max, h_min, h_ela, h_max),
+            "ice_surface_temp": "-10,-10,-2000,4000",
+        }
+
+        hydrology_parameters = {
+            "hydrology.routing.include_floating_ice": True,
+            "hydrology.add_water_input_to_till_storage": False,
+            "hydrology.surface_innput.period": 1,
+        }
+        if frontal_melt_file:
+            hydrology_parameters["hydrology.surface_input.file"] = "$input_dir/data_sets/frontal_melt/{}".format(
+                frontal_melt_file
+            )
+            frontalmelt_params_dict = {
+                "frontal_melt": "routing",
+                "frontal_melt.routing.file": "$input_dir/data_sets/frontal_melt/{}".format(frontal_melt_file),
+            }
+        else:
+            frontalmelt_params_dict = {}
+
+        calving_parameters = {
+            "thickness_calving_threshold": 50,
+            "calving.vonmises_calving.sigma_max": vct * 1.0e6,
+            "vonmises_calving.use_custom_flow_law": True,
+        }
+
+        ocean_params_dict = {
+            "ocean": "th",
+            "ocean.th.file": "$input_dir/data_sets/frontal_melt/{}".format(frontal_melt_file),
+        }
+
+        return merge_dicts(
+            general_params_dict,
+            generate_grid_description(run.grid, run.domain, restart=regridfile is not None),
+            generate_stress_balance(options.stress_balance, sb_params_dict),
+            generate_climate("elevation_forcing", **climate_parameters),
+            generate_hydrology(hydrology, **hydrology_parameters),
+            frontalmelt_params_dict,
+            ocean_params_dict,
+            generate_calving(options.calving, **calving_parameters),
+            generate_scalar_ts(
+                outfile, "yearly", start=run.simulation_start_year, end=run.simulation_end_year, odir=run.dirs["scalar"]
+            ),
+            run.spatial_ts_params(outfile),
+        )
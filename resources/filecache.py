@@ -0,0 +1,191 @@
+"""
+filecache
+=========
+
+Provides a content-addressed cache for files the generators derive from
+their inputs:
+
+  - PISM config files, built with ncgen and keyed by the contents of
+    the CDL file
+  - time files, built with timeline.create_timeline() and keyed by the
+    start and end date, periodicity and reference date
+  - forcing files cropped to regional domains with crop.crop_file(),
+    keyed by the path, modification time and size of the source file
+    and the window
+
+Each file is built once per key and hard-linked into the output
+directory (copied if the cache is on another file system). The cache
+lives in $CRIOS2PISM_CACHE or ~/.cache/crios2pism; the generators keep
+cropped forcing files, which are large, in a cache in the output
+directory instead, so they are linked and never copied.
+
+Cached files are shared: they are read by PISM and must not be modified
+in place.
+
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from os.path import exists, expanduser, join
+import shutil
+import subprocess as sub
+import tempfile
+
+from crop import crop_file
+from timeline import create_timeline
+
+cache_env = "CRIOS2PISM_CACHE"
+default_cache_dir = join("~", ".cache", "crios2pism")
+
+# change when the way a kind of file is built changes
+builder_versions = {"config": 1, "timeline": 2, "crop": 1}
+
+
+def default_directory():
+    """
+    Return the cache directory: $CRIOS2PISM_CACHE or ~/.cache/crios2pism.
+    """
+
+    return expanduser(os.environ.get(cache_env, default_cache_dir))
+
+
+def cache_key(kind, *parts):
+    """
+    Return the key of a file of 'kind' built from 'parts' (strings or
+    bytes).
+
+    Returns: string
+    """
+
+    h = hashlib.sha1()
+    h.update(json.dumps([kind, builder_versions.get(kind, 0)]).encode())
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part).encode()
+        h.update(hashlib.sha1(part).digest())
+    return h.hexdigest()
+
+
+def install(source, target):
+    """
+    Make 'target' a hard link to (or, across file systems, a copy of)
+    'source', replacing an existing 'target'.
+
+    Returns: string ("linked", "copied" or "unchanged")
+    """
+
+    if exists(target) and os.path.samefile(source, target):
+        return "unchanged"
+
+    tmp = "{}.tmp{}".format(target, os.getpid())
+    try:
+        os.link(source, tmp)
+        status = "linked"
+    except OSError:
+        shutil.copy2(source, tmp)
+        status = "copied"
+    os.replace(tmp, target)
+    return status
+
+
+class FileCache(object):
+    """
+    Content-addressed cache of built files in 'directory'.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = default_directory()
+        self.directory = directory
+        self.stats = OrderedDict((s, 0) for s in ("hit", "built"))
+
+    def path(self, key, suffix=".nc"):
+        return join(self.directory, key[:2], key + suffix)
+
+    def get(self, key, build, suffix=".nc"):
+        """
+        Return the cached file for 'key', calling build(filename) to
+        create it if it is not in the cache yet. build() must write
+        'filename'; it is moved into the cache atomically.
+
+        Returns: string
+        """
+
+        filename = self.path(key, suffix)
+        if exists(filename):
+            self.stats["hit"] += 1
+            return filename
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=suffix, dir=os.path.dirname(filename))
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            build(tmp)
+            if not exists(tmp):
+                raise RuntimeError("Building {} did not write a file".format(filename))
+            os.replace(tmp, filename)
+        finally:
+            if exists(tmp):
+                os.remove(tmp)
+
+        self.stats["built"] += 1
+        return filename
+
+    def config(self, cdl, target):
+        """
+        Install the PISM config file built from 'cdl' as 'target'.
+
+        Returns: string
+        """
+
+        with open(cdl, "rb") as f:
+            key = cache_key("config", f.read())
+
+        def build(filename):
+            sub.call(["ncgen", "-o", filename, cdl])
+
+        return install(self.get(key, build), target)
+
+    def timeline(self, start_date, end_date, periodicity, reference_date, target):
+        """
+        Install the time file from 'start_date' to 'end_date' as 'target'.
+        A 'periodicity' of None means yearly.
+
+        Returns: string
+        """
+
+        key = cache_key("timeline", start_date, end_date, periodicity, reference_date)
+
+        def build(filename):
+            create_timeline(
+                filename, start_date, end_date, periodicity=periodicity or "yearly", ref_date=reference_date
+            )
+
+        return install(self.get(key, build), target)
+
+    def crop(self, source, window, target):
+        """
+        Install 'source' cropped to 'window' (see crop.read_window()) as
+        'target'.
+
+        Returns: string
+        """
+
+        st = os.stat(source)
+        key = cache_key("crop", os.path.abspath(source), st.st_mtime, st.st_size, window)
+
+        def build(filename):
+            crop_file(source, filename, window)
+
+        return install(self.get(key, build), target)
+
+    def clear(self):
+        """
+        Remove all cached files.
+        """
+
+        if exists(self.directory):
+            shutil.rmtree(self.directory)
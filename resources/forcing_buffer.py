@@ -0,0 +1,106 @@
+"""
+forcing_buffer
+==============
+
+Provides the choice of climate_forcing.buffer_size, the number of
+records of time-dependent forcing PISM keeps in memory:
+
+  - PISM reads each forcing file's records into buffers on the model
+    grid, one per field (climatic_mass_balance, theta_ocean, ...); every
+    rank holds its subdomain plus a ghost region of each buffer
+  - a buffer of at least as many records as a file has is filled once;
+    a smaller one is refilled as the run advances, which re-reads daily
+    forcing many times
+  - the largest buffer that fits into a fraction of the memory per rank
+    is chosen, capped at the longest record count
+
+"""
+
+from collections import OrderedDict
+import os
+
+from allocation import decompose, ownership_ranges
+
+# fraction of the memory of one rank forcing buffers may use; the rest
+# is left for the model state and PETSc
+default_memory_fraction = 0.25
+
+# PISM keeps forcing buffers in double precision
+bytes_per_value = 8
+
+# ghost points on each side of a subdomain
+stencil_width = 2
+
+# PISM needs two records to interpolate in time
+min_buffer_size = 2
+
+
+def local_points(grid_dict, n_ranks):
+    """
+    Return the number of points of the largest subdomain of 'grid_dict'
+    on 'n_ranks' ranks, including ghosts.
+
+    Returns: int
+    """
+
+    Mx, My = grid_dict["Mx"], grid_dict["My"]
+    Nx, Ny = decompose(n_ranks, Mx, My)
+    xm = max(ownership_ranges(Mx, Nx))
+    ym = max(ownership_ranges(My, Ny))
+    return (xm + 2 * stencil_width) * (ym + 2 * stencil_width)
+
+
+def node_memory():
+    """
+    Return the physical memory of this machine in bytes, or None if it
+    cannot be determined.
+    """
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def buffer_bytes(size, forcing, points):
+    """
+    Return the memory per rank of buffers of 'size' records for
+    'forcing', a list of (records, fields) pairs, one per forcing file.
+
+    Returns: int
+    """
+
+    return sum(min(size, records) * fields for records, fields in forcing) * points * bytes_per_value
+
+
+def choose_buffer_size(forcing, points, memory, fraction=default_memory_fraction):
+    """
+    Choose the buffer size for 'forcing' (a list of (records, fields)
+    pairs, one per forcing file) on subdomains of 'points' points with
+    'memory' bytes per rank: the longest record count if it fits into
+    'fraction' of 'memory', otherwise the largest size that does (at
+    least min_buffer_size).
+
+    Returns: OrderedDict with the buffer size, the bytes per rank it
+    uses and whether all records fit
+    """
+
+    budget = fraction * memory
+    longest = max([records for records, fields in forcing] + [min_buffer_size])
+
+    size = longest
+    if buffer_bytes(size, forcing, points) > budget:
+        low, high = min_buffer_size, longest
+        while low < high:
+            mid = (low + high + 1) // 2
+            if buffer_bytes(mid, forcing, points) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        size = low
+
+    result = OrderedDict()
+    result["buffer_size"] = size
+    result["bytes"] = buffer_bytes(size, forcing, points)
+    result["complete"] = size >= longest
+    return result
@@ -0,0 +1,220 @@
+"""
+incremental
+===========
+
+Provides:
+  - a manifest of the run scripts a generator writes: the content hash
+    of each script and the merged PISM parameters (all_params_dict) of
+    its member, per restart segment for scripts running several
+  - incremental regeneration: scripts whose content did not change are
+    left untouched, and new and changed members are reported and listed
+    in resubmit.list next to the manifest
+  - a check whether a derived file (config .nc, time file) is older
+    than its sources
+
+"""
+
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import os
+from os.path import abspath, basename, dirname, join
+
+# Comment lines written by resources.version_header(). They record how
+# and when a script was generated and do not change what it runs.
+provenance_prefixes = ("# Generated by ", "# Command: ", "# Git top level: ", "# URL: ", "# Version: ")
+
+
+def content_hash(text):
+    """
+    Return the SHA1 hash of 'text'.
+
+    Returns: string
+    """
+
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def script_hash(text):
+    """
+    Return the SHA1 hash of the script 'text', ignoring provenance
+    comments.
+
+    Returns: string
+    """
+
+    lines = [line for line in text.split("\n") if not line.startswith(provenance_prefixes)]
+    return content_hash("\n".join(lines))
+
+
+def needs_update(target, *sources):
+    """
+    Return True if 'target' does not exist or is older than any of
+    'sources'.
+    """
+
+    if not os.path.exists(target):
+        return True
+    mtime = os.path.getmtime(target)
+    return any(os.path.getmtime(source) > mtime for source in sources if os.path.exists(source))
+
+
+class _ScriptWriter(object):
+    """
+    File-like context manager that collects a script and hands it to the
+    manifest on exit.
+    """
+
+    def __init__(self, manifest, script):
+        self.manifest = manifest
+        self.script = script
+        self.buffer = io.StringIO()
+
+    def __enter__(self):
+        return self.buffer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.manifest.commit(self.script, self.buffer.getvalue())
+        self.buffer.close()
+        return False
+
+
+class ScriptManifest(object):
+    """
+    Manifest of the run scripts in a run_scripts directory.
+
+    Use open() instead of open(script, "w") to write a script, and
+    record_params() to store the parameters of its member. If
+    'incremental' is True, scripts whose content is unchanged are not
+    rewritten.
+    """
+
+    def __init__(self, filename, incremental=False):
+        self.filename = filename
+        self.incremental = incremental
+        self.previous = OrderedDict()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.previous = json.load(f, object_pairs_hook=OrderedDict)
+        self.entries = OrderedDict()
+        self.status = OrderedDict()
+
+    def key(self, script):
+        return basename(script)
+
+    def open(self, script):
+        """
+        Return a context manager to write 'script' with.
+        """
+
+        return _ScriptWriter(self, script)
+
+    def record_params(self, script, params_dict, segment=None):
+        """
+        Store the merged PISM parameters of the member written to 'script'.
+        Scripts running several restart segments (_j.sh) store those of
+        each 'segment' (the job number) under "segments".
+        """
+
+        params = OrderedDict((k, str(v)) for k, v in params_dict.items())
+        entry = self.entries.setdefault(self.key(script), OrderedDict())
+        if segment is None:
+            entry["params_hash"] = content_hash(json.dumps(params))
+            entry["params"] = params
+        else:
+            segments = entry.setdefault("segments", OrderedDict())
+            segments[str(segment)] = params
+            entry["params_hash"] = content_hash(json.dumps(segments))
+
+    def commit(self, script, text):
+        """
+        Compare 'text' with the manifest and write 'script' if needed.
+        Scripts that differ only in provenance comments are unchanged.
+
+        Returns: string ("new", "changed" or "unchanged")
+        """
+
+        key = self.key(script)
+        old = self.previous.get(key)
+        new_hash = script_hash(text)
+
+        if old is None or not os.path.exists(script):
+            status = "new"
+        elif old.get("hash") != new_hash:
+            status = "changed"
+        else:
+            status = "unchanged"
+
+        if status != "unchanged" or not self.incremental:
+            with open(script, "w") as f:
+                f.write(text)
+
+        entry = self.entries.setdefault(key, OrderedDict())
+        entry["script"] = abspath(script)
+        entry["hash"] = new_hash
+        self.status[key] = status
+        return status
+
+    def changed_params(self, key):
+        """
+        Return the names of the parameters that differ from the previous
+        manifest, prefixed with the segment ("2:ye") for scripts running
+        several restart segments.
+
+        Returns: list
+        """
+
+        def differing(old, new):
+            return [k for k in set(old) | set(new) if old.get(k) != new.get(k)]
+
+        old = self.previous.get(key, {})
+        new = self.entries.get(key, {})
+        names = differing(old.get("params", {}), new.get("params", {}))
+        old_segments, new_segments = old.get("segments", {}), new.get("segments", {})
+        for segment in set(old_segments) | set(new_segments):
+            names.extend(
+                "{}:{}".format(segment, k)
+                for k in differing(old_segments.get(segment, {}), new_segments.get(segment, {}))
+            )
+        return sorted(names)
+
+    def save(self):
+        """
+        Write the manifest (keeping entries of scripts not written this
+        time) and the list of scripts to resubmit.
+
+        Returns: string
+        """
+
+        merged = OrderedDict(self.previous)
+        merged.update(self.entries)
+        with open(self.filename, "w") as f:
+            json.dump(merged, f, indent=2)
+
+        resubmit = join(dirname(self.filename), "resubmit.list")
+        with open(resubmit, "w") as f:
+            for key, status in self.status.items():
+                if status != "unchanged":
+                    f.write(self.entries[key]["script"] + "\n")
+
+        return self.filename
+
+    def report(self):
+        """
+        Print which scripts are new, changed or unchanged.
+        """
+
+        counts = OrderedDict((s, 0) for s in ("new", "changed", "unchanged"))
+        for key, status in self.status.items():
+            counts[status] += 1
+            if status == "changed":
+                params = self.changed_params(key)
+                if params:
+                    print("changed: {} ({})".format(key, ", ".join(params)))
+                else:
+                    print("changed: {} (no parameter changes)".format(key))
+            elif status == "new":
+                print("new: {}".format(key))
+        print(", ".join("{} {}".format(n, s) for s, n in counts.items()) + " scripts")
@@ -0,0 +1,184 @@
+"""
+io_benchmark
+============
+
+Measures write throughput on the file system runs write to, for
+io_planner.py:
+
+  - serial: one writer creating a netCDF-4 file with an ice sheet-like
+    field (smooth inside an ellipse, zero outside) at each compression
+    level; throughput in uncompressed bytes per second and the
+    compression ratio achieved
+  - parallel: many processes writing disjoint slabs of one file, for
+    each Lustre stripe count; aggregate throughput in bytes per second
+
+Usage: python io_benchmark.py [-o io_benchmark.json] DIR
+
+Run it on a compute node with DIR on the scratch file system of the
+runs, and pass the result to the generators with --io_benchmark.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import json
+import multiprocessing
+import os
+from os.path import join
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+
+def ice_sheet_field(Mx, My):
+    """
+    Return a field resembling ice sheet output: smooth values inside an
+    ellipse and zeros (ice-free) outside.
+
+    Returns: numpy array
+    """
+
+    x = np.linspace(-1, 1, Mx)
+    y = np.linspace(-1, 1, My)
+    X, Y = np.meshgrid(x, y)
+    r2 = X**2 + (1.5 * Y) ** 2
+    field = 3000.0 * np.sqrt(np.maximum(1 - r2, 0)) + np.random.normal(0, 1, X.shape)
+    field[r2 > 1] = 0.0
+    return field
+
+
+def benchmark_serial(directory, Mx=1000, My=1000, records=10, levels=(0, 1, 2, 4)):
+    """
+    Write 'records' records of an Mx x My field with each compression
+    level.
+
+    Returns: OrderedDict
+    """
+
+    if NC is None:
+        raise ImportError("netCDF4 is required for the serial benchmark")
+
+    field = ice_sheet_field(Mx, My)
+    results = OrderedDict()
+    for level in levels:
+        filename = join(directory, "serial_{}.nc".format(level))
+        start = time.time()
+        nc = NC(filename, "w", format="NETCDF4")
+        nc.createDimension("time", None)
+        nc.createDimension("y", My)
+        nc.createDimension("x", Mx)
+        var = nc.createVariable(
+            "thk", "f8", dimensions=("time", "y", "x"), zlib=level > 0, complevel=max(level, 1), chunksizes=(1, My, Mx)
+        )
+        for k in range(records):
+            var[k, :, :] = field
+        nc.close()
+        elapsed = time.time() - start
+        n_bytes = field.nbytes * records
+        results[level] = OrderedDict(
+            [("rate", n_bytes / elapsed), ("ratio", float(n_bytes) / os.path.getsize(filename))]
+        )
+        os.remove(filename)
+        print(
+            "serial, level {}: {:.0f} MB/s, ratio {:.2f}".format(
+                level, results[level]["rate"] / 1e6, results[level]["ratio"]
+            )
+        )
+    return results
+
+
+def write_slab(args):
+    filename, offset, size, block = args
+    data = os.urandom(min(block, size))
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        written = 0
+        while written < size:
+            n = min(len(data), size - written)
+            os.pwrite(fd, data[:n], offset + written)
+            written += n
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def set_stripes(directory, stripes):
+    """
+    Set the stripe count of 'directory'. Returns False if lfs is not
+    available.
+    """
+
+    if shutil.which("lfs") is None:
+        return False
+    subprocess.call(["lfs", "setstripe", "-c", str(stripes), directory])
+    return True
+
+
+def benchmark_parallel(directory, n_writers=8, stripe_counts=(1, 4, 16, -1), file_bytes=1024**3, block=4 * 1024**2):
+    """
+    Write a file of 'file_bytes' from 'n_writers' processes for each
+    stripe count.
+
+    Returns: OrderedDict
+    """
+
+    results = OrderedDict()
+    slab = int(file_bytes // n_writers)
+    for stripes in stripe_counts:
+        stripe_dir = join(directory, "stripes_{}".format(stripes))
+        os.makedirs(stripe_dir)
+        if not set_stripes(stripe_dir, stripes) and len(results) > 0:
+            print("lfs not found, skipping stripe count {}".format(stripes))
+            shutil.rmtree(stripe_dir)
+            continue
+        filename = join(stripe_dir, "parallel.bin")
+        with open(filename, "wb") as f:
+            f.truncate(slab * n_writers)
+        pool = multiprocessing.Pool(n_writers)
+        start = time.time()
+        pool.map(write_slab, [(filename, k * slab, slab, block) for k in range(n_writers)])
+        elapsed = time.time() - start
+        pool.close()
+        results[stripes] = slab * n_writers / elapsed
+        shutil.rmtree(stripe_dir)
+        print("parallel, {} stripes: {:.0f} MB/s".format(stripes, results[stripes] / 1e6))
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Measure write throughput for the output planner."
+    parser.add_argument("DIR", nargs=1, help="directory on the file system to measure")
+    parser.add_argument("-o", "--output", dest="output", help="result file", default="io_benchmark.json")
+    parser.add_argument("-w", "--writers", dest="writers", type=int, help="parallel writers", default=8)
+    parser.add_argument("--stripes", dest="stripes", help="stripe counts to measure", default="1,4,16,-1")
+    parser.add_argument("--size", dest="size", type=int, help="parallel file size in MB", default=1024)
+    parser.add_argument("--records", dest="records", type=int, help="records in serial files", default=10)
+    options = parser.parse_args()
+
+    directory = join(os.path.abspath(options.DIR[0]), "io_benchmark_{}".format(os.getpid()))
+    os.makedirs(directory)
+    try:
+        result = OrderedDict()
+        result["directory"] = options.DIR[0]
+        result["serial"] = benchmark_serial(directory, records=options.records)
+        result["parallel"] = benchmark_parallel(
+            directory,
+            n_writers=options.writers,
+            stripe_counts=[int(s) for s in options.stripes.split(",")],
+            file_bytes=options.size * 1024**2,
+        )
+    finally:
+        shutil.rmtree(directory)
+
+    with open(options.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print("Results written to {}".format(options.output))
@@ -0,0 +1,222 @@
+"""
+io_planner
+==========
+
+Provides:
+  - write time and on-disk size estimates for the output formats PISM
+    supports, from write throughput measured with io_benchmark.py (or
+    typical values if no benchmark is available)
+  - an output plan per run: the output format, compression level and
+    Lustre stripe count of each output directory
+
+PISM uses one output format for all files of a run. Serial formats
+gather each field on rank 0, which writes (and compresses) it; parallel
+formats write from all ranks, uncompressed. The planner picks, among
+all choices that write within a tolerance of the fastest one, the one
+that uses the least disk space and the fewest stripes: small files are
+compressed and not striped, large files are written in parallel and
+striped over as many OSTs as pay off.
+
+The typical values are only good enough to plan stripe counts; the
+generators let the planner change the format and compression level of
+an experiment only with a measured benchmark.
+
+"""
+
+from collections import OrderedDict
+import json
+
+# Typical throughput (bytes of uncompressed data per second) and
+# compression ratio per compression level of a single writer, and
+# aggregate throughput of many writers per stripe count (-1: all OSTs).
+# 'overhead' is the time in seconds per record written (the parallel
+# formats synchronize all ranks).
+default_benchmark = {
+    "serial": {
+        0: {"rate": 400.0e6, "ratio": 1.0},
+        1: {"rate": 120.0e6, "ratio": 2.0},
+        2: {"rate": 100.0e6, "ratio": 2.2},
+        4: {"rate": 70.0e6, "ratio": 2.4},
+    },
+    "parallel": {1: 300.0e6, 4: 1.0e9, 16: 3.0e9, -1: 5.0e9},
+    "overhead": {"serial": 0.05, "parallel": 0.1},
+}
+
+serial_formats = ("netcdf4_serial", "netcdf3")
+parallel_formats = ("netcdf4_parallel", "pnetcdf")
+
+# formats considered by "-o_format auto"
+auto_formats = ("netcdf4_serial", "netcdf4_parallel")
+
+# a single writer does not benefit from many stripes
+max_serial_stripes = 4
+serial_stripe_threshold = 1024**3
+
+# compression level of netcdf4_serial output without a measured
+# benchmark
+default_compression_level = 2
+
+# choices writing within this fraction (or number of seconds) of the
+# fastest one are considered equally fast
+default_tolerance = 0.25
+default_slack = 30.0
+
+
+def load_benchmark(filename=None):
+    """
+    Load throughput measurements written by io_benchmark.py. Returns the
+    typical values if 'filename' is None.
+
+    Returns: dict
+    """
+
+    if filename is None:
+        return default_benchmark
+
+    with open(filename) as f:
+        measured = json.load(f)
+
+    benchmark = {
+        "serial": {int(k): v for k, v in measured.get("serial", {}).items()} or default_benchmark["serial"],
+        "parallel": {int(k): float(v) for k, v in measured.get("parallel", {}).items()}
+        or default_benchmark["parallel"],
+        "overhead": dict(default_benchmark["overhead"], **measured.get("overhead", {})),
+    }
+    return benchmark
+
+
+def state_file_bytes(grid_dict, bytes_per_value=8):
+    """
+    Estimate the size of a PISM output state file: the 3D enthalpy and
+    age, the bedrock temperature and about 40 2D fields.
+
+    Returns: int
+    """
+
+    levels = 2 * int(grid_dict["Mz"]) + int(grid_dict.get("Mbz", 1) or 1) + 40
+    return int(grid_dict["Mx"]) * int(grid_dict["My"]) * levels * bytes_per_value
+
+
+def serial_stripes(file_bytes):
+    """
+    Return the stripe count for a file written by a single writer.
+    """
+
+    return 1 if file_bytes < serial_stripe_threshold else max_serial_stripes
+
+
+def write_time(file_bytes, records, rate, overhead):
+    """
+    Return the estimated time in seconds to write 'file_bytes' in
+    'records' records.
+    """
+
+    return records * overhead + float(file_bytes) / rate
+
+
+def candidates(oformat, compression_level, n_cores, benchmark):
+    """
+    Return the (format, compression level) choices to consider.
+
+    Returns: list of tuples
+    """
+
+    if oformat == "auto":
+        formats = auto_formats
+    else:
+        formats = (oformat,)
+
+    result = []
+    for fmt in formats:
+        if fmt == "netcdf4_serial":
+            if compression_level is None:
+                levels = sorted(benchmark["serial"].keys())
+            else:
+                levels = [int(compression_level)]
+            result.extend((fmt, level) for level in levels)
+        elif fmt in parallel_formats and (n_cores > 1 or oformat != "auto"):
+            result.append((fmt, None))
+        elif fmt in serial_formats:
+            result.append((fmt, None))
+    return result
+
+
+def plan_file(file_bytes, records, fmt, level, benchmark, tolerance=default_tolerance):
+    """
+    Return the estimated write time, size on disk and stripe count of a
+    file written with format 'fmt' and compression level 'level'.
+
+    Returns: OrderedDict
+    """
+
+    result = OrderedDict()
+    if fmt in parallel_formats:
+        overhead = benchmark["overhead"]["parallel"]
+        times = OrderedDict(
+            (stripes, write_time(file_bytes, records, rate, overhead))
+            for stripes, rate in sorted(benchmark["parallel"].items(), key=lambda x: x[1])
+        )
+        best = min(times.values())
+        # the slowest (fewest OSTs) stripe count that is nearly as fast
+        stripes = [s for s, t in times.items() if t <= (1 + tolerance) * best][0]
+        result["seconds"] = times[stripes]
+        result["bytes"] = file_bytes
+        result["stripes"] = stripes
+    else:
+        serial = benchmark["serial"]
+        if level is None or level not in serial:
+            measured = serial[min(serial.keys(), key=lambda k: abs(k - (level or 0)))]
+        else:
+            measured = serial[level]
+        ratio = measured["ratio"] if level else 1.0
+        result["seconds"] = write_time(file_bytes, records, measured["rate"], benchmark["overhead"]["serial"])
+        result["bytes"] = int(file_bytes / ratio)
+        result["stripes"] = serial_stripes(result["bytes"])
+    return result
+
+
+def plan_run(
+    files,
+    n_cores,
+    oformat="auto",
+    compression_level=None,
+    benchmark=None,
+    tolerance=default_tolerance,
+    slack=default_slack,
+):
+    """
+    Plan the output of a run writing 'files', a dict mapping an output
+    directory to (bytes, records) of the largest file written there.
+
+    Among all format and compression choices, those writing within
+    'tolerance' (a fraction) plus 'slack' (seconds) of the fastest one
+    are acceptable; the one using the least disk space wins.
+
+    Returns: OrderedDict with "o_format", "compression_level",
+    "seconds", "bytes" and "stripes" (a dict mapping each directory in
+    'files' to a stripe count)
+    """
+
+    if benchmark is None:
+        benchmark = default_benchmark
+
+    plans = []
+    for fmt, level in candidates(oformat, compression_level, n_cores, benchmark):
+        per_file = OrderedDict(
+            (d, plan_file(file_bytes, records, fmt, level, benchmark, tolerance=tolerance))
+            for d, (file_bytes, records) in files.items()
+        )
+        plan = OrderedDict()
+        plan["o_format"] = fmt
+        plan["compression_level"] = level
+        plan["seconds"] = sum(p["seconds"] for p in per_file.values())
+        plan["bytes"] = sum(p["bytes"] for p in per_file.values())
+        plan["stripes"] = OrderedDict((d, p["stripes"]) for d, p in per_file.items())
+        plans.append(plan)
+
+    if not plans:
+        raise ValueError("No output format to plan for o_format {}".format(oformat))
+
+    fastest = min(p["seconds"] for p in plans)
+    acceptable = [p for p in plans if p["seconds"] <= (1 + tolerance) * fastest + slack]
+    return min(acceptable, key=lambda p: (p["bytes"], sum(p["stripes"].values()), p["seconds"]))
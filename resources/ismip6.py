@@ -0,0 +1,429 @@
+"""
+ismip6
+======
+
+Provides the conversion of PISM output files (split by variable) to
+ISMIP6 files in one pass, in place of cdo seltimestep followed by
+adjust_timeline():
+
+  - variables depending on time are streamed in blocks of records;
+    state variables keep all records, flux variables drop the first
+    (PISM writes the state at the start of the run, fluxes are averages
+    over the period before a record)
+  - missing values of floating point variables are set to the ISMIP6
+    value (like cdo -setmissval)
+  - the time axis is written as the final one: a period of 'interval'
+    years per record from 'start_date', with the start of each period
+    for state variables and the mid-point and bounds for flux variables
+  - the file is written compressed, with the chunk shapes of a profile
+    of resources/chunking.py ("balanced" by default: maps and time
+    series at points are both read quickly), under a temporary name
+    and renamed, so there is no intermediate copy to reopen
+
+and the catalog of the files to convert:
+
+  - the ISMIP6 variables are read from ismip6vars.csv; file names
+    <variable>_<ice sheet>_<group>_<model>_<experiment>[_<grid>].nc
+    (as written by cdo splitname) are parsed with one precompiled
+    expression, so a variable matches its own name only (acabf does not
+    match tendacabf_..., lim does not match climatic_mass_balance_...)
+  - files that are not ISMIP6 file names but contain the names of
+    variables are reported
+  - a manifest in the output directory records the converted files,
+    keyed by path, modification time and size of their source, so
+    reruns only convert new or changed files
+
+Usage: python ismip6.py -t flux -a 2015-1-1 --interval 5 IN.nc OUT.nc
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import csv
+import json
+import os
+from os.path import abspath, basename, dirname, join, realpath
+import re
+import sys
+import time
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+sys.path.append(realpath(dirname(__file__)))
+from chunking import block_records, profiles, variable_chunks
+from crop import block_bytes
+from preflight import file_stamp
+from timeline import time_bounds, write_timeline
+
+variables_file = join(realpath(dirname(__file__)), "ismip6vars.csv")
+
+manifest_name = "ismip6_manifest.json"
+
+# change when convert() writes different files
+converter_version = 2
+
+# memory of a converting process besides the blocks of records
+base_memory = 256 * 1024**2
+
+# missing value of ISMIP6 files
+missing_value = 1.0e20
+
+# compression level of ISMIP6 files (cdo -z zip_3)
+complevel = 3
+
+# records dropped and time axis of each type of variable (column "type"
+# of ismip6vars.csv)
+variable_types = {
+    "state": {"skip": 0, "interval_type": "start", "bounds": False},
+    "flux": {"skip": 1, "interval_type": "mid", "bounds": True},
+}
+
+
+def time_axis_variables(nc):
+    """
+    Return the names of the time variable and its bounds in 'nc'.
+
+    Returns: list of strings
+    """
+
+    names = ["time"]
+    if "time" in nc.variables:
+        bounds = getattr(nc.variables["time"], "bounds", None)
+        if bounds in nc.variables:
+            names.append(bounds)
+    return names
+
+
+def set_missing(data, old_values, new_value):
+    """
+    Replace 'old_values' (the fill and missing values of the source) and
+    NaNs in the array 'data' by 'new_value', in place.
+    """
+
+    mask = np.isnan(data)
+    for v in old_values:
+        mask |= data == v
+    data[mask] = new_value
+
+
+def convert(
+    source,
+    target,
+    var_type,
+    start_date="2008-1-1",
+    interval=1,
+    fill_value=missing_value,
+    profile="balanced",
+    ref_date="2008-1-1",
+    ref_unit="days",
+    calendar="standard",
+):
+    """
+    Write the ISMIP6 file 'target' for the PISM output file 'source'
+    holding a variable of 'var_type' (state or flux). Missing values
+    are set to 'fill_value' unless it is None; variables are chunked
+    for 'profile' (see chunking.profiles; None: one record per chunk).
+
+    Returns: int (number of records written)
+    """
+
+    if NC is None:
+        raise ImportError("netCDF4 is required to convert files")
+    if var_type not in variable_types:
+        raise ValueError("var_type must be one of {}, got {}".format(sorted(variable_types), var_type))
+    options = variable_types[var_type]
+    skip = options["skip"]
+
+    tmp = "{}.tmp{}".format(target, os.getpid())
+    try:
+        with NC(source) as src, NC(tmp, "w", format="NETCDF4") as dst:
+            nt = len(src.dimensions["time"]) - skip if "time" in src.dimensions else 0
+            if nt <= 0:
+                raise ValueError("{} has no records to convert".format(source))
+
+            skipped = time_axis_variables(src)
+            variables = OrderedDict((k, v) for k, v in src.variables.items() if k not in skipped)
+            used = set(d for var in variables.values() for d in var.dimensions)
+            dst.createDimension("time", None)
+            for name, dim in src.dimensions.items():
+                if name in used and name != "time":
+                    dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            attrs = OrderedDict((a, src.getncattr(a)) for a in src.ncattrs())
+            history = "{}: converted to ISMIP6 ({} variable, from {})".format(time.asctime(), var_type, start_date)
+            attrs["history"] = "\n".join([history] + ([attrs["history"]] if "history" in attrs else []))
+            dst.setncatts(attrs)
+
+            bounds = time_bounds(
+                start_date,
+                periodicity="yearly",
+                interval=interval,
+                count=nt + 1,
+                ref_date=ref_date,
+                ref_unit=ref_unit,
+                calendar=calendar,
+            )
+            write_timeline(
+                dst,
+                bounds,
+                "{} since {}".format(ref_unit, ref_date),
+                calendar,
+                interval_type=options["interval_type"],
+                with_bounds=options["bounds"],
+            )
+
+            for name, var in variables.items():
+                copy_variable(var, dst, skip, fill_value, profile)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+    return nt
+
+
+def copy_variable(var, dst, skip, fill_value, profile=None):
+    """
+    Copy 'var' to the dataset 'dst', without its first 'skip' records if
+    it depends on time, in blocks of records, chunked for 'profile'.
+    Missing values of floating point variables depending on time are
+    set to 'fill_value'.
+    """
+
+    var.set_auto_maskandscale(False)
+    by_time = var.dimensions[:1] == ("time",)
+    floating = np.issubdtype(var.dtype, np.floating)
+
+    old_fill = getattr(var, "_FillValue", None)
+    attrs = OrderedDict((a, var.getncattr(a)) for a in var.ncattrs() if a != "_FillValue")
+    old_values = []
+    if by_time and floating and fill_value is not None:
+        old_values = [np.asarray(v, dtype=var.dtype) for v in (old_fill, attrs.get("missing_value")) if v is not None]
+        new_fill = np.asarray(fill_value, dtype=var.dtype)
+        attrs["missing_value"] = new_fill
+    else:
+        new_fill = old_fill
+
+    chunks = None
+    if profile is not None:
+        chunks = variable_chunks(var, profile, records=var.shape[0] - skip if by_time else None, memory=block_bytes)
+    out = dst.createVariable(
+        var.name,
+        var.datatype,
+        var.dimensions,
+        zlib=var.ndim > 0 and isinstance(var.datatype, np.dtype),
+        complevel=complevel,
+        shuffle=False,
+        chunksizes=chunks,
+        fill_value=new_fill,
+    )
+    out.setncatts(attrs)
+    out.set_auto_maskandscale(False)
+
+    if var.ndim == 0:
+        out.assignValue(var.getValue())
+        return
+    if not by_time:
+        out[:] = var[:]
+        return
+
+    n = var.shape[0]
+    record_bytes = var.dtype.itemsize * int(np.prod(var.shape[1:]))
+    if chunks is not None:
+        # whole chunks of records, so each chunk is written once
+        step = block_records(chunks, record_bytes, block_bytes)
+    else:
+        step = max(block_bytes // max(record_bytes, 1), 1)
+    for k in range(skip, n, step):
+        data = var[k : min(k + step, n)]
+        if old_values:
+            set_missing(data, old_values, new_fill)
+        out[k - skip : k - skip + len(data)] = data
+
+
+def convert_memory(source):
+    """
+    Return an estimate of the memory convert() needs for 'source' in
+    bytes: a block of records of the largest variable, its mask and a
+    copy on the way to the compressed file.
+
+    Returns: int
+    """
+
+    largest = os.path.getsize(source)
+    if NC is not None:
+        try:
+            with NC(source) as nc:
+                largest = 0
+                for var in nc.variables.values():
+                    if not isinstance(var.datatype, np.dtype):
+                        continue
+                    size = var.dtype.itemsize * int(np.prod(var.shape))
+                    if var.dimensions[:1] == ("time",) and var.shape[0] > 0:
+                        size = min(size, max(block_bytes, size // var.shape[0]))
+                    largest = max(largest, size)
+        except Exception:
+            pass
+    return base_memory + 3 * largest
+
+
+def read_variables(filename=variables_file):
+    """
+    Read the ISMIP6 variables from the CSV file 'filename' (columns
+    var_name, units, standard_name, dims and type).
+
+    Returns: OrderedDict (variable -> OrderedDict column -> value)
+    """
+
+    with open(filename) as f:
+        rows = [[c.strip() for c in row] for row in csv.reader(f) if row]
+    keys = rows[0]
+    return OrderedDict((row[0], OrderedDict(zip(keys[1:], row[1:]))) for row in rows[1:])
+
+
+class Catalog(object):
+    """
+    The files of the ISMIP6 'variables' (see read_variables()) written
+    by 'model' of 'group' for 'ice_sheet'. Files without a grid in their
+    name are on 'grid'.
+    """
+
+    def __init__(self, variables, ice_sheet, group, model, grid="01"):
+        self.variables = variables
+        self.ice_sheet = ice_sheet
+        self.group = group
+        self.model = model
+        self.grid = grid
+        names = "|".join(re.escape(v) for v in sorted(variables, key=len, reverse=True))
+        self.file_re = re.compile(
+            r"^(?P<variable>{})_(?P<ice_sheet>[^_]+)_(?P<group>[^_]+)_(?P<model>[^_]+)_"
+            r"(?P<experiment>.+?)(?:_(?P<grid>\d+))?\.nc$".format(names)
+        )
+        self.name_re = re.compile(names)
+
+    def parse(self, path):
+        """
+        Return the variable, experiment, model and grid of the file
+        'path', or None if it is not an ISMIP6 file name.
+
+        Returns: OrderedDict
+        """
+
+        m = self.file_re.match(basename(path))
+        if m is None:
+            return None
+        entry = OrderedDict([("path", path), ("file", basename(path))])
+        entry.update((k, m.group(k)) for k in ("variable", "ice_sheet", "group", "model", "experiment"))
+        entry["grid"] = m.group("grid") or self.grid
+        entry.update(self.variables[entry["variable"]])
+        return entry
+
+    def scan(self, paths):
+        """
+        Return the files of this model among 'paths', and the files that
+        contain the names of variables but are not ISMIP6 file names.
+
+        Returns: tuple (list of OrderedDicts (see parse()), OrderedDict
+        path -> problem)
+        """
+
+        entries = []
+        problems = OrderedDict()
+        for path in paths:
+            entry = self.parse(path)
+            if entry is None:
+                names = sorted(set(self.name_re.findall(basename(path))))
+                if len(names) > 1:
+                    problems[path] = "ambiguous, contains {}".format(", ".join(names))
+                elif names:
+                    problems[path] = "contains {} but is not an ISMIP6 file name".format(names[0])
+                continue
+            if (entry["ice_sheet"], entry["group"], entry["model"]) == (self.ice_sheet, self.group, self.model):
+                entries.append(entry)
+        return entries, problems
+
+
+class Manifest(object):
+    """
+    The files converted into 'directory', in the JSON file
+    ismip6_manifest.json keyed by the absolute path of their source. An
+    entry is current while the modification time and size of its source
+    are unchanged and its target exists.
+    """
+
+    def __init__(self, directory):
+        self.filename = join(directory, manifest_name)
+        self.entries = OrderedDict()
+        self.modified = False
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    self.entries = json.load(f, object_pairs_hook=OrderedDict)
+            except ValueError:
+                self.entries = OrderedDict()
+
+    def is_current(self, source, target):
+        """
+        Return True if 'target' was converted from 'source' as it is.
+        """
+
+        entry = self.entries.get(abspath(source))
+        return (
+            entry is not None
+            and entry.get("version") == converter_version
+            and entry["target"] == abspath(target)
+            and entry["stamp"] == file_stamp(abspath(source))
+            and os.path.exists(target)
+        )
+
+    def record(self, source, target):
+        """
+        Record that 'target' was converted from 'source'.
+        """
+
+        self.entries[abspath(source)] = OrderedDict(
+            [("version", converter_version), ("stamp", file_stamp(abspath(source))), ("target", abspath(target))]
+        )
+        self.modified = True
+
+    def save(self):
+        """
+        Write the manifest if it changed.
+        """
+
+        if not self.modified:
+            return
+        os.makedirs(dirname(self.filename), exist_ok=True)
+        tmp = "{}.tmp{}".format(self.filename, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp, self.filename)
+        self.modified = False
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Convert a PISM output file to an ISMIP6 file."
+    parser.add_argument("FILES", nargs=2)
+    parser.add_argument("-t", "--type", dest="var_type", choices=sorted(variable_types), required=True)
+    parser.add_argument("-a", "--start_date", dest="start_date", default="2008-1-1")
+    parser.add_argument("--interval", dest="interval", type=int, help="years per record", default=1)
+    parser.add_argument("-p", "--profile", dest="profile", choices=profiles, default="balanced")
+    options = parser.parse_args()
+
+    source, target = options.FILES
+    n = convert(
+        source,
+        target,
+        options.var_type,
+        start_date=options.start_date,
+        interval=options.interval,
+        profile=options.profile,
+    )
+    print("{}: {} records".format(target, n))
@@ -0,0 +1,525 @@
+"""
+lazy
+====
+
+Provides out-of-core processing of spatial time series (ex_ files), in
+place of cdo and NCO chains that load whole files:
+
+  - a Field is a variable of a netCDF file with a window (a range of
+    records and an x/y extent) and a list of steps; building it reads
+    only headers and coordinates
+  - steps are unit conversions (scale and offset, new units), renaming,
+    reductions over the x/y grid (sum, mean, max, min) and, as the last
+    step, reductions over time (mean of all records, running mean)
+  - write() evaluates fields in blocks of records sized to a memory
+    limit, on several processes, and writes the blocks in order; a
+    running mean reads the records its windows overlap twice, a time
+    mean adds up partial sums, so memory does not grow with the file
+
+Usage: python lazy.py -v VARIABLE [--x_range X_MIN X_MAX] [--y_range
+Y_MIN Y_MAX] [--start DATE] [--end DATE] [--scale FACTOR] [--units UNITS]
+[--fldsum|--fldmean|--fldmax|--fldmin] [--timmean|--runmean N]
+[--rename NAME] [-j jobs] [--memory GB] IN.nc OUT.nc
+applies the steps in the order given, e.g. the cdo chain
+"setattribute,v@units=Gt yr-1 -divc,1e12 -fldsum -mulc,1e6 -seltimestep,1/365 -selvar,v"
+is "-v v --records 0 365 --scale 1e6 --fldsum --scale 1e-12 --units 'Gt yr-1'".
+
+"""
+
+from argparse import Action, ArgumentParser
+from collections import OrderedDict, deque
+import copy
+from multiprocessing import Pool
+import os
+from os.path import dirname, realpath
+import sys
+import time
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+sys.path.append(realpath(dirname(__file__)))
+from crop import coordinate_window
+from timeline import date_value
+
+# memory for the blocks of records being evaluated, on all processes
+default_memory = 4 * 1024**3
+
+# copies of a block held while it is evaluated (data, mask, result)
+block_copies = 4
+
+space_reductions = {"fldsum": np.ma.sum, "fldmean": np.ma.mean, "fldmax": np.ma.max, "fldmin": np.ma.min}
+
+
+class Field(object):
+    """
+    The variable 'variable' of the netCDF file 'filename', evaluated
+    lazily. Methods return new fields with one more step.
+    """
+
+    def __init__(self, filename, variable):
+        if NC is None:
+            raise ImportError("netCDF4 is required to process files")
+        self.filename = filename
+        self.variable = variable
+        self.name = variable
+        with NC(filename) as nc:
+            var = nc.variables[variable]
+            self.dimensions = var.dimensions
+            self.shape = var.shape
+            self.dtype = var.dtype
+            self.attrs = OrderedDict((a, var.getncattr(a)) for a in var.ncattrs() if a != "_FillValue")
+        self.window = OrderedDict((d, (0, n)) for d, n in zip(self.dimensions, self.shape))
+        self.steps = []
+        self.time_reduction = None
+
+    def _with(self, **kwargs):
+        result = copy.copy(self)
+        result.window = OrderedDict(self.window)
+        result.attrs = OrderedDict(self.attrs)
+        result.steps = list(self.steps)
+        for k, v in kwargs.items():
+            setattr(result, k, v)
+        return result
+
+    def _append(self, step=None, time_reduction=None):
+        if self.time_reduction is not None:
+            raise ValueError("{} must be the last step".format(self.time_reduction[0]))
+        result = self._with()
+        if step is not None:
+            result.steps.append(step)
+        if time_reduction is not None:
+            if "time" not in self.window:
+                raise ValueError("{} has no records".format(self.variable))
+            result.time_reduction = time_reduction
+        return result
+
+    def reduced(self):
+        """
+        Return True if the x/y grid is reduced.
+        """
+
+        return any(step[0] in space_reductions for step in self.steps)
+
+    def subset(self, x_range=None, y_range=None):
+        """
+        Return the field on the part of the grid within 'x_range' and
+        'y_range' (coordinate values).
+        """
+
+        if self.reduced():
+            raise ValueError("cannot subset a field reduced over the grid")
+        result = self._with()
+        with NC(self.filename) as nc:
+            for dim, c_range in (("x", x_range), ("y", y_range)):
+                if c_range is None:
+                    continue
+                if dim not in self.window:
+                    raise ValueError("{} has no dimension {}".format(self.variable, dim))
+                w = coordinate_window(nc.variables[dim][:], c_range, halo=0)
+                if w is None:
+                    raise ValueError("{} range {} is outside of {}".format(dim, c_range, self.filename))
+                result.window[dim] = w
+        return result
+
+    def select_records(self, start, stop):
+        """
+        Return the field on records 'start' to 'stop' (excluded) of the
+        selected ones.
+        """
+
+        if "time" not in self.window:
+            raise ValueError("{} has no records".format(self.variable))
+        first, last = self.window["time"]
+        result = self._with()
+        result.window["time"] = (min(first + start, last), min(first + stop, last))
+        return result
+
+    def select_time(self, start_date=None, end_date=None):
+        """
+        Return the field on the records at or after 'start_date' and
+        before 'end_date'.
+        """
+
+        if "time" not in self.window:
+            raise ValueError("{} has no records".format(self.variable))
+        with NC(self.filename) as nc:
+            time_var = nc.variables["time"]
+            first, last = self.window["time"]
+            t = time_var[first:last]
+            calendar = getattr(time_var, "calendar", "standard")
+            keep = np.ones(len(t), dtype=bool)
+            if start_date is not None:
+                keep &= t >= date_value(start_date, time_var.units, calendar)
+            if end_date is not None:
+                keep &= t < date_value(end_date, time_var.units, calendar)
+        k = np.nonzero(keep)[0]
+        if len(k) == 0:
+            raise ValueError("no records of {} from {} to {}".format(self.filename, start_date, end_date))
+        return self.select_records(int(k[0]), int(k[-1]) + 1)
+
+    def scale(self, factor=1.0, offset=0.0, units=None):
+        """
+        Return the field times 'factor' plus 'offset', in 'units' if
+        given.
+        """
+
+        result = self._append(("scale", factor, offset))
+        if units is not None:
+            result.attrs["units"] = units
+        return result
+
+    def set_units(self, units):
+        """
+        Return the field with the units attribute 'units'.
+        """
+
+        result = self._with()
+        result.attrs["units"] = units
+        return result
+
+    def rename(self, name):
+        """
+        Return the field written as 'name'.
+        """
+
+        return self._with(name=name)
+
+    def reduce_space(self, reduction):
+        """
+        Return the reduction ('fldsum', 'fldmean', 'fldmax' or 'fldmin')
+        of the field over the x/y grid.
+        """
+
+        if reduction not in space_reductions:
+            raise ValueError("reduction must be one of {}, got {}".format(sorted(space_reductions), reduction))
+        if self.reduced():
+            raise ValueError("{} is already reduced over the grid".format(self.variable))
+        axes = tuple(k for k, d in enumerate(self.dimensions) if d in ("x", "y"))
+        if not axes:
+            raise ValueError("{} has no x/y grid".format(self.variable))
+        return self._append((reduction, axes))
+
+    def time_mean(self):
+        """
+        Return the mean of the field over the selected records.
+        """
+
+        return self._append(time_reduction=("timmean",))
+
+    def running_mean(self, n):
+        """
+        Return the running mean of the field over 'n' records.
+        """
+
+        first, last = self.window.get("time", (0, 0))
+        if n < 1 or n > last - first:
+            raise ValueError("running mean over {} of {} records".format(n, last - first))
+        return self._append(time_reduction=("runmean", n))
+
+    def output_dimensions(self):
+        """
+        Return the dimensions and shape of the evaluated field.
+
+        Returns: list of (dimension, length)
+        """
+
+        reduced = set()
+        for step in self.steps:
+            if step[0] in space_reductions:
+                reduced.update(self.dimensions[k] for k in step[1])
+        result = []
+        for d, (start, stop) in self.window.items():
+            if d in reduced:
+                continue
+            n = stop - start
+            if d == "time" and self.time_reduction is not None:
+                n = 1 if self.time_reduction[0] == "timmean" else n - self.time_reduction[1] + 1
+            result.append((d, n))
+        return result
+
+    def record_bytes(self):
+        """
+        Return the bytes of one record of the window.
+        """
+
+        return self.dtype.itemsize * int(
+            np.prod([stop - start for d, (start, stop) in self.window.items() if d != "time"])
+        )
+
+
+def apply_steps(data, steps):
+    """
+    Apply 'steps' to the masked array 'data'.
+
+    Returns: masked array
+    """
+
+    for step in steps:
+        if step[0] == "scale":
+            data = data * step[1] + step[2]
+        else:
+            data = space_reductions[step[0]](data, axis=step[1])
+    return np.ma.asarray(data)
+
+
+def evaluate_block(args):
+    """
+    Read records 'start' to 'stop' of the field and apply its steps; with
+    a time reduction, return the partial sum and count (timmean) or the
+    running means of the windows within the records (runmean).
+
+    Returns: masked array, or tuple of arrays (timmean)
+    """
+
+    field, start, stop = args
+    index = tuple(slice(*field.window[d]) if d != "time" else slice(start, stop) for d in field.dimensions)
+    with NC(field.filename) as nc:
+        data = nc.variables[field.variable][index]
+    data = apply_steps(np.ma.asarray(data, dtype=np.float64 if data.dtype.kind != "f" else data.dtype), field.steps)
+
+    if field.time_reduction is None:
+        return data
+    valid = (~np.ma.getmaskarray(data)).astype(np.int64)
+    filled = np.ma.filled(data, 0)
+    if field.time_reduction[0] == "timmean":
+        return filled.sum(axis=0), valid.sum(axis=0)
+    n = field.time_reduction[1]
+    zeros = np.zeros((1,) + filled.shape[1:])
+    sums = np.cumsum(np.concatenate([zeros, filled]), axis=0)
+    counts = np.cumsum(np.concatenate([zeros, valid]), axis=0)
+    window_counts = counts[n:] - counts[:-n]
+    means = (sums[n:] - sums[:-n]) / np.maximum(window_counts, 1)
+    return np.ma.masked_where(window_counts == 0, means)
+
+
+def blocks(field, n_records, overlap=0):
+    """
+    Return the record ranges (start, stop) read for each block of
+    'n_records' output records of 'field'; consecutive ranges overlap
+    by 'overlap' records.
+
+    Returns: list of tuples
+    """
+
+    first, last = field.window["time"]
+    n_out = last - first - overlap
+    return [(first + k, first + min(k + n_records, n_out) + overlap) for k in range(0, n_out, n_records)]
+
+
+def time_values(field, nc):
+    """
+    Return the time of each output record of 'field'.
+
+    Returns: numpy array
+    """
+
+    first, last = field.window["time"]
+    t = nc.variables["time"][first:last]
+    if field.time_reduction is None:
+        return t
+    if field.time_reduction[0] == "timmean":
+        return np.array([t.mean()])
+    n = field.time_reduction[1]
+    return np.convolve(t, np.ones(n) / n, mode="valid")
+
+
+def write(fields, target, jobs=None, memory=default_memory, complevel=3):
+    """
+    Evaluate 'fields' (sharing one file, window and time reduction) and
+    write them to 'target', 'jobs' blocks at a time, holding at most
+    about 'memory' bytes of records.
+    """
+
+    fields = list(fields)
+    first = fields[0]
+    for f in fields[1:]:
+        if (f.filename, f.window, f.time_reduction) != (first.filename, first.window, first.time_reduction):
+            raise ValueError("fields written together must share the file, window and time reduction")
+    jobs = jobs or os.cpu_count() or 1
+    by_time = "time" in first.window
+
+    tmp = "{}.tmp{}".format(target, os.getpid())
+    try:
+        with NC(first.filename) as src, NC(tmp, "w", format="NETCDF4") as dst:
+            attrs = OrderedDict((a, src.getncattr(a)) for a in src.ncattrs())
+            history = "{}: {}".format(time.asctime(), "; ".join(describe(f) for f in fields))
+            attrs["history"] = "\n".join([history] + ([attrs["history"]] if "history" in attrs else []))
+            dst.setncatts(attrs)
+
+            outputs = []
+            for f in fields:
+                dims = f.output_dimensions()
+                for d, n in dims:
+                    if d not in dst.dimensions:
+                        dst.createDimension(d, None if d == "time" else n)
+                        if d in src.variables and d != "time":
+                            start, stop = f.window[d]
+                            coord = dst.createVariable(d, src.variables[d].datatype, (d,))
+                            coord.setncatts(
+                                OrderedDict((a, src.variables[d].getncattr(a)) for a in src.variables[d].ncattrs())
+                            )
+                            coord[:] = src.variables[d][start:stop]
+                out = dst.createVariable(
+                    f.name,
+                    "f8" if f.dtype.kind != "f" else f.dtype,
+                    [d for d, _ in dims],
+                    zlib=complevel > 0,
+                    complevel=max(complevel, 1),
+                    fill_value=np.ma.default_fill_value(np.dtype("f8" if f.dtype.kind != "f" else f.dtype)),
+                )
+                attrs = OrderedDict(f.attrs)
+                if f.reduced():
+                    attrs.pop("grid_mapping", None)
+                out.setncatts(attrs)
+                outputs.append(out)
+
+            if by_time:
+                time_var = dst.createVariable("time", "f8", ("time",))
+                time_var.setncatts(
+                    OrderedDict(
+                        (a, src.variables["time"].getncattr(a))
+                        for a in src.variables["time"].ncattrs()
+                        if a != "bounds"
+                    )
+                )
+                time_var[:] = time_values(first, src)
+            mapping = first.attrs.get("grid_mapping")
+            if mapping in src.variables and not first.reduced():
+                m = dst.createVariable(mapping, src.variables[mapping].datatype)
+                m.setncatts(
+                    OrderedDict((a, src.variables[mapping].getncattr(a)) for a in src.variables[mapping].ncattrs())
+                )
+
+            for f, out in zip(fields, outputs):
+                evaluate(f, out, jobs, memory)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, target)
+
+
+def evaluate(field, out, jobs, memory):
+    """
+    Evaluate 'field' into the netCDF variable 'out', 'jobs' blocks at a
+    time.
+    """
+
+    if "time" not in field.window:
+        out[:] = evaluate_block((field, 0, 0))
+        return
+
+    overlap = field.time_reduction[1] - 1 if field.time_reduction and field.time_reduction[0] == "runmean" else 0
+    n_records = max(memory // (jobs * block_copies * max(field.record_bytes(), 1)) - overlap, 1)
+    ranges = blocks(field, n_records, overlap)
+
+    total = count = None
+    k = 0
+    with Pool(min(jobs, len(ranges))) as pool:
+        pending = deque()
+        for r in ranges + [None] * jobs:
+            if r is not None:
+                pending.append(pool.apply_async(evaluate_block, ((field, r[0], r[1]),)))
+            if len(pending) < jobs and r is not None:
+                continue
+            if not pending:
+                break
+            result = pending.popleft().get()
+            if field.time_reduction and field.time_reduction[0] == "timmean":
+                total = result[0] if total is None else total + result[0]
+                count = result[1] if count is None else count + result[1]
+            else:
+                out[k : k + len(result)] = result
+                k += len(result)
+
+    if total is not None:
+        out[0] = np.ma.masked_where(count == 0, total / np.maximum(count, 1))
+
+
+def describe(field):
+    """
+    Return the steps of 'field' as text, for the history attribute.
+    """
+
+    words = ["{}[{}]".format(field.variable, ", ".join("{}={}:{}".format(d, *w) for d, w in field.window.items()))]
+    for step in field.steps:
+        words.append("{}({:g}, {:g})".format(*step) if step[0] == "scale" else step[0])
+    if field.time_reduction is not None:
+        words.append(" ".join(str(s) for s in field.time_reduction))
+    if field.name != field.variable:
+        words.append("as " + field.name)
+    return " -> ".join(words)
+
+
+class Step(Action):
+    """
+    Record command line steps in the order given.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        steps = getattr(namespace, "steps", None) or []
+        steps.append((self.dest, values))
+        namespace.steps = steps
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Subset, convert, select and reduce variables of large netCDF files in bounded memory."
+    parser.add_argument("FILES", nargs=2)
+    parser.add_argument("-v", "--variables", dest="variables", help="comma-separated variables", required=True)
+    parser.add_argument("--x_range", dest="x_range", type=float, nargs=2, action=Step)
+    parser.add_argument("--y_range", dest="y_range", type=float, nargs=2, action=Step)
+    parser.add_argument("--records", dest="records", type=int, nargs=2, action=Step, help="records START STOP")
+    parser.add_argument("--start", dest="start", action=Step, help="first date")
+    parser.add_argument("--end", dest="end", action=Step, help="end date (excluded)")
+    parser.add_argument("--scale", dest="scale", type=float, action=Step)
+    parser.add_argument("--offset", dest="offset", type=float, action=Step)
+    parser.add_argument("--units", dest="units", action=Step)
+    for reduction in sorted(space_reductions):
+        parser.add_argument("--" + reduction, dest=reduction, nargs=0, action=Step)
+    parser.add_argument("--timmean", dest="timmean", nargs=0, action=Step)
+    parser.add_argument("--runmean", dest="runmean", type=int, action=Step)
+    parser.add_argument("--rename", dest="rename", action=Step, help="new name (one variable)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, help="processes. default: all cores", default=None)
+    parser.add_argument("--memory", dest="memory", type=float, help="memory for records in GB", default=None)
+    parser.add_argument("-L", "--level", dest="level", type=int, help="compression level", default=3)
+    options = parser.parse_args()
+
+    source, target = options.FILES
+    fields = [Field(source, v) for v in options.variables.split(",")]
+    for step, value in getattr(options, "steps", None) or []:
+        for k, f in enumerate(fields):
+            if step == "x_range":
+                f = f.subset(x_range=value)
+            elif step == "y_range":
+                f = f.subset(y_range=value)
+            elif step == "records":
+                f = f.select_records(*value)
+            elif step == "start":
+                f = f.select_time(start_date=value)
+            elif step == "end":
+                f = f.select_time(end_date=value)
+            elif step == "scale":
+                f = f.scale(factor=value)
+            elif step == "offset":
+                f = f.scale(offset=value)
+            elif step == "units":
+                f = f.set_units(value)
+            elif step in space_reductions:
+                f = f.reduce_space(step)
+            elif step == "timmean":
+                f = f.time_mean()
+            elif step == "runmean":
+                f = f.running_mean(value)
+            elif step == "rename":
+                f = f.rename(value)
+            fields[k] = f
+
+    memory = int(options.memory * 1024**3) if options.memory is not None else default_memory
+    write(fields, target, options.jobs, memory, options.level)
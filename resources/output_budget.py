@@ -0,0 +1,277 @@
+"""
+output_budget
+=============
+
+Provides:
+  - an estimate of the size of the spatial time series (-extra_file) a
+    run writes: number of records, bytes per record, bytes written and
+    the expected size after compression
+  - budget checks per run and per ensemble that either refuse a setup
+    or coarsen the writing interval (exstep) until it fits
+
+Sizes are estimates: every field is counted at its full grid size and
+compression ratios are typical values for ice sheet output (large
+ice-free areas compress well), not guarantees.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import math
+import re
+
+# Number of fields PISM writes for a variable name that is not a single
+# field. Variables not listed here are one field.
+n_fields = {
+    "bwatvel": 2,
+    "deviatoric_stresses": 3,
+    "diffusivity_staggered": 2,
+    "mass_fluxes": 7,
+    "strain_rates": 2,
+    "subglacial_water_flux": 2,
+    "taud": 2,
+    "velbar": 2,
+    "velbase": 2,
+    "velsurf": 2,
+    # the 2D variables of ismip6vars.csv
+    "ismip6": 25,
+}
+
+# Variables with a vertical dimension: "z" (ice, Mz levels) or "zb"
+# (bedrock, Mbz levels).
+vertical_dims = {
+    "age": "z",
+    "effective_viscosity": "z",
+    "enthalpy": "z",
+    "liqfrac": "z",
+    "litho_temp": "zb",
+    "temp": "z",
+    "temp_pa": "z",
+    "uvel": "z",
+    "vvel": "z",
+    "wvel": "z",
+    "wvel_rel": "z",
+}
+
+# Records per model year of the PISM time keywords, from fine to coarse.
+records_per_year = OrderedDict([("hourly", 365.0 * 24), ("daily", 365.0), ("monthly", 12.0), ("yearly", 1.0)])
+
+# Intervals (in years) tried after "yearly" when coarsening.
+coarse_steps = [2, 5, 10, 20, 50, 100]
+
+# Typical compression ratio of PISM output per netCDF compression level.
+compression_ratios = {0: 1.0, 1: 2.0, 2: 2.2, 3: 2.3, 4: 2.4}
+max_compression_ratio = 2.5
+
+# Only these output formats support compression.
+compressed_formats = ("netcdf4_serial",)
+
+size_re = re.compile(r"^\s*([0-9.]+)\s*([KMGTP]?)i?B?\s*$", re.IGNORECASE)
+size_units = ["", "K", "M", "G", "T", "P"]
+
+
+def parse_size(size):
+    """
+    Convert a size such as "500G", "2T" or "1.5TB" to bytes (powers of
+    1024).
+
+    Returns: int
+    """
+
+    m = size_re.match(str(size))
+    if m is None:
+        raise ValueError("Cannot parse size {}. Use e.g. 500G or 2T".format(size))
+    value, unit = m.groups()
+    return int(float(value) * 1024 ** size_units.index(unit.upper()))
+
+
+def format_size(n_bytes):
+    """
+    Convert bytes to a human readable string.
+
+    Returns: string
+    """
+
+    value = float(n_bytes)
+    for unit in size_units:
+        if value < 1024 or unit == size_units[-1]:
+            break
+        value /= 1024
+    return "{:.1f} {}B".format(value, unit)
+
+
+def count_records(exstep, years):
+    """
+    Return the number of records written over 'years' model years with
+    writing interval 'exstep' (a PISM time keyword or a number of years).
+
+    Returns: int
+    """
+
+    if exstep in records_per_year:
+        per_year = records_per_year[exstep]
+    else:
+        try:
+            per_year = 1.0 / float(exstep)
+        except ValueError:
+            raise ValueError("Cannot estimate the number of records for exstep {}".format(exstep))
+    return max(int(math.ceil(years * per_year)), 1)
+
+
+def field_levels(var, grid_dict):
+    """
+    Return the number of 2D slices of 'var' on the grid 'grid_dict'.
+
+    Returns: int
+    """
+
+    dim = vertical_dims.get(var)
+    if dim == "z":
+        levels = int(grid_dict["Mz"])
+    elif dim == "zb":
+        levels = int(grid_dict.get("Mbz", 1) or 1)
+    else:
+        levels = 1
+    return n_fields.get(var, 1) * levels
+
+
+def compression_ratio(oformat, compression_level):
+    """
+    Return the expected compression ratio.
+    """
+
+    if oformat not in compressed_formats or compression_level is None:
+        return 1.0
+    level = int(compression_level)
+    return compression_ratios.get(level, max_compression_ratio)
+
+
+def estimate_output(
+    grid_dict, exvars, exstep, years, oformat="netcdf4_serial", compression_level=None, bytes_per_value=8
+):
+    """
+    Estimate the spatial time series one run writes.
+
+    Returns: OrderedDict
+    """
+
+    points = int(grid_dict["Mx"]) * int(grid_dict["My"])
+    slices = sum(field_levels(var, grid_dict) for var in exvars)
+    records = count_records(exstep, years)
+    ratio = compression_ratio(oformat, compression_level)
+
+    result = OrderedDict()
+    result["exstep"] = exstep
+    result["records"] = records
+    result["fields"] = slices
+    result["bytes_per_record"] = points * slices * bytes_per_value
+    result["bytes"] = result["bytes_per_record"] * records
+    result["compression_ratio"] = ratio
+    result["bytes_compressed"] = int(result["bytes"] / ratio)
+    return result
+
+
+def coarser_steps(exstep):
+    """
+    Return the writing intervals coarser than 'exstep', from fine to
+    coarse.
+
+    Returns: list
+    """
+
+    keywords = list(records_per_year.keys())
+    if exstep in keywords:
+        return keywords[keywords.index(exstep) + 1 :] + coarse_steps
+    try:
+        step = float(exstep)
+    except ValueError:
+        return []
+    return [s for s in coarse_steps if s > step]
+
+
+def enforce_budget(
+    grid_dict, exvars, exstep, years, n_members=1, budget=None, ensemble_budget=None, coarsen=False, **kwargs
+):
+    """
+    Check the compressed output estimate against 'budget' (bytes per
+    run) and 'ensemble_budget' (bytes for 'n_members' runs). If a budget
+    is exceeded, return the finest coarser exstep that fits if 'coarsen'
+    is True, otherwise raise ValueError. Writing intervals longer than
+    the run are not considered.
+
+    Returns: tuple (exstep, estimate)
+    """
+
+    def fits(estimate):
+        run_bytes = estimate["bytes_compressed"]
+        if budget is not None and run_bytes > budget:
+            return False
+        if ensemble_budget is not None and run_bytes * n_members > ensemble_budget:
+            return False
+        return True
+
+    estimate = estimate_output(grid_dict, exvars, exstep, years, **kwargs)
+    if fits(estimate):
+        return exstep, estimate
+
+    message = "Spatial output of {} per run ({} for {} runs) exceeds the budget".format(
+        format_size(estimate["bytes_compressed"]), format_size(estimate["bytes_compressed"] * n_members), n_members
+    )
+    if coarsen:
+        for step in coarser_steps(exstep):
+            if step in coarse_steps and step > years:
+                break
+            candidate = estimate_output(grid_dict, exvars, step, years, **kwargs)
+            if fits(candidate):
+                return step, candidate
+        raise ValueError(message + " even with the coarsest writing interval")
+
+    raise ValueError(message + " with exstep {}. Choose a coarser exstep or fewer variables".format(exstep))
+
+
+if __name__ == "__main__":
+
+    import os
+    import sys
+
+    sys.path.append(os.path.realpath(os.path.dirname(__file__)))
+    from resources import generate_grid_description, spatial_ts_vars
+    from performance import model_years
+
+    parser = ArgumentParser()
+    parser.description = "Estimate the size of the spatial time series of a run."
+    parser.add_argument("-d", "--domain", dest="domain", default="gris")
+    parser.add_argument("-g", "--grid", dest="grid", type=int, default=9000)
+    parser.add_argument("--spatial_ts", dest="spatial_ts", choices=sorted(spatial_ts_vars.keys()), default="standard")
+    parser.add_argument("--exstep", dest="exstep", default="monthly")
+    parser.add_argument("--start", help="start year or date", default="2008-1-1")
+    parser.add_argument("--end", help="end year or date", default="2015-1-1")
+    parser.add_argument("-L", "--comp_level", dest="compression_level", type=int, default=2)
+    parser.add_argument("-f", "--o_format", dest="oformat", default="netcdf4_serial")
+    parser.add_argument("--members", dest="n_members", type=int, help="number of ensemble members", default=1)
+    options = parser.parse_args()
+
+    grid_dict = generate_grid_description(options.grid, options.domain)
+    years = model_years(options.start, options.end)
+    for exstep in [options.exstep] + coarser_steps(options.exstep):
+        if exstep in coarse_steps and exstep > years:
+            break
+        e = estimate_output(
+            grid_dict,
+            spatial_ts_vars[options.spatial_ts],
+            exstep,
+            years,
+            oformat=options.oformat,
+            compression_level=options.compression_level,
+        )
+        print(
+            "{:>8}: {:6d} records of {}, {} written, ~{} compressed, ~{} for {} runs".format(
+                str(exstep),
+                e["records"],
+                format_size(e["bytes_per_record"]),
+                format_size(e["bytes"]),
+                format_size(e["bytes_compressed"]),
+                format_size(e["bytes_compressed"] * options.n_members),
+                options.n_members,
+            )
+        )
@@ -0,0 +1,472 @@
+"""
+performance
+===========
+
+Provides:
+  - a performance database built from past runs: PISM -profile files,
+    job logs and the run_stats/command metadata of output state files
+  - a runtime model per domain and physics (stress balance, hydrology,
+    calving), fit to grid size and core count
+  - walltime, core count and restart step sizing from that model
+
+The model is
+
+  log(wall clock hours per model year) = a + b log(Mx My (Mz + Mbz)) + c log(cores)
+
+fit by least squares to the runs of each (domain, stress_balance,
+hydrology, calving) group, falling back to all runs of the domain and
+then to all runs if a group has too few records.
+
+"""
+
+from argparse import ArgumentParser
+import ast
+from collections import OrderedDict
+import csv
+from datetime import datetime
+import glob
+import math
+import os
+from os.path import basename, join
+import re
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+fields = [
+    "run",
+    "domain",
+    "grid",
+    "Mx",
+    "My",
+    "Mz",
+    "Mbz",
+    "cores",
+    "stress_balance",
+    "hydrology",
+    "calving",
+    "model_years",
+    "wall_clock_hours",
+    "profile",
+]
+
+physics_keys = ("stress_balance", "hydrology", "calving")
+
+# minimum number of runs needed to fit the three model coefficients
+min_records = 3
+
+run_re = re.compile(r"^(?P<domain>[A-Za-z0-9]+(?:_[A-Za-z0-9]+)*?)_g(?P<grid>\d+)m_")
+procs_re = re.compile(r"started on (\d+) procs")
+ofile_re = re.compile(r"Writing model state to file [`'](\S+?)'")
+
+
+def parse_command(command):
+    """
+    Return the values of the PISM command line options used by the
+    runtime model.
+
+    Returns: dict
+    """
+
+    result = {}
+    tokens = command.split()
+    for k, token in enumerate(tokens[:-1]):
+        option = token.lstrip("-")
+        if token.startswith("-") and option in ("Mx", "My", "Mz", "Mbz") + physics_keys:
+            result[option] = tokens[k + 1]
+    return result
+
+
+def profile_value(node):
+    """
+    Return the value of the right-hand side 'node' of an assignment in a
+    PISM -profile file: literals, and numpy.array() of literals, possibly
+    nested in dicts, lists and tuples.
+    """
+
+    if isinstance(node, ast.Dict):
+        return {ast.literal_eval(k): profile_value(v) for k, v in zip(node.keys, node.values)}
+    if isinstance(node, (ast.List, ast.Tuple)):
+        values = [profile_value(v) for v in node.elts]
+        return values if isinstance(node, ast.List) else tuple(values)
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "array"
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id in ("np", "numpy")
+        and len(node.args) == 1
+        and not node.keywords
+    ):
+        return np.array(profile_value(node.args[0]))
+    return ast.literal_eval(node)
+
+
+def profile_target(namespace, node):
+    """
+    Return the container and key that the assignment target 'node' (a
+    name or a chain of subscripts of a name) of a PISM -profile file
+    refers to in 'namespace'.
+
+    Returns: tuple (dict, key)
+    """
+
+    if isinstance(node, ast.Name):
+        return namespace, node.id
+    if isinstance(node, ast.Subscript):
+        container, key = profile_target(namespace, node.value)
+        index = node.slice.value if isinstance(node.slice, getattr(ast, "Index", ())) else node.slice
+        return container[key], ast.literal_eval(index)
+    raise ValueError("unsupported assignment target {}".format(ast.dump(node)))
+
+
+def read_profile(filename):
+    """
+    Read a PISM -profile file and return the maximum time over all ranks
+    of each event.
+
+    The file is a Python script, but it is not executed: only imports
+    and assignments of literals (and numpy arrays of literals) to names
+    and subscripts are accepted.
+
+    Returns: OrderedDict
+    """
+
+    with open(filename) as f:
+        tree = ast.parse(f.read(), filename)
+
+    namespace = {}
+    for statement in tree.body:
+        if isinstance(statement, (ast.Import, ast.ImportFrom)):
+            continue
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+            continue
+        if not isinstance(statement, ast.Assign):
+            raise ValueError("{}:{}: unsupported statement".format(filename, statement.lineno))
+        value = profile_value(statement.value)
+        for target in statement.targets:
+            container, key = profile_target(namespace, target)
+            container[key] = value
+
+    result = OrderedDict()
+
+    def collect(events):
+        for name, event in events.items():
+            if isinstance(event, dict) and "time" in event:
+                result[name] = float(np.max(event["time"]))
+            elif isinstance(event, dict):
+                collect(event)
+
+    for key in ("Stages", "Events", "events", "stages"):
+        if isinstance(namespace.get(key), dict):
+            collect(namespace[key])
+
+    return result
+
+
+def read_job_log(filename):
+    """
+    Return the output file name and the number of MPI ranks reported in
+    a PISM job log.
+
+    Returns: tuple
+    """
+
+    ofile, cores = None, None
+    with open(filename, errors="replace") as f:
+        for line in f:
+            m = procs_re.search(line)
+            if m:
+                cores = int(m.group(1))
+            m = ofile_re.search(line)
+            if m:
+                ofile = basename(m.group(1))
+    return ofile, cores
+
+
+def read_state_file(filename):
+    """
+    Return metadata of a PISM output file written with run_stats.
+
+    Returns: dict or None
+    """
+
+    if NC is None:
+        raise ImportError("netCDF4 is required to read {}".format(filename))
+
+    nc = NC(filename, "r")
+    try:
+        if "run_stats" not in nc.variables:
+            return None
+        stats = nc.variables["run_stats"]
+        result = parse_command(getattr(nc, "command", ""))
+        for dim, option in (("x", "Mx"), ("y", "My"), ("z", "Mz"), ("zb", "Mbz")):
+            if dim in nc.dimensions:
+                result[option] = len(nc.dimensions[dim])
+        wall_clock_hours = float(stats.wall_clock_hours)
+        processor_hours = float(stats.processor_hours)
+        result["wall_clock_hours"] = wall_clock_hours
+        result["cores"] = int(round(processor_hours / wall_clock_hours)) if wall_clock_hours > 0 else None
+        result["model_years"] = processor_hours * float(stats.model_years_per_processor_hour)
+    finally:
+        nc.close()
+
+    return result
+
+
+def ingest_run(output_dir):
+    """
+    Collect performance records from the output directory of a set of
+    runs generated by the scripts in this repository.
+
+    Returns: list of OrderedDict
+    """
+
+    # job logs and profiles are named after the job ID
+    jobs = {}
+    for job_log in glob.glob(join(output_dir, "jobs", "job*")):
+        job_id = basename(job_log).rsplit(".", 1)[-1]
+        ofile, cores = read_job_log(job_log)
+        if ofile is not None:
+            jobs[ofile] = (job_id, cores)
+
+    records = []
+    for state_file in sorted(glob.glob(join(output_dir, "state", "*.nc"))):
+        run = basename(state_file)
+        m = run_re.match(run)
+        if m is None:
+            continue
+        try:
+            metadata = read_state_file(state_file)
+        except (IOError, OSError, AttributeError):
+            metadata = None
+        if metadata is None or not metadata.get("model_years"):
+            continue
+
+        record = OrderedDict([(field, "") for field in fields])
+        record["run"] = run
+        record["domain"] = m.group("domain")
+        record["grid"] = int(m.group("grid"))
+        record["Mbz"] = 0
+        record.update(metadata)
+
+        if run in jobs:
+            job_id, cores = jobs[run]
+            if not record["cores"]:
+                record["cores"] = cores
+            profile = join(output_dir, "performance", "profile_{}.py".format(job_id))
+            if os.path.exists(profile):
+                try:
+                    events = read_profile(profile)
+                    record["profile"] = ";".join("{}={:.1f}".format(k, v) for k, v in events.items())
+                except Exception as e:
+                    print("  skipping {}: {}".format(profile, e))
+
+        if record["cores"]:
+            records.append(record)
+
+    return records
+
+
+def load_database(filename):
+    """
+    Load the performance database.
+
+    Returns: list of OrderedDict
+    """
+
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [OrderedDict(row) for row in csv.DictReader(f)]
+
+
+def save_database(filename, records):
+    """
+    Write the performance database, replacing records of the same run.
+    """
+
+    merged = OrderedDict()
+    for record in load_database(filename) + records:
+        merged[record["run"]] = record
+
+    with open(filename, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for record in merged.values():
+            writer.writerow(record)
+
+
+def grid_points(grid_dict):
+    """
+    Return the number of 3D grid points of a grid description.
+    """
+
+    return (
+        float(grid_dict["Mx"]) * float(grid_dict["My"]) * (float(grid_dict["Mz"]) + float(grid_dict.get("Mbz", 0) or 0))
+    )
+
+
+def fit(records):
+    """
+    Fit the runtime model to 'records'.
+
+    Returns: numpy array (a, b, c)
+    """
+
+    A = np.array([[1.0, math.log(grid_points(r)), math.log(float(r["cores"]))] for r in records])
+    y = np.array([math.log(float(r["wall_clock_hours"]) / float(r["model_years"])) for r in records])
+    coeffs, _, rank, _ = np.linalg.lstsq(A, y, rcond=None)
+    if rank < 3:
+        # not enough variation in grid size or cores: assume ideal
+        # scaling (b = 1, c = -1) and fit the constant only
+        coeffs = np.array([np.mean(y - A[:, 1] + A[:, 2]), 1.0, -1.0])
+    return coeffs
+
+
+class RuntimeModel(object):
+    """
+    Runtime model fit to a performance database.
+    """
+
+    def __init__(self, records):
+        self.records = [r for r in records if float(r["model_years"]) > 0 and float(r["wall_clock_hours"]) > 0]
+        self._coeffs = {}
+
+    def coefficients(self, domain, **physics):
+        """
+        Return the model coefficients for 'domain' and 'physics',
+        using the most specific group with enough records.
+        """
+
+        key = (domain,) + tuple(str(physics.get(k, "")) for k in physics_keys)
+        if key not in self._coeffs:
+            groups = [
+                [r for r in self.records if (r["domain"],) + tuple(r[k] for k in physics_keys) == key],
+                [r for r in self.records if r["domain"] == domain],
+                self.records,
+            ]
+            for group in groups:
+                if len(group) >= min_records:
+                    self._coeffs[key] = fit(group)
+                    break
+            else:
+                raise ValueError("Not enough runs in the performance database to fit a runtime model")
+        return self._coeffs[key]
+
+    def hours_per_year(self, domain, grid_dict, cores, **physics):
+        """
+        Return the predicted wall clock hours per model year.
+        """
+
+        a, b, c = self.coefficients(domain, **physics)
+        return math.exp(a + b * math.log(grid_points(grid_dict)) + c * math.log(cores))
+
+
+def model_years(start, end):
+    """
+    Return the number of model years between 'start' and 'end', given as
+    years or as dates (YYYY-MM-DD).
+    """
+
+    def to_year(date):
+        try:
+            return float(date)
+        except ValueError:
+            d = datetime.strptime(date, "%Y-%m-%d")
+            return d.year + (d.timetuple().tm_yday - 1) / 365.25
+
+    return to_year(end) - to_year(start)
+
+
+def walltime_hours(walltime):
+    """
+    Convert a walltime string HH:MM:SS to hours.
+    """
+
+    h, m, s = (int(x) for x in walltime.split(":"))
+    return h + m / 60.0 + s / 3600.0
+
+
+def format_walltime(hours):
+    """
+    Convert hours to a walltime string HH:MM:SS, rounded up to full minutes.
+    """
+
+    minutes = int(math.ceil(hours * 60))
+    return "{:d}:{:02d}:00".format(minutes // 60, minutes % 60)
+
+
+def size_run(model, domain, grid_dict, ppn, n_cores, years, max_walltime, step=None, safety_factor=1.25, **physics):
+    """
+    Size a run of 'years' model years: choose the smallest whole-node
+    core count (up to the nodes 'n_cores' occupies) for which the run, or
+    a restart segment, finishes within 'max_walltime', the walltime
+    to request and, if 'step' is not None, the restart step in years
+    (the longest step that fits and divides 'years'). A ValueError is
+    raised if no core count fits.
+
+    Returns: OrderedDict with "cores", "walltime" and "step"
+    """
+
+    max_hours = walltime_hours(max_walltime)
+    max_nodes = max(int(math.ceil(float(n_cores) / ppn)), 1)
+
+    for nodes in range(1, max_nodes + 1):
+        cores = nodes * ppn
+        hours = model.hours_per_year(domain, grid_dict, cores, **physics) * safety_factor
+        if step is None and hours * years <= max_hours:
+            break
+        if step is not None and hours <= max_hours:
+            break
+    else:
+        needed = hours * (years if step is None else 1)
+        raise ValueError(
+            "The runtime model predicts {} for {} on {} cores, more than the walltime limit {}; {}".format(
+                format_walltime(needed),
+                "the run" if step is None else "one model year",
+                cores,
+                max_walltime,
+                "use restart steps (--step) or more cores" if step is None else "use more cores",
+            )
+        )
+
+    result = OrderedDict()
+    result["cores"] = cores
+    result["hours_per_year"] = hours
+    if step is None:
+        result["step"] = None
+        result["walltime"] = format_walltime(min(hours * years, max_hours))
+    else:
+        max_step = int(max(min(math.floor(max_hours / hours), years), 1))
+        # restart segments should divide the run evenly
+        result["step"] = max(d for d in range(1, max_step + 1) if int(years) % d == 0)
+        result["walltime"] = format_walltime(min(hours * result["step"], max_hours))
+
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Add PISM runs to the performance database and show the fitted runtime model."
+    parser.add_argument("DB", nargs=1, help="performance database (CSV)")
+    parser.add_argument("OUTDIR", nargs="*", help="output directories of past runs")
+    options = parser.parse_args()
+
+    db = options.DB[0]
+    for output_dir in options.OUTDIR:
+        records = ingest_run(output_dir)
+        print("{}: {} runs".format(output_dir, len(records)))
+        save_database(db, records)
+
+    model = RuntimeModel(load_database(db))
+    groups = sorted(set((r["domain"],) + tuple(r[k] for k in physics_keys) for r in model.records))
+    for group in groups:
+        physics = dict(zip(physics_keys, group[1:]))
+        a, b, c = model.coefficients(group[0], **physics)
+        print("{}: log(h/yr) = {:.3f} + {:.3f} log(points) + {:.3f} log(cores)".format(", ".join(group), a, b, c))
@@ -0,0 +1,366 @@
+"""
+preflight
+=========
+
+Provides a check of the input files of an ensemble before its scripts
+are written:
+
+  - the files PISM will read are taken from the parameters of every
+    member ($input_dir/... values of the parameters in
+    'input_variables': climate, runoff, ocean, frontal melt, front
+    retreat, calving threshold and rate scaling files and the
+    bootstrapping data set)
+  - each file must exist and contain the variables PISM reads from it,
+    cover the x/y extent of regional domains and, for time-dependent
+    forcing, cover the simulated period
+  - netCDF headers are kept in a persistent index keyed by path,
+    modification time and size; files not in the index are opened in
+    parallel, so repeated checks of large ensembles sharing forcing
+    files only stat the files
+
+Usage: python preflight.py [--index headers.json] FILE.nc [FILE.nc ...]
+prints the header summary of netCDF files as stored in the index.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import json
+from multiprocessing import Pool
+import os
+from os.path import abspath, join
+import re
+import sys
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+sys.path.append(os.path.realpath(os.path.dirname(__file__)))
+from filecache import default_directory
+from timeline import date_value
+
+index_name = "headers.json"
+
+# change when read_header() stores different information
+header_version = 2
+
+# PISM parameter -> variables PISM reads from the file it names
+input_variables = OrderedDict(
+    [
+        ("i", ["topg", "thk"]),
+        ("surface_given_file", ["climatic_mass_balance", "ice_surface_temp"]),
+        ("surface_ismip6_file", ["climatic_mass_balance_anomaly", "ice_surface_temp_anomaly"]),
+        ("surface_anomaly_file", ["climatic_mass_balance_anomaly", "ice_surface_temp_anomaly"]),
+        ("hydrology.surface_input_file", ["water_input_rate"]),
+        ("hydrology.surface_input.file", ["water_input_rate"]),
+        ("ocean.th.file", ["theta_ocean", "salinity_ocean"]),
+        ("frontal_melt.routing.file", ["theta_ocean"]),
+        ("frontal_melt.discharge_given.file", ["theta_ocean", "subglacial_discharge"]),
+        ("front_retreat_file", ["land_ice_area_fraction_retreat"]),
+        ("calving.vonmises_calving.threshold_file", ["vonmises_calving_threshold"]),
+        ("calving.rate_scaling.file", ["frac_calving_rate"]),
+    ]
+)
+
+# parameters naming time-dependent forcing that must cover the run
+time_dependent = {
+    "surface_given_file",
+    "surface_ismip6_file",
+    "surface_anomaly_file",
+    "hydrology.surface_input_file",
+    "hydrology.surface_input.file",
+    "ocean.th.file",
+    "frontal_melt.routing.file",
+    "frontal_melt.discharge_given.file",
+    "front_retreat_file",
+}
+
+input_dir_re = re.compile(r"^\$(?:input_dir|\{input_dir\})/(.+)$")
+
+
+def default_index():
+    """
+    Return the header index file: headers.json in the file cache
+    directory.
+    """
+
+    return join(default_directory(), index_name)
+
+
+def file_stamp(path):
+    """
+    Return the modification time and size of 'path', or None if it does
+    not exist.
+    """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def _extent(var):
+    """
+    Return the first and last value of the coordinate variable 'var' as
+    [min, max, spacing].
+    """
+
+    n = len(var)
+    if n == 0:
+        return None
+    first, last = float(var[0]), float(var[n - 1])
+    spacing = abs(float(var[1]) - first) if n > 1 else 0.0
+    return [min(first, last), max(first, last), spacing]
+
+
+def read_header(path):
+    """
+    Read the header of the netCDF file 'path': its variables (and which
+    of them depend on time), x/y extent, number of records and time
+    coverage.
+
+    Returns: dict
+    """
+
+    header = OrderedDict([("version", header_version), ("stamp", file_stamp(path)), ("error", None)])
+    if NC is None:
+        header["error"] = "netCDF4 is not installed"
+        return header
+    try:
+        nc = NC(path)
+    except Exception as e:
+        header["error"] = "cannot open ({})".format(e)
+        return header
+
+    try:
+        header["variables"] = sorted(nc.variables.keys())
+        header["time_variables"] = sorted(
+            name for name, var in nc.variables.items() if var.dimensions[:1] == ("time",) and name != "time"
+        )
+        for coord in ("x", "y"):
+            header[coord] = _extent(nc.variables[coord]) if coord in nc.variables else None
+
+        header["records"] = len(nc.dimensions["time"]) if "time" in nc.dimensions else 0
+        header["time"] = None
+        if "time" in nc.variables and len(nc.variables["time"]) > 0:
+            time = nc.variables["time"]
+            bounds = getattr(time, "bounds", None)
+            if bounds in nc.variables:
+                bnds = nc.variables[bounds]
+                t_min, t_max = float(bnds[0, 0]), float(bnds[len(bnds) - 1, 1])
+            else:
+                t_min, t_max = float(time[0]), float(time[len(time) - 1])
+            header["time"] = OrderedDict(
+                [
+                    ("units", getattr(time, "units", "")),
+                    ("calendar", getattr(time, "calendar", "standard")),
+                    ("min", t_min),
+                    ("max", t_max),
+                ]
+            )
+    except Exception as e:
+        header["error"] = "cannot read header ({})".format(e)
+    finally:
+        nc.close()
+    return header
+
+
+class HeaderIndex(object):
+    """
+    Persistent index of netCDF headers in the JSON file 'filename',
+    keyed by absolute path. An entry is valid while the modification
+    time and size of its file are unchanged.
+    """
+
+    def __init__(self, filename=None, n_jobs=None):
+        if filename is None:
+            filename = default_index()
+        self.filename = filename
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.entries = OrderedDict()
+        self.modified = False
+        self.stats = OrderedDict((s, 0) for s in ("indexed", "read", "missing"))
+        if os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self.entries = json.load(f, object_pairs_hook=OrderedDict)
+            except ValueError:
+                self.entries = OrderedDict()
+
+    def headers(self, paths):
+        """
+        Return the headers of 'paths' (None for files that do not
+        exist), reading files not in the index in parallel.
+
+        Returns: dict
+        """
+
+        result = OrderedDict()
+        stale = []
+        for path in paths:
+            key = abspath(path)
+            stamp = file_stamp(key)
+            if stamp is None:
+                result[path] = None
+                self.stats["missing"] += 1
+            elif (
+                key in self.entries
+                and self.entries[key].get("version") == header_version
+                and self.entries[key]["stamp"] == stamp
+            ):
+                result[path] = self.entries[key]
+                self.stats["indexed"] += 1
+            else:
+                stale.append(path)
+
+        if len(stale) > 1 and self.n_jobs > 1:
+            with Pool(min(self.n_jobs, len(stale))) as pool:
+                headers = pool.map(read_header, [abspath(p) for p in stale])
+        else:
+            headers = [read_header(abspath(p)) for p in stale]
+
+        for path, header in zip(stale, headers):
+            result[path] = header
+            self.entries[abspath(path)] = header
+            self.stats["read"] += 1
+            self.modified = True
+
+        return result
+
+    def save(self):
+        """
+        Write the index if it changed.
+        """
+
+        if not self.modified:
+            return
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = "{}.tmp{}".format(self.filename, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+        self.modified = False
+
+
+def input_files(params_dicts, input_dir):
+    """
+    Collect the input files named by 'params_dicts' (an iterable of PISM
+    parameter dicts, one per member).
+
+    Returns: OrderedDict (path -> OrderedDict parameter -> number of
+    members)
+    """
+
+    files = OrderedDict()
+    for params_dict in params_dicts:
+        for parameter, value in params_dict.items():
+            if parameter not in input_variables:
+                continue
+            m = input_dir_re.match(str(value))
+            if m is None:
+                continue
+            path = join(input_dir, m.group(1))
+            uses = files.setdefault(path, OrderedDict())
+            uses[parameter] = uses.get(parameter, 0) + 1
+    return files
+
+
+def check_header(header, parameters, start_date=None, end_date=None, x_range=None, y_range=None):
+    """
+    Check a file 'header' against the 'parameters' it is used for.
+
+    Returns: list of strings (problems)
+    """
+
+    if header is None:
+        return ["missing"]
+    if header["error"] is not None:
+        return [header["error"]]
+
+    problems = []
+    required = []
+    for parameter in parameters:
+        required += [v for v in input_variables[parameter] if v not in required]
+    missing = [v for v in required if v not in header["variables"]]
+    if missing:
+        problems.append("no variable {}".format(", ".join(missing)))
+
+    for coord, extent in (("x", x_range), ("y", y_range)):
+        if extent is None:
+            continue
+        have = header.get(coord)
+        if have is None:
+            problems.append("no {} coordinate".format(coord))
+            continue
+        c_min, c_max, spacing = have
+        if c_min - spacing > extent[0] or c_max + spacing < extent[1]:
+            problems.append(
+                "{coord} from {c_min:.0f} to {c_max:.0f} does not cover the domain ({e_min:.0f} to {e_max:.0f})".format(
+                    coord=coord, c_min=c_min, c_max=c_max, e_min=extent[0], e_max=extent[1]
+                )
+            )
+
+    if start_date is not None and end_date is not None and any(p in time_dependent for p in parameters):
+        time = header.get("time")
+        if time is None:
+            problems.append("no time axis")
+        else:
+            try:
+                start = date_value(start_date, time["units"], time["calendar"])
+                end = date_value(end_date, time["units"], time["calendar"])
+            except ValueError as e:
+                problems.append(str(e))
+            else:
+                if time["min"] > start or time["max"] < end:
+                    problems.append(
+                        "time from {:g} to {:g} {} does not cover {} to {}".format(
+                            time["min"], time["max"], time["units"], start_date, end_date
+                        )
+                    )
+    return problems
+
+
+def check_inputs(params_dicts, input_dir, start_date=None, end_date=None, x_range=None, y_range=None, index=None):
+    """
+    Check the input files of all members. 'start_date' and 'end_date'
+    are the simulated period (dates; None to skip the time check),
+    'x_range' and 'y_range' the extent of a regional domain.
+
+    Returns: tuple (number of files, OrderedDict path -> (problems,
+    parameter uses))
+    """
+
+    if index is None:
+        index = HeaderIndex()
+
+    files = input_files(params_dicts, input_dir)
+    headers = index.headers(list(files))
+    index.save()
+
+    problems = OrderedDict()
+    for path, uses in files.items():
+        p = check_header(headers[path], uses, start_date, end_date, x_range, y_range)
+        if p:
+            problems[path] = (p, uses)
+    return len(files), problems
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Print the indexed header summary of netCDF files."
+    parser.add_argument("FILES", nargs="+")
+    parser.add_argument(
+        "--index", dest="index", help="Header index. default: headers.json in the file cache", default=None
+    )
+    options = parser.parse_args()
+
+    index = HeaderIndex(options.index)
+    for path, header in index.headers(options.FILES).items():
+        print(json.dumps({path: header}, indent=2))
+    index.save()
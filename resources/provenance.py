@@ -0,0 +1,169 @@
+"""
+provenance
+==========
+
+Provides:
+  - the Git top level, the URL of the "origin" remote and the version of
+    this repository, determined once per process
+  - reading the same information from a precomputed manifest or from
+    environment variables (compute nodes without git)
+  - a single content-hashed provenance record per ensemble
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+# path to a manifest written by write_manifest()
+manifest_env = "CRIOS2PISM_PROVENANCE"
+
+# individual fields, used if no manifest is given
+field_envs = OrderedDict(
+    [("toplevel", "CRIOS2PISM_GIT_TOPLEVEL"), ("url", "CRIOS2PISM_GIT_URL"), ("version", "CRIOS2PISM_GIT_VERSION")]
+)
+
+git_commands = OrderedDict(
+    [
+        ("toplevel", "git rev-parse --show-toplevel"),
+        ("url", "git remote get-url origin"),
+        ("version", "git describe --always"),
+    ]
+)
+
+_provenance = None
+
+
+def read_git(path=None):
+    """
+    Run git in the directory containing this module (or 'path').
+    Fields that git cannot provide are set to "unknown".
+
+    Returns: OrderedDict
+    """
+
+    if path is None:
+        path = os.path.realpath(os.path.dirname(__file__))
+
+    result = OrderedDict()
+    for field, command in git_commands.items():
+        try:
+            output = subprocess.check_output(shlex.split(command), cwd=path, stderr=subprocess.DEVNULL)
+            result[field] = output.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            result[field] = "unknown"
+    return result
+
+
+def read_manifest(filename):
+    """
+    Read provenance from a manifest written by write_manifest().
+
+    Returns: OrderedDict
+    """
+
+    with open(filename) as f:
+        manifest = json.load(f)
+
+    return OrderedDict([(field, str(manifest.get(field, "unknown"))) for field in git_commands])
+
+
+def read_environment():
+    """
+    Read provenance from environment variables. Returns None unless
+    all fields are set.
+
+    Returns: OrderedDict or None
+    """
+
+    if not all(env in os.environ for env in field_envs.values()):
+        return None
+    return OrderedDict([(field, os.environ[env]) for field, env in field_envs.items()])
+
+
+def get_provenance():
+    """
+    Return provenance of this repository, looked up once per process.
+
+    Sources, in order of precedence:
+      1. the manifest named by $CRIOS2PISM_PROVENANCE
+      2. $CRIOS2PISM_GIT_TOPLEVEL, $CRIOS2PISM_GIT_URL and $CRIOS2PISM_GIT_VERSION
+      3. git
+
+    Returns: OrderedDict
+    """
+
+    global _provenance
+
+    if _provenance is None:
+        manifest = os.environ.get(manifest_env)
+        if manifest:
+            _provenance = read_manifest(manifest)
+        else:
+            _provenance = read_environment() or read_git()
+
+    return _provenance.copy()
+
+
+def write_manifest(filename):
+    """
+    Write provenance to a manifest that can be used on machines without git.
+
+    Returns: string
+    """
+
+    with open(filename, "w") as f:
+        json.dump(get_provenance(), f, indent=2)
+        f.write("\n")
+    return filename
+
+
+def provenance_record(**kwargs):
+    """
+    Return the provenance record of this process. Additional key-value
+    pairs (e.g. the ensemble file) are added to the record.
+
+    Returns: OrderedDict
+    """
+
+    record = get_provenance()
+    record["script"] = os.path.realpath(sys.argv[0])
+    record["command"] = " ".join(sys.argv)
+    record.update(kwargs)
+    return record
+
+
+def write_provenance_record(output_dir, **kwargs):
+    """
+    Write the provenance record of this process to 'output_dir'. The
+    file name contains a hash of the content, so identical records are
+    written only once.
+
+    Returns: string
+    """
+
+    content = json.dumps(provenance_record(**kwargs), indent=2, sort_keys=True) + "\n"
+    digest = hashlib.sha1(content.encode()).hexdigest()[:12]
+    filename = os.path.join(output_dir, "provenance_{}.json".format(digest))
+
+    if not os.path.exists(filename):
+        with open(filename, "w") as f:
+            f.write(content)
+
+    return filename
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Write a provenance manifest for use on machines without git."
+    parser.add_argument("FILE", nargs=1, help="manifest file")
+    options = parser.parse_args()
+
+    print("Provenance written to {}".format(write_manifest(options.FILE[0])))
+    print("Set {}={} to use it".format(manifest_env, os.path.realpath(options.FILE[0])))
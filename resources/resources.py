@@ -14,6 +14,18 @@ import math
 import sys
 import os.path
 
+from allocation import recommend_cores
+from chain import guard_command, write_chain_script
+from emission import farm_member_system, write_array_script, write_farm_script
+from domains import compute_grid, get_domain, get_grid, list_domains
+from filecache import FileCache
+from forcing_buffer import choose_buffer_size, local_points, node_memory
+from incremental import ScriptManifest, needs_update
+from io_planner import default_compression_level, load_benchmark, plan_run, state_file_bytes
+from output_budget import enforce_budget, estimate_output, format_size, parse_size
+from performance import RuntimeModel, load_database, model_years, size_run
+from provenance import get_provenance, write_provenance_record
+
 
 def generate_prefix_str(pism_exec):
     """
@@ -32,51 +44,14 @@ def generate_domain(domain):
     Returns: string
     """
 
-    if domain.lower() in ("greenland", "gris", "gris_ext", "ismip6"):
-        pism_exec = "pismr"
-    elif domain.lower() in ("synth_jib", "synth_ellps"):
-        pism_exec = "pismr -regional -calving_wrap_around -ssa_dirichelt_bc"
-    elif domain.lower() in ("hia"):
-        x_min = -652200.0
-        x_max = -232600.0
-        y_min = -1263900.0
-        y_max = -943500.0
-        pism_exec = """pismr -x_range {x_min},{x_max} -y_range {y_min},{y_max} -bootstrap""".format(
-            x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max
-        )
-
-    elif domain.lower() in ("jakobshavn", "jib"):
-        x_min = -280000.0
-        x_max = 320000.0
-        y_min = -2410000.0
-        y_max = -2020000.0
-        pism_exec = """pismr -regional -x_range {x_min},{x_max} -y_range {y_min},{y_max}  -bootstrap -regional.zero_gradient true -regional.no_model_strip 4.5""".format(
-            x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max
-        )
-    elif domain.lower() in ("qaamerujup"):
-        x_min = -250000.0
-        x_max = -153000.0
-        y_min = -2075000.0
-        y_max = -2021000.0
-        pism_exec = """pismr -regional -x_range {x_min},{x_max} -y_range {y_min},{y_max}  -bootstrap -regional.zero_gradient true -regional.no_model_strip 4.5""".format(
-            x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max
-        )
-    elif domain.lower() in ("nw"):
-        x_min = -400000.0
-        x_max = 320000.0
-        y_min = -2022000.0
-        y_max = -1500000.0
-        pism_exec = """pismr -regional -x_range {x_min},{x_max} -y_range {y_min},{y_max}  -bootstrap -regional.zero_gradient true -regional.no_model_strip 4.5""".format(
-            x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max
-        )
-    else:
+    try:
+        return get_domain(domain)["pism_exec"]
+    except ValueError:
         print(("Domain {} not recognized, exiting".format(domain)))
         import sys
 
         sys.exit(0)
 
-    return pism_exec
-
 
 spatial_ts_vars = {}
 
@@ -301,227 +276,21 @@ def generate_grid_description(grid_resolution, domain, restart=False):
     Returns: OrderedDict
     """
 
-    if domain.lower() in ("greenland_ext", "gris_ext", "greenland", "gris"):
-
-        if domain.lower() in ("greenland_ext", "gris_ext"):
-            mx_max = 15120
-            my_max = 19680
-        else:
-            mx_max = 10560
-            my_max = 18240
-
-        resolution_max = 150
-
-        accepted_resolutions = (
-            150,
-            300,
-            450,
-            600,
-            900,
-            1200,
-            1500,
-            1800,
-            2400,
-            3000,
-            3600,
-            4500,
-            6000,
-            9000,
-            18000,
-            36000,
-        )
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        if grid_resolution < 1200:
-            skip_max = 200
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 1200) and (grid_resolution < 4500):
-            skip_max = 100
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 4500) and (grid_resolution < 18000):
-            skip_max = 50
-            mz = 201
-            mzb = 21
-        else:
-            skip_max = 20
-            mz = 101
-            mzb = 11
-
-    elif domain.lower() in ("ismip6"):
-
-        mx_max = 1681
-        my_max = 2881
-
-        resolution_max = 1000
-
-        accepted_resolutions = (1000, 2000)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        skip_max = 200
-        mz = 201
-        mzb = 21
-
-    elif domain.lower() in ("jakobshavn", "jib"):
-
-        mx_max = 4000
-        my_max = 2600
-
-        resolution_max = 150
-
-        accepted_resolutions = (150, 300, 450, 600, 900, 1200, 1500, 1800, 2400, 3000, 3600, 4500)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        if grid_resolution < 1200:
-            skip_max = 200
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 1200) and (grid_resolution < 4500):
-            skip_max = 100
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 4500) and (grid_resolution < 18000):
-            skip_max = 50
-            mz = 201
-            mzb = 21
-        else:
-            skip_max = 20
-            mz = 101
-            mzb = 11
-
-    elif domain.lower() in ("qaamerujup"):
-
-        mx_max = 520
-        my_max = 240
-
-        resolution_max = 150
-
-        accepted_resolutions = (150, 300, 450, 600, 900, 1200)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        if grid_resolution >= 900:
-            skip_max = 200
-            mz = 201
-            mzb = 21
-        else:
-            skip_max = 200
-            mz = 201
-            mzb = 11
-
-    elif domain.lower() in ("nw"):
-
-        mx_max = 4000
-        my_max = 2600
-
-        resolution_max = 150
-
-        accepted_resolutions = (150, 300, 450, 600, 900, 1200, 1500, 1800, 2400, 3000, 3600, 4500)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        if grid_resolution < 1200:
-            skip_max = 200
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 1200) and (grid_resolution < 4500):
-            skip_max = 100
-            mz = 201
-            mzb = 21
-        elif (grid_resolution >= 4500) and (grid_resolution < 18000):
-            skip_max = 50
-            mz = 201
-            mzb = 21
-        else:
-            skip_max = 20
-            mz = 101
-            mzb = 11
-
-    elif domain.lower() in ("synth_ellps"):
-
-        mx_max = 3600
-        my_max = 1000
-
-        resolution_max = 100
-
-        accepted_resolutions = (100, 200, 250, 500, 1000, 2000, 5000)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        skip_max = 200
-        mz = 401
-        mzb = 0
-
-    elif domain.lower() in ("synth_jib"):
-
-        mx_max = 3000
-        my_max = 1000
-
-        resolution_max = 100
-
-        accepted_resolutions = (100, 200, 250, 500, 1000, 2000, 5000)
-
-        try:
-            grid_resolution in accepted_resolutions
-            pass
-        except:
-            print(("grid resolution {}m not recognized".format(grid_resolution)))
-
-        skip_max = 200
-        mz = 401
-        mzb = 0
-
-    grid_div = grid_resolution / resolution_max
-
-    mx = int(mx_max / grid_div)
-    my = int(my_max / grid_div)
-
-    horizontal_grid = OrderedDict()
-    horizontal_grid["Mx"] = mx
-    horizontal_grid["My"] = my
-
-    vertical_grid = OrderedDict()
-    vertical_grid["Lz"] = 4000
-    vertical_grid["Lbz"] = 2000
-    vertical_grid["z_spacing"] = "equal"
-    vertical_grid["Mz"] = mz
-    vertical_grid["Mbz"] = mzb
-
-    grid_options = {}
-    grid_options["skip"] = ""
-    grid_options["skip_max"] = skip_max
-
-    grid_dict = merge_dicts(horizontal_grid, vertical_grid, grid_options)
+    try:
+        grid_dict = get_grid(domain, grid_resolution)
+    except ValueError:
+        # not an accepted resolution: compute the grid anyway if the
+        # domain has a grid description
+        m_domain = get_domain(domain)
+        if not m_domain["resolutions"]:
+            raise ValueError("Domain {} has no grid description".format(domain))
+        print(("grid resolution {}m not recognized".format(grid_resolution)))
+        grid_dict = compute_grid(m_domain, grid_resolution)
 
     if restart is True:
+        grid_options = OrderedDict()
+        grid_options["skip"] = grid_dict["skip"]
+        grid_options["skip_max"] = grid_dict["skip_max"]
         return grid_options
     else:
         return grid_dict
@@ -816,42 +585,70 @@ def list_bed_types():
 
 
 # information about systems
+#
+# queue         - processors per node of each queue
+# farm_mpido    - MPI launcher of task-farm members (see emission.py); it
+#                 has to start a member on cores no other member uses
+# farm_nodefile - hosts of the job, one line per core; each task-farm
+#                 worker gets its own slice in $farm_hostfile
+# memory        - memory per node in GB (debug: the memory of this machine)
+# staging_queue - queue for staging workers (see staging.py)
 systems = {}
 
-systems["debug"] = {"mpido": "mpiexec -n {cores}", "submit": "echo", "job_id": "PBS_JOBID", "queue": {}}
+systems["debug"] = {
+    "mpido": "mpiexec -n {cores}",
+    "farm_mpido": "mpiexec -n {cores}",
+    "submit": "echo",
+    "job_id": "PBS_JOBID",
+    "queue": {},
+}
 
 systems["chinook"] = {
     "mpido": "mpirun -np {cores} -machinefile ./nodes_$SLURM_JOBID",
+    "farm_mpido": "srun --exclusive --ntasks={cores}",
+    "array": {"directive": "#SBATCH --array=0-{last}", "index": "SLURM_ARRAY_TASK_ID"},
+    "chain": {"submit": "sbatch --parsable", "depend": "--dependency=afterok:{job_id}"},
     "submit": "sbatch",
     "work_dir": "SLURM_SUBMIT_DIR",
     "job_id": "SLURM_JOBID",
     "queue": {"t1standard": 24, "t1small": 24, "t2standard": 24, "t2small": 24, "debug": 24, "analysis": 24},
+    "memory": 128,
+    "staging_queue": "analysis",
 }
 
 systems["pleiades"] = {
     "mpido": "mpiexec -n {cores}",
+    "farm_mpido": "mpiexec -n {cores} -hostfile $farm_hostfile",
+    "farm_nodefile": "PBS_NODEFILE",
+    "array": {"directive": "#PBS -J 0-{last}", "index": "PBS_ARRAY_INDEX"},
+    "chain": {"submit": "qsub", "depend": "-W depend=afterok:{job_id}"},
     "submit": "qsub",
     "work_dir": "PBS_O_WORKDIR",
     "job_id": "PBS_JOBID",
     "queue": {"long": 20, "normal": 20},
+    "memory": 64,
 }
 
 systems["pleiades_haswell"] = systems["pleiades"].copy()
 systems["pleiades_haswell"]["queue"] = {"long": 24, "normal": 24}
+systems["pleiades_haswell"]["memory"] = 128
 
 systems["pleiades_ivy"] = systems["pleiades"].copy()
 systems["pleiades_ivy"]["queue"] = {"long": 20, "normal": 20}
 
 systems["pleiades_sandy"] = systems["pleiades"].copy()
 systems["pleiades_sandy"]["queue"] = {"long": 16, "normal": 16}
+systems["pleiades_sandy"]["memory"] = 32
 
 systems["pleiades_broadwell"] = systems["pleiades"].copy()
 systems["pleiades_broadwell"]["queue"] = {"long": 28, "normal": 28}
+systems["pleiades_broadwell"]["memory"] = 128
 
 systems["electra_broadwell"] = systems["pleiades_broadwell"].copy()
 
 systems["electra_skylake"] = systems["pleiades"].copy()
 systems["electra_skylake"]["queue"] = {"long": 40, "normal": 40}
+systems["electra_skylake"]["memory"] = 192
 
 
 # headers for batch jobs
@@ -1107,6 +904,225 @@ def make_batch_header(system_name, n_cores, walltime, queue):
     return system["header"], system
 
 
+def allocate_cores(system_name, queue, n_cores, grid_dict, auto=False):
+    """
+    Check 'n_cores' against the queue's node size and the domain
+    decomposition of 'grid_dict', and print a recommendation if another
+    core count is cheaper. If 'auto' is True, the recommended core count
+    is returned instead of 'n_cores'; otherwise the recommendation is
+    advice only and is skipped if the grid cannot be decomposed for the
+    queue.
+
+    Returns: int
+    """
+
+    if system_name == "debug":
+        return n_cores
+
+    try:
+        ppn = systems[system_name]["queue"][queue]
+    except KeyError:
+        raise ValueError(
+            "There is no queue {} on {}. Pick one of {}.".format(
+                queue, system_name, list(systems[system_name]["queue"].keys())
+            )
+        )
+
+    try:
+        recommended = recommend_cores(grid_dict, ppn, n_cores)
+    except ValueError:
+        if auto:
+            raise
+        # the recommendation is advice only; keep 'n_cores'
+        return n_cores
+    if recommended["cores"] != n_cores:
+        print(
+            (
+                "Recommended: {cores} tasks on {nodes} {ppn}-processor nodes ({Nx}x{Ny} subdomains of at most {xm}x{ym} points) instead of {n_cores} tasks".format(
+                    ppn=ppn, n_cores=n_cores, **recommended
+                )
+            )
+        )
+        if auto:
+            return recommended["cores"]
+
+    return n_cores
+
+
+def size_from_performance_db(db, system_name, queue, domain, grid_dict, n_cores, years, walltime, step=None, **physics):
+    """
+    Size a run from the runtime model fit to the performance database
+    'db' (see performance.py): the core count (at most 'n_cores'), the
+    walltime (at most 'walltime') and, if 'step' is not None, the
+    restart step in years. 'physics' are the stress_balance, hydrology
+    and calving choices as passed to generate_*().
+
+    Returns: tuple (n_cores, walltime, step)
+    """
+
+    if system_name == "debug":
+        ppn = n_cores
+    else:
+        ppn = systems[system_name]["queue"][queue]
+
+    pism_physics = {"stress_balance": physics.get("stress_balance", "")}
+    if physics.get("hydrology"):
+        pism_physics["hydrology"] = generate_hydrology(physics["hydrology"])["hydrology"]
+    if physics.get("calving"):
+        pism_physics["calving"] = generate_calving(physics["calving"])["calving"]
+
+    model = RuntimeModel(load_database(db))
+    sizing = size_run(model, domain, grid_dict, ppn, n_cores, years, walltime, step=step, **pism_physics)
+
+    print(
+        (
+            "Runtime model: {hours_per_year:.3f} hours per model year on {cores} cores, requesting {walltime}".format(
+                **sizing
+            )
+        )
+    )
+    if step is not None and sizing["step"] != step:
+        print(
+            (
+                "Runtime model: restart step {} years instead of {} (the longest step that fits into {} and divides {:g} years)".format(
+                    sizing["step"], step, walltime, years
+                )
+            )
+        )
+    elif step is not None:
+        print(("Runtime model: restart step {} years".format(sizing["step"])))
+
+    return sizing["cores"], sizing["walltime"], sizing["step"]
+
+
+def check_output_budget(
+    spatial_ts,
+    grid_dict,
+    exstep,
+    years,
+    n_members=1,
+    budget=None,
+    ensemble_budget=None,
+    coarsen=False,
+    oformat="netcdf4_serial",
+    compression_level=None,
+):
+    """
+    Print the estimated size of the spatial time series of a run and an
+    ensemble of 'n_members' runs, and check it against 'budget' (per
+    run) and 'ensemble_budget' (per ensemble), given as sizes like
+    "500G". If a budget is exceeded, a coarser exstep is returned if
+    'coarsen' is True; otherwise a ValueError is raised.
+
+    Returns: string or number
+    """
+
+    if spatial_ts == "none":
+        return exstep
+
+    new_exstep, estimate = enforce_budget(
+        grid_dict,
+        spatial_ts_vars[spatial_ts],
+        exstep,
+        years,
+        n_members=n_members,
+        budget=None if budget is None else parse_size(budget),
+        ensemble_budget=None if ensemble_budget is None else parse_size(ensemble_budget),
+        coarsen=coarsen,
+        oformat=oformat,
+        compression_level=compression_level,
+    )
+    if new_exstep != exstep:
+        print(("Output budget: exstep {} exceeds the budget, using {}".format(exstep, new_exstep)))
+    print(
+        (
+            "Output budget: {} records with exstep {}, ~{} per run, ~{} for {} runs".format(
+                estimate["records"],
+                new_exstep,
+                format_size(estimate["bytes_compressed"]),
+                format_size(estimate["bytes_compressed"] * n_members),
+                n_members,
+            )
+        )
+    )
+
+    return new_exstep
+
+
+def plan_output_io(
+    system_name,
+    n_cores,
+    grid_dict,
+    spatial_ts,
+    exstep,
+    years,
+    oformat="auto",
+    compression_level=None,
+    benchmark=None,
+    default_format="netcdf4_parallel",
+):
+    """
+    Plan the output format, compression level and stripe counts of a run
+    from the estimated size of its state file and spatial time series
+    (see io_planner.py). If 'benchmark', a file written by
+    io_benchmark.py, is given, 'oformat' "auto" lets the planner choose
+    the format and a 'compression_level' of None the level. Without a
+    benchmark they mean 'default_format' and the default level; only
+    the stripe counts are planned.
+
+    Returns: OrderedDict
+    """
+
+    if benchmark is None:
+        if oformat == "auto":
+            oformat = default_format
+        if compression_level is None and oformat == "netcdf4_serial":
+            compression_level = default_compression_level
+
+    files = OrderedDict()
+    files["state"] = (state_file_bytes(grid_dict), 1)
+    if spatial_ts != "none":
+        estimate = estimate_output(grid_dict, spatial_ts_vars[spatial_ts], exstep, years)
+        files["spatial_tmp"] = (estimate["bytes"], estimate["records"])
+
+    plan = plan_run(files, n_cores, oformat=oformat, compression_level=compression_level, benchmark=load_benchmark(benchmark))
+    if system_name == "debug":
+        plan["stripes"] = OrderedDict()
+    elif "spatial_tmp" in plan["stripes"]:
+        # post-processed spatial files are as large as PISM's
+        plan["stripes"]["spatial"] = plan["stripes"]["spatial_tmp"]
+
+    print(
+        (
+            "Output plan: o_format {o_format}, compression level {compression_level}, ~{seconds:.0f} s writing, ~{size} on disk".format(
+                size=format_size(plan["bytes"]), **plan
+            )
+        )
+    )
+
+    return plan
+
+
+def stripe_commands(plan, dirs):
+    """
+    Return Bash commands setting the Lustre stripe count of the output
+    directories 'dirs' (a dict as used by the run scripts) to the counts
+    of 'plan' (see plan_output_io()). Directories not in the plan hold
+    small files and get one stripe.
+
+    Returns: string
+    """
+
+    if not plan["stripes"]:
+        return ""
+
+    commands = ["# stripe output directories for the expected file sizes", "if command -v lfs > /dev/null; then"]
+    for key, directory in dirs.items():
+        commands.append("  lfs setstripe -c {} {}".format(plan["stripes"].get(key, 1), directory))
+    commands.append("fi")
+    return "\n".join(commands) + "\n\n"
+
+
 def make_batch_post_header(system):
 
     v = version_header()
@@ -1129,20 +1145,12 @@ def make_batch_header_test():
 
 def version():
     """Return the path to the top directory of the Git repository
-    containing this script, the URL of the "origin" remote and the version."""
-    import inspect
-    import shlex
-    import subprocess
-
-    def output(command):
-        path = os.path.realpath(os.path.dirname(inspect.stack(0)[0][1]))
-        return subprocess.check_output(shlex.split(command), cwd=path).strip()
-
-    return (
-        output("git rev-parse --show-toplevel"),
-        output("git remote get-url origin"),
-        output("git describe --always"),
-    )
+    containing this script, the URL of the "origin" remote and the version.
+
+    The information is looked up once per process, see provenance.get_provenance()."""
+
+    version_info = get_provenance()
+    return (version_info["toplevel"], version_info["url"], version_info["version"])
 
 
 def version_header():
@@ -1162,3 +1170,39 @@ def version_header():
         url=version_info[1],
         version=version_info[2],
     )
+
+
+def rank_memory(system_name, queue, n_cores):
+    """
+    Return the memory per MPI rank in bytes of 'n_cores' ranks on
+    'system_name', or None if the node memory is unknown.
+
+    Returns: int or None
+    """
+
+    system = systems[system_name]
+    if system_name == "debug":
+        memory = node_memory()
+        ranks = n_cores
+    else:
+        memory = system.get("memory")
+        memory = memory * 1024**3 if memory is not None else None
+        ranks = min(system["queue"].get(queue, n_cores), n_cores)
+    if memory is None:
+        return None
+    return memory // max(ranks, 1)
+
+
+def size_forcing_buffer(system_name, queue, n_cores, grid_dict, forcing):
+    """
+    Choose climate_forcing.buffer_size for 'forcing', a list of
+    (records, fields) pairs, one per time-dependent forcing file (see
+    forcing_buffer.py).
+
+    Returns: OrderedDict or None if the memory per rank is unknown
+    """
+
+    memory = rank_memory(system_name, queue, n_cores)
+    if memory is None or not forcing:
+        return None
+    return choose_buffer_size(forcing, local_points(grid_dict, n_cores), memory)
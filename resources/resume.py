@@ -0,0 +1,282 @@
+"""
+resume
+======
+
+Provides resume scripts for members that did not finish, from the
+snapshots PISM wrote while they ran (generators: --save_times, see
+resources.generate_snap_shots):
+
+  - a member is finished if its output file (-o) is complete (PISM
+    writes run_stats at the end of a run)
+  - the snapshots of a member are the files save_<output>*.nc next to
+    its output; a snapshot is consistent if it opens, has a time axis
+    and its last record of the ice thickness can be read
+  - the resume script is the member's script with the parameters from
+    the manifest (run_scripts/manifest.json) changed to start from the
+    latest consistent snapshot (-i) and run to the original end;
+    scalar and spatial time series are appended to
+
+Usage: python resume.py RUN_SCRIPTS_DIR [SCRIPT ...]
+writes <script>_resume.sh for each unfinished member (all members in
+the manifest, or the given scripts) and lists them in resume.list.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import glob
+import json
+import os
+from os.path import basename, join, splitext
+import re
+import sys
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+sys.path.append(os.path.realpath(os.path.dirname(__file__)))
+from bootstrap import bootstrap_re
+from timeline import value_date
+
+# variables of the run header (see engine.run_header_template)
+header_variable_re = re.compile(r'^(config|input_dir|output_dir|spatial_tmp_dir)="(.*)"$', re.M)
+
+# parameters that bootstrap a run or set its start; a resumed run starts
+# from the snapshot instead
+start_parameters = ["bootstrap", "regrid_file", "regrid_vars", "time_file", "ys"]
+
+
+def header_variables(scripts_dir, script):
+    """
+    Return the shell variables set by the run header of 'script', or of
+    another script in 'scripts_dir' if it has none (members of job
+    arrays and task farms).
+
+    Returns: dict
+    """
+
+    candidates = [script] + sorted(glob.glob(join(scripts_dir, "*.sh")))
+    for candidate in candidates:
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate) as f:
+            variables = dict(header_variable_re.findall(f.read()))
+        if "output_dir" in variables:
+            return variables
+    return {}
+
+
+def expand(value, variables):
+    """
+    Replace $name and ${name} in 'value' by 'variables'.
+
+    Returns: string
+    """
+
+    for name, v in variables.items():
+        value = value.replace("${" + name + "}", v).replace("$" + name, v)
+    return value
+
+
+def is_complete(filename):
+    """
+    Return True if 'filename' is a complete PISM output file.
+    """
+
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return False
+    try:
+        with NC(filename) as nc:
+            return "run_stats" in nc.variables
+    except Exception:
+        return False
+
+
+def read_snapshot(filename):
+    """
+    Return the time (value, units and calendar) of the last record of
+    the snapshot 'filename', or None if it is not consistent.
+
+    Returns: OrderedDict
+    """
+
+    try:
+        with NC(filename) as nc:
+            time = nc.variables["time"]
+            n = len(time)
+            if n == 0 or "thk" not in nc.variables:
+                return None
+            nc.variables["thk"][n - 1]
+            return OrderedDict(
+                [
+                    ("file", filename),
+                    ("time", float(time[n - 1])),
+                    ("units", time.units),
+                    ("calendar", getattr(time, "calendar", "standard")),
+                ]
+            )
+    except Exception:
+        return None
+
+
+def end_date(params, variables):
+    """
+    Return the end of the run with 'params': the end of its time file,
+    or -ye.
+
+    Returns: string or None
+    """
+
+    if "time_file" in params:
+        try:
+            with NC(expand(params["time_file"], variables)) as nc:
+                time = nc.variables["time"]
+                bounds = getattr(time, "bounds", None)
+                if bounds in nc.variables:
+                    t_end = float(nc.variables[bounds][-1, 1])
+                else:
+                    t_end = float(time[-1])
+                return value_date(t_end, time.units, getattr(time, "calendar", "standard"))
+        except Exception:
+            return None
+    return params.get("ye")
+
+
+def latest_snapshot(params, variables):
+    """
+    Return the latest consistent snapshot of the member with 'params'.
+
+    Returns: OrderedDict (see read_snapshot()) or None
+    """
+
+    if "save_file" not in params:
+        return None
+    prefix = expand(params["save_file"], variables)
+    if prefix.endswith(".nc"):
+        prefix = prefix[: -len(".nc")]
+    snapshots = [read_snapshot(f) for f in glob.glob(glob.escape(prefix) + "*.nc")]
+    snapshots = [s for s in snapshots if s is not None]
+    if not snapshots:
+        return None
+    return max(snapshots, key=lambda s: s["time"])
+
+
+def resume_params(params, snapshot, end):
+    """
+    Return the parameters 'params' of a member changed to run from
+    'snapshot' to 'end'.
+
+    Returns: OrderedDict
+    """
+
+    result = OrderedDict((k, v) for k, v in params.items() if k not in start_parameters)
+    result["i"] = snapshot["file"]
+    result["ye"] = end
+    if "ts_file" in result:
+        result["ts_append"] = ""
+    if "extra_file" in result:
+        result["extra_append"] = ""
+    return result
+
+
+def render(params):
+    """
+    Return 'params' as written into run scripts by engine.Run.command().
+
+    Returns: string
+    """
+
+    return " \\\n  ".join(["-{} {}".format(k, v) for k, v in params.items()])
+
+
+def write_resume_script(script, params, new_params, snapshot):
+    """
+    Write the resume script of 'script', which runs PISM with 'params',
+    running it with 'new_params' instead.
+
+    Returns: string (the resume script)
+    """
+
+    with open(script) as f:
+        text = f.read()
+    old = render(params)
+    k = text.find(old)
+    if k < 0:
+        raise ValueError("{}: the PISM command does not match the manifest".format(script))
+
+    line_start = text.rfind("\n", 0, k) + 1
+    date = value_date(snapshot["time"], snapshot["units"], snapshot["calendar"])
+    comment = "# resumed from {} ({}), see resources/resume.py\n".format(snapshot["file"], date)
+    command = bootstrap_re.sub("", text[line_start:k])
+    text = text[:line_start] + comment + command + render(new_params) + text[k + len(old) :]
+
+    resume_script = splitext(script)[0] + "_resume.sh"
+    with open(resume_script, "w") as f:
+        f.write(text)
+    return resume_script
+
+
+def resume(scripts_dir, scripts=None):
+    """
+    Write resume scripts for the unfinished members in 'scripts_dir'
+    (those of 'scripts' if given).
+
+    Returns: OrderedDict script -> status
+    """
+
+    with open(join(scripts_dir, "manifest.json")) as f:
+        manifest = json.load(f, object_pairs_hook=OrderedDict)
+
+    keys = [basename(s) for s in scripts] if scripts else list(manifest.keys())
+    result = OrderedDict()
+    for key in keys:
+        entry = manifest.get(key)
+        if entry is None or "params" not in entry:
+            result[key] = "not in the manifest"
+            continue
+        script = entry.get("script", join(scripts_dir, key))
+        params = entry["params"]
+        variables = header_variables(scripts_dir, script)
+
+        if "o" in params and is_complete(expand(params["o"], variables)):
+            result[key] = "complete"
+            continue
+        snapshot = latest_snapshot(params, variables)
+        if snapshot is None:
+            result[key] = "no snapshot, rerun {}".format(script)
+            continue
+        end = end_date(params, variables)
+        if end is None:
+            result[key] = "cannot determine the end of the run"
+            continue
+        try:
+            result[key] = write_resume_script(script, params, resume_params(params, snapshot, end), snapshot)
+        except ValueError as e:
+            result[key] = str(e)
+
+    with open(join(scripts_dir, "resume.list"), "w") as f:
+        for status in result.values():
+            if status.endswith("_resume.sh"):
+                f.write(status + "\n")
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Write scripts resuming unfinished members from their latest snapshot."
+    parser.add_argument("RUN_SCRIPTS_DIR", nargs=1)
+    parser.add_argument("SCRIPTS", nargs="*", help="members to resume. default: all in the manifest")
+    options = parser.parse_args()
+
+    if NC is None:
+        print("resume.py needs netCDF4")
+        sys.exit(1)
+
+    result = resume(options.RUN_SCRIPTS_DIR[0], options.SCRIPTS)
+    for key, status in result.items():
+        print("{}: {}".format(key, status))
+    n = sum(1 for status in result.values() if status.endswith("_resume.sh"))
+    print("{} resume scripts written, listed in {}".format(n, join(options.RUN_SCRIPTS_DIR[0], "resume.list")))
@@ -0,0 +1,148 @@
+"""
+scheduler
+=========
+
+Provides a worker pool for post-processing many files of very different
+sizes (scalar time series of kilobytes, spatial files of gigabytes):
+
+  - tasks are started largest first, so the large files do not end up
+    at the tail of the batch
+  - a task is started only if a worker is free and its estimated memory
+    fits into the memory not used by running tasks (smaller tasks may go
+    first); a task needing more than all of it runs alone
+  - completions are reported as they happen, with the time each task
+    took and the progress of the batch
+  - a failing task is recorded with its traceback; the others go on
+
+The memory available to the workers is a fraction of the memory of the
+job (SLURM_MEM_PER_NODE) or of this machine.
+
+"""
+
+from collections import OrderedDict
+from multiprocessing import Pool
+import os
+from os.path import dirname, realpath
+import queue
+import sys
+import time
+import traceback
+
+sys.path.append(realpath(dirname(__file__)))
+from forcing_buffer import node_memory
+
+# fraction of the memory of the job the workers may use; the rest is
+# left for the parent and the file system cache
+default_memory_fraction = 0.8
+
+summary_fields = ["name", "bytes", "memory", "status", "seconds", "error"]
+
+
+def available_memory(fraction=default_memory_fraction):
+    """
+    Return the memory the workers may use in bytes: 'fraction' of the
+    memory of the SLURM job, or of this machine. None if it cannot be
+    determined.
+    """
+
+    memory = os.environ.get("SLURM_MEM_PER_NODE")
+    if memory is not None and memory.isdigit():
+        memory = int(memory) * 1024**2
+    else:
+        memory = node_memory()
+    return int(memory * fraction) if memory else None
+
+
+def make_task(name, argument, size, memory):
+    """
+    Return a task applying the function of the batch to 'argument',
+    reported as 'name'; 'size' orders the tasks, 'memory' is the
+    estimated memory of the task in bytes.
+
+    Returns: OrderedDict
+    """
+
+    return OrderedDict([("name", name), ("argument", argument), ("size", size), ("memory", memory)])
+
+
+def run_task(function, argument):
+    """
+    Apply 'function' to 'argument' in a worker.
+
+    Returns: tuple (status, result, seconds, error)
+    """
+
+    start = time.time()
+    try:
+        return "done", function(argument), time.time() - start, None
+    except Exception:
+        return "failed", None, time.time() - start, traceback.format_exc()
+
+
+def run_tasks(function, tasks, n_procs, memory=None):
+    """
+    Apply 'function' to the arguments of 'tasks' (see make_task()) on
+    'n_procs' workers, running tasks of at most 'memory' bytes in total
+    (None: no limit).
+
+    Returns: list of OrderedDict (see summary_fields, and "result"), in
+    the order of 'tasks'
+    """
+
+    results = []
+    for t in tasks:
+        r = OrderedDict((f, "") for f in summary_fields)
+        r.update(name=t["name"], bytes=t["size"], memory=t["memory"], result=None)
+        results.append(r)
+    if not tasks:
+        return results
+
+    pending = sorted(range(len(tasks)), key=lambda k: tasks[k]["size"], reverse=True)
+    total = sum(t["size"] for t in tasks)
+    finished = queue.Queue()
+    running = OrderedDict()
+    used = 0
+    done_bytes = 0
+    start = time.time()
+
+    with Pool(max(min(n_procs, len(tasks)), 1)) as pool:
+        while pending or running:
+            for k in list(pending):
+                if len(running) >= n_procs:
+                    break
+                need = tasks[k]["memory"]
+                if running and memory is not None and used + need > memory:
+                    continue
+                if not running and memory is not None and need > memory:
+                    print("{} needs about {:.1f} GB, running it alone".format(tasks[k]["name"], need / 1024.0**3))
+                pending.remove(k)
+                running[k] = need
+                used += need
+                pool.apply_async(
+                    run_task,
+                    (function, tasks[k]["argument"]),
+                    callback=lambda r, k=k: finished.put((k, r)),
+                    error_callback=lambda e, k=k: finished.put((k, ("failed", None, 0.0, repr(e)))),
+                )
+
+            k, (status, result, seconds, error) = finished.get()
+            used -= running.pop(k)
+            done_bytes += tasks[k]["size"]
+            results[k].update(status=status, seconds="{:.1f}".format(seconds), error=error or "", result=result)
+            n_finished = sum(1 for r in results if r["status"])
+            print(
+                "[{}/{}] {} {} after {:.1f} s ({:.0f}% of {:.1f} GB in {:.0f} s)".format(
+                    n_finished,
+                    len(tasks),
+                    tasks[k]["name"],
+                    status,
+                    seconds,
+                    100.0 * done_bytes / max(total, 1),
+                    total / 1024.0**3,
+                    time.time() - start,
+                )
+            )
+            if error:
+                print(error)
+
+    return results
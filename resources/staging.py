@@ -0,0 +1,241 @@
+"""
+staging
+=======
+
+Provides a queue for the work done on the output files of a run after
+PISM exits (compression, rechunking, moving files out of the temporary
+directory, extracting the ice-ocean interface), so it does not hold the
+MPI allocation:
+
+  - run scripts hand a task (a list of shell commands) to the queue
+    directory $output_dir/staging/queue and exit; the task file is
+    written under a hidden name and renamed, so workers never see a
+    partial task
+  - workers claim tasks by renaming them into running/ (atomic on a
+    shared file system, so several workers may serve one queue), run up
+    to --jobs of them at a time and move them to done/ or failed/, with
+    the output in logs/
+  - a worker stops when --expect tasks are finished, or after --idle
+    seconds without tasks
+
+Usage: python staging.py [-j jobs] [--expect N] [--idle seconds] STAGING_DIR
+runs a worker; python staging.py --status STAGING_DIR prints the
+number of tasks in each state.
+
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+import os
+from os.path import basename, join
+import socket
+import subprocess
+import sys
+import time
+
+states = ["queue", "running", "done", "failed", "logs"]
+
+# shell commands of the steps a task may have
+step_commands = {
+    "compress": "ncks -O -4 -L 3 {source} {target}",
+    "move": "mv {source} {target}",
+    "extract_interface": "extract_interface.py -t ice_ocean -o {target} {source}",
+    "rechunk": "{python} {chunking} -L 3 --profile {profile} {source} {target}",
+}
+
+chunking_script = join(os.path.realpath(os.path.dirname(__file__)), "chunking.py")
+
+# seconds between looks at an empty queue
+poll_interval = 10
+
+
+def step_command(step):
+    """
+    Return the shell command of 'step', a tuple (kind, source, target)
+    with kind one of compress, move and extract_interface, or
+    ("rechunk", source, target, profile) (see chunking.py).
+
+    Returns: string
+    """
+
+    kind, source, target = step[:3]
+    if kind == "rechunk":
+        return step_commands[kind].format(
+            python=sys.executable or "python", chunking=chunking_script, profile=step[3], source=source, target=target
+        )
+    return step_commands[kind].format(source=source, target=target)
+
+
+def enqueue_command(staging_dir, name, steps):
+    """
+    Return shell commands handing the task 'name' with 'steps' (see
+    step_command()) to the queue in 'staging_dir'. Shell variables in
+    the steps are expanded when the task is queued.
+
+    Returns: string
+    """
+
+    queue = join(staging_dir, "queue")
+    return """# hand the output files to the staging queue (see resources/staging.py)
+mkdir -p {queue}
+cat > {queue}/.{name}.sh <<EOF
+{commands}
+EOF
+mv {queue}/.{name}.sh {queue}/{name}.sh
+""".format(queue=queue, name=name, commands="\n".join(step_command(step) for step in steps))
+
+
+def worker_command(staging_dir, jobs, expect):
+    """
+    Return the command running a worker for 'expect' tasks in
+    'staging_dir'.
+
+    Returns: string
+    """
+
+    return "{python} {staging} --jobs {jobs} --expect {expect} {staging_dir}".format(
+        python=sys.executable or "python",
+        staging=os.path.realpath(__file__),
+        jobs=jobs,
+        expect=expect,
+        staging_dir=staging_dir,
+    )
+
+
+def status(staging_dir, since=None):
+    """
+    Return the number of tasks in each state (moved there after the time
+    'since', if given).
+
+    Returns: OrderedDict
+    """
+
+    result = OrderedDict()
+    for state in states[:4]:
+        d = join(staging_dir, state)
+        tasks = [join(d, f) for f in os.listdir(d) if f.endswith(".sh")] if os.path.isdir(d) else []
+        if since is not None:
+            tasks = [t for t in tasks if os.path.getmtime(t) >= since]
+        result[state] = len(tasks)
+    return result
+
+
+def claim(staging_dir):
+    """
+    Claim the oldest task in the queue.
+
+    Returns: tuple (task name, claimed task file) or None if the queue
+    is empty
+    """
+
+    queue = join(staging_dir, "queue")
+    try:
+        tasks = [join(queue, f) for f in os.listdir(queue) if f.endswith(".sh") and not f.startswith(".")]
+    except OSError:
+        return None
+
+    def mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    for task in sorted(tasks, key=mtime):
+        claimed = join(staging_dir, "running", "{}_{}_{}".format(socket.gethostname(), os.getpid(), basename(task)))
+        try:
+            os.rename(task, claimed)
+        except OSError:
+            # another worker was faster
+            continue
+        return basename(task), claimed
+    return None
+
+
+def work(staging_dir, jobs=1, expect=None, idle=None):
+    """
+    Run the tasks in 'staging_dir', 'jobs' at a time, until 'expect'
+    tasks finished after the worker started (including those of other
+    workers) are done or failed, or until the queue was empty for 'idle'
+    seconds.
+
+    Returns: OrderedDict (number of tasks this worker finished, by
+    state)
+    """
+
+    for state in states:
+        os.makedirs(join(staging_dir, state), exist_ok=True)
+
+    finished = OrderedDict([("done", 0), ("failed", 0)])
+    running = []
+    start = last_task = time.time()
+    while True:
+        for entry in list(running):
+            name, task, process, log = entry
+            if process.poll() is None:
+                continue
+            log.close()
+            state = "done" if process.returncode == 0 else "failed"
+            os.replace(task, join(staging_dir, state, name))
+            # tasks of earlier runs are older than the start of a worker
+            os.utime(join(staging_dir, state, name))
+            finished[state] += 1
+            running.remove(entry)
+
+        while len(running) < jobs:
+            claimed = claim(staging_dir)
+            if claimed is None:
+                break
+            name, task = claimed
+            log = open(join(staging_dir, "logs", name[: -len(".sh")] + ".log"), "w")
+            process = subprocess.Popen(["bash", "-e", task], stdout=log, stderr=subprocess.STDOUT)
+            running.append((name, task, process, log))
+            last_task = time.time()
+
+        if not running:
+            s = status(staging_dir, since=start)
+            if expect is not None and s["done"] + s["failed"] >= expect:
+                break
+            if idle is not None and time.time() - last_task > idle:
+                break
+        time.sleep(poll_interval if not running else 1)
+    return finished
+
+
+def write_worker_script(filename, batch_header, staging_dir, jobs, expect):
+    """
+    Write a batch script running a worker for 'expect' tasks in
+    'staging_dir'; submit it alongside the run scripts, on a cheap
+    queue.
+    """
+
+    with open(filename, "w") as f:
+        f.write(batch_header)
+        f.write("\n# compress and move the output files of the runs (see resources/staging.py)\n")
+        f.write(worker_command(staging_dir, jobs, expect))
+        f.write("\n")
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Run the staging tasks queued by run scripts."
+    parser.add_argument("STAGING_DIR", nargs=1)
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, help="tasks run at a time", default=1)
+    parser.add_argument(
+        "--expect", dest="expect", type=int, help="stop when this many tasks are finished", default=None
+    )
+    parser.add_argument(
+        "--idle", dest="idle", type=float, help="stop after this many seconds without tasks", default=None
+    )
+    parser.add_argument("--status", dest="status", action="store_true", help="print the number of tasks in each state")
+    options = parser.parse_args()
+
+    staging_dir = options.STAGING_DIR[0]
+    if options.status:
+        print(", ".join("{} {}".format(n, state) for state, n in status(staging_dir).items()))
+    else:
+        if options.expect is None and options.idle is None:
+            options.idle = 0
+        finished = work(staging_dir, options.jobs, options.expect, options.idle)
+        print("{} tasks done, {} failed".format(finished["done"], finished["failed"]))
+        sys.exit(1 if finished["failed"] else 0)
@@ -0,0 +1,428 @@
+"""
+timeline
+========
+
+Provides time axes for PISM forcing and output files:
+
+  - the bounds of periods of any periodicity (secondly to yearly, every
+    'interval' periods) from a start date, until an end date or for a
+    number of periods
+  - time (start, mid-point or end of each period) and time_bnds in
+    "<unit> since <reference date>" for the standard, proleptic
+    Gregorian, 365_day, 366_day and 360_day calendars
+  - writing time and time_bnds into a new or an existing netCDF file,
+    in place of PISM's create_timeline.py and of adjust_timeline()
+
+Dates are handled as arrays of years, months, days and seconds, so a
+daily axis over 150 years is computed without creating one Python
+object per date. The standard calendar is treated as proleptic
+Gregorian; dates before 1582-10-15 are refused.
+
+Usage: python timeline.py -a 2008-1-1 -e 2015-1-1 -p daily -d 2008-1-1 timefile.nc
+
+"""
+
+from argparse import ArgumentParser
+import re
+
+import numpy as np
+
+try:
+    from netCDF4 import Dataset as NC
+except ImportError:
+    NC = None
+
+# length in seconds of periods of fixed length
+fixed_periods = {"secondly": 1, "minutely": 60, "hourly": 3600, "daily": 86400, "weekly": 7 * 86400}
+
+# length in months of periods of calendar length
+calendar_periods = {"monthly": 1, "seasonal": 3, "yearly": 12}
+
+unit_seconds = {"seconds": 1, "minutes": 60, "hours": 3600, "days": 86400}
+
+gregorian_calendars = ("standard", "gregorian", "proleptic_gregorian")
+
+month_days = {
+    "365_day": [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    "366_day": [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+}
+month_days["noleap"] = month_days["365_day"]
+month_days["all_leap"] = month_days["366_day"]
+
+date_re = re.compile(
+    r"^\s*(-?\d+)-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{1,2})(?::(\d{1,2})(?:\.\d*)?)?)?\s*(?:Z|UTC)?\s*$"
+)
+units_re = re.compile(r"^\s*([A-Za-z]+)\s+since\s+(.+?)\s*$")
+
+
+def parse_date(date):
+    """
+    Split a date "Y-M-D" or "Y-M-D h:m:s" into year, month, day and
+    seconds of the day.
+
+    Returns: tuple of ints
+    """
+
+    m = date_re.match(str(date))
+    if m is None:
+        raise ValueError("Cannot parse date {}. Use e.g. 2008-1-1 or 2008-1-1 12:00".format(date))
+    year, month, day, hour, minute, second = [int(g) if g is not None else 0 for g in m.groups()]
+    return year, month, day, hour * 3600 + minute * 60 + second
+
+
+def days_since_epoch(year, month, day, calendar="standard"):
+    """
+    Return the number of days from a calendar's epoch to each date. The
+    arguments are arrays (or scalars) of ints.
+
+    Returns: numpy array
+    """
+
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+
+    if calendar in gregorian_calendars:
+        # days from 1970-1-1 of the proleptic Gregorian calendar
+        y = year - (month <= 2)
+        era = np.floor_divide(y, 400)
+        yoe = y - era * 400
+        doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+        doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+        return era * 146097 + doe - 719468
+    elif calendar == "360_day":
+        return year * 360 + (month - 1) * 30 + day - 1
+    elif calendar in month_days:
+        lengths = month_days[calendar]
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return year * sum(lengths) + offsets[month - 1] + day - 1
+    else:
+        raise ValueError("Calendar {} is not supported".format(calendar))
+
+
+def epoch_date(days, calendar="standard"):
+    """
+    Return the dates 'days' (an array or scalar of ints) days from a
+    calendar's epoch; the inverse of days_since_epoch().
+
+    Returns: tuple of numpy arrays (years, months, days)
+    """
+
+    days = np.asarray(days, dtype=np.int64)
+
+    if calendar in gregorian_calendars:
+        z = days + 719468
+        era = np.floor_divide(z, 146097)
+        doe = z - era * 146097
+        yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+        doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+        mp = (5 * doy + 2) // 153
+        day = doy - (153 * mp + 2) // 5 + 1
+        month = np.where(mp < 10, mp + 3, mp - 9)
+        return yoe + era * 400 + (month <= 2), month, day
+    elif calendar == "360_day":
+        year, doy = np.divmod(days, 360)
+        return year, doy // 30 + 1, doy % 30 + 1
+    elif calendar in month_days:
+        lengths = month_days[calendar]
+        ends = np.cumsum(lengths)
+        year, doy = np.divmod(days, ends[-1])
+        month = np.searchsorted(ends, doy, side="right")
+        return year, month + 1, doy - np.concatenate([[0], ends])[month] + 1
+    else:
+        raise ValueError("Calendar {} is not supported".format(calendar))
+
+
+def check_date(year, month, day, calendar="standard"):
+    """
+    Raise ValueError if a date does not exist in 'calendar'.
+    """
+
+    if not 1 <= month <= 12:
+        raise ValueError("Invalid month in {}-{}-{}".format(year, month, day))
+    if calendar in gregorian_calendars:
+        if (year, month, day) < (1582, 10, 15):
+            raise ValueError("Dates before 1582-10-15 are not supported in the {} calendar".format(calendar))
+        leap = (year % 4 == 0 and year % 100 != 0) or year % 400 == 0
+        length = month_days["366_day" if leap else "365_day"][month - 1]
+    elif calendar == "360_day":
+        length = 30
+    else:
+        length = month_days[calendar][month - 1]
+    if not 1 <= day <= length:
+        raise ValueError("{}-{}-{} does not exist in the {} calendar".format(year, month, day, calendar))
+
+
+def seconds_since(year, month, day, seconds, ref_date, calendar="standard"):
+    """
+    Return the number of seconds from 'ref_date' to each date.
+
+    Returns: numpy array
+    """
+
+    ref_year, ref_month, ref_day, ref_seconds = parse_date(ref_date)
+    ref = days_since_epoch(ref_year, ref_month, ref_day, calendar) * 86400 + ref_seconds
+    return days_since_epoch(year, month, day, calendar) * 86400 + np.asarray(seconds, dtype=np.int64) - ref
+
+
+def date_value(date, units, calendar="standard"):
+    """
+    Return 'date' as a value of the time 'units' (e.g. "days since
+    2008-1-1") in 'calendar'.
+
+    Returns: float
+    """
+
+    m = units_re.match(units)
+    unit = m.group(1).lower() if m else ""
+    if not unit.endswith("s"):
+        unit += "s"
+    if unit not in unit_seconds:
+        raise ValueError("Cannot interpret time units {}".format(units))
+    seconds = seconds_since(*parse_date(date), ref_date=m.group(2), calendar=calendar)
+    return float(seconds) / unit_seconds[unit]
+
+
+def value_date(value, units, calendar="standard"):
+    """
+    Return the date of the time 'value' in 'units' (e.g. "seconds since
+    2008-1-1") in 'calendar', as "Y-M-D", or "Y-M-DTh:m:s" if it is not
+    at midnight; the inverse of date_value() (to the second).
+
+    Returns: string
+    """
+
+    m = units_re.match(units)
+    unit = m.group(1).lower() if m else ""
+    if not unit.endswith("s"):
+        unit += "s"
+    if unit not in unit_seconds:
+        raise ValueError("Cannot interpret time units {}".format(units))
+    ref_year, ref_month, ref_day, ref_seconds = parse_date(m.group(2))
+    seconds = int(round(value * unit_seconds[unit])) + ref_seconds
+    days, seconds = divmod(seconds, 86400)
+    year, month, day = epoch_date(days_since_epoch(ref_year, ref_month, ref_day, calendar) + days, calendar)
+    date = "{}-{}-{}".format(int(year), int(month), int(day))
+    if seconds:
+        date += "T{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return date
+
+
+def time_bounds(
+    start_date,
+    end_date=None,
+    periodicity="yearly",
+    interval=1,
+    count=None,
+    ref_date="2008-1-1",
+    ref_unit="days",
+    calendar="standard",
+):
+    """
+    Return the boundaries of periods of 'periodicity' (every 'interval'
+    periods) starting at 'start_date', in 'ref_unit' since 'ref_date'.
+    Boundaries are generated up to and including 'end_date', or 'count'
+    boundaries are generated. Like dateutil.rrule, monthly and longer
+    periods keep the day of the month of 'start_date'; start dates that
+    do not exist in every month are refused.
+
+    Returns: numpy array
+    """
+
+    if (end_date is None) == (count is None):
+        raise ValueError("Give either end_date or count")
+
+    periodicity = periodicity.lower()
+    year, month, day, seconds = parse_date(start_date)
+    check_date(year, month, day, calendar)
+
+    if end_date is not None:
+        end = seconds_since(*parse_date(end_date), ref_date=ref_date, calendar=calendar)
+
+    if periodicity in fixed_periods:
+        step = fixed_periods[periodicity] * interval
+        start = seconds_since(year, month, day, seconds, ref_date, calendar)
+        if count is None:
+            count = max(int((end - start) // step) + 1, 0)
+        bounds = start + step * np.arange(count, dtype=np.int64)
+    elif periodicity in calendar_periods:
+        if day > 28 and calendar != "360_day":
+            raise ValueError("Start dates after the 28th are not supported with periodicity {}".format(periodicity))
+        step = calendar_periods[periodicity] * interval
+        if count is None:
+            end_year, end_month = parse_date(end_date)[:2]
+            count = max((end_year * 12 + end_month - year * 12 - month) // step + 2, 0)
+        months = year * 12 + (month - 1) + step * np.arange(count, dtype=np.int64)
+        bounds = seconds_since(months // 12, months % 12 + 1, day, seconds, ref_date, calendar)
+    else:
+        raise ValueError(
+            "Periodicity {} is not supported. Pick one of {}".format(
+                periodicity, sorted(list(fixed_periods) + list(calendar_periods))
+            )
+        )
+
+    if end_date is not None:
+        bounds = bounds[bounds <= end]
+
+    return bounds / float(unit_seconds[ref_unit])
+
+
+def time_values(bounds, interval_type="mid"):
+    """
+    Return the time of each period given its 'bounds': the mid-point,
+    the start or the end.
+
+    Returns: numpy array
+    """
+
+    if interval_type == "mid":
+        return bounds[:-1] + np.diff(bounds) / 2
+    elif interval_type == "start":
+        return bounds[:-1]
+    elif interval_type == "end":
+        return bounds[1:]
+    else:
+        raise ValueError("interval_type must be one of mid, start and end, got {}".format(interval_type))
+
+
+def write_timeline(
+    nc, bounds, time_units, calendar="standard", interval_type="mid", with_bounds=True, bounds_name="time_bnds"
+):
+    """
+    Write the time variable (and the time bounds 'bounds_name' if
+    'with_bounds' is True) for 'bounds' into the open netCDF dataset
+    'nc', creating dimensions and variables that do not exist.
+    """
+
+    time_dim = "time"
+    if time_dim not in nc.dimensions:
+        nc.createDimension(time_dim)
+
+    if "time" not in nc.variables:
+        time_var = nc.createVariable("time", "d", dimensions=(time_dim,))
+    else:
+        time_var = nc.variables["time"]
+    time_var[:] = time_values(bounds, interval_type)
+    time_var.units = time_units
+    time_var.calendar = calendar
+    time_var.standard_name = "time"
+    time_var.axis = "T"
+
+    if with_bounds:
+        bnds_dim = "nb2"
+        if bnds_dim not in nc.dimensions:
+            nc.createDimension(bnds_dim, 2)
+        if bounds_name not in nc.variables:
+            time_bnds_var = nc.createVariable(bounds_name, "d", dimensions=(time_dim, bnds_dim))
+        else:
+            time_bnds_var = nc.variables[bounds_name]
+        time_bnds_var[:, :] = np.column_stack([bounds[:-1], bounds[1:]])
+        time_var.bounds = bounds_name
+    elif "bounds" in time_var.ncattrs():
+        time_var.delncattr("bounds")
+
+
+def create_timeline(
+    filename,
+    start_date,
+    end_date,
+    periodicity="yearly",
+    ref_date="2008-1-1",
+    ref_unit="days",
+    calendar="standard",
+    interval_type="mid",
+):
+    """
+    Write a time file with time and time_bnds for the periods from
+    'start_date' to 'end_date' (what create_timeline.py writes).
+
+    Returns: string
+    """
+
+    if NC is None:
+        raise ImportError("netCDF4 is required to write time files")
+
+    bounds = time_bounds(
+        start_date, end_date, periodicity=periodicity, ref_date=ref_date, ref_unit=ref_unit, calendar=calendar
+    )
+    nc = NC(filename, "w")
+    try:
+        write_timeline(nc, bounds, "{} since {}".format(ref_unit, ref_date), calendar, interval_type=interval_type)
+    finally:
+        nc.close()
+    return filename
+
+
+def adjust_timeline(
+    filename,
+    start_date="2008-1-1",
+    interval=1,
+    interval_type="mid",
+    bounds=True,
+    periodicity="yearly",
+    ref_date="2008-1-1",
+    ref_unit="days",
+    calendar="standard",
+):
+    """
+    Rewrite the time axis of 'filename' in place: one period of
+    'interval' 'periodicity' per record, starting at 'start_date'.
+    """
+
+    if NC is None:
+        raise ImportError("netCDF4 is required to adjust time axes")
+
+    nc = NC(filename, "a")
+    try:
+        nt = len(nc.variables["time"])
+        bnds = time_bounds(
+            start_date,
+            periodicity=periodicity,
+            interval=interval,
+            count=nt + 1,
+            ref_date=ref_date,
+            ref_unit=ref_unit,
+            calendar=calendar,
+        )
+        write_timeline(
+            nc,
+            bnds,
+            "{} since {}".format(ref_unit, ref_date),
+            calendar,
+            interval_type=interval_type,
+            with_bounds=bounds,
+        )
+    finally:
+        nc.close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.description = "Create a time file with time and time bounds."
+    parser.add_argument("FILE", nargs=1, help="output file")
+    parser.add_argument("-a", "--start_date", dest="start_date", default="2015-1-1")
+    parser.add_argument("-e", "--end_date", dest="end_date", default="2019-1-1")
+    parser.add_argument(
+        "-p",
+        "--periodicity",
+        dest="periodicity",
+        choices=sorted(list(fixed_periods) + list(calendar_periods)),
+        default="yearly",
+    )
+    parser.add_argument("-d", "--ref_date", dest="ref_date", default="2015-1-1")
+    parser.add_argument("-u", "--ref_unit", dest="ref_unit", choices=sorted(unit_seconds), default="days")
+    parser.add_argument("-c", "--calendar", dest="calendar", default="standard")
+    parser.add_argument("-i", "--interval_type", dest="interval_type", choices=["start", "mid", "end"], default="mid")
+    options = parser.parse_args()
+
+    create_timeline(
+        options.FILE[0],
+        options.start_date,
+        options.end_date,
+        periodicity=options.periodicity,
+        ref_date=options.ref_date,
+        ref_unit=options.ref_unit,
+        calendar=options.calendar,
+        interval_type=options.interval_type,
+    )